@@ -0,0 +1 @@
+# s3pub benchmarks
@@ -0,0 +1,496 @@
+'''
+In-process stand-ins for the S3 and CloudFront APIs used by s3pub.
+
+Each server runs on a background thread on a free localhost port, and hands
+out boto connections pointed at itself.  Only the requests s3pub makes are
+implemented, and authentication is ignored.
+
+Latency, bandwidth and throttling can be injected to approximate a real
+endpoint:
+
+* 'latency' seconds are slept before answering each request
+* 'bandwidth' caps request and response bodies to that many bytes/second per
+  connection
+* 'throttle' is the fraction of requests rejected with 503 SlowDown
+'''
+
+from __future__ import absolute_import, division
+
+import bisect
+import email.utils
+import hashlib
+import itertools
+import random
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from xml.sax.saxutils import escape
+
+import boto.cloudfront
+import boto.s3.connection
+from six.moves import BaseHTTPServer, http_client, socketserver
+from six.moves.urllib.parse import parse_qsl, unquote, urlsplit
+
+S3_NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+CHUNK = 64 * 1024
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Dispatches requests to the owning fake's 'handle' method.
+    '''
+    protocol_version = 'HTTP/1.1'
+    # headers and bodies are written separately; don't let Nagle's algorithm
+    # hold back the second write waiting for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *_):
+        pass
+
+    def _dispatch(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        body = self._read_body(fake.bandwidth)
+        fake.requests += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.throttle and fake.random.random() < fake.throttle:
+            fake.throttled += 1
+            status, headers, payload = _error(
+                503, 'SlowDown', 'Please reduce your request rate.')
+        else:
+            status, headers, payload = fake.handle(
+                self.command, unquote(url.path), query, self.headers, body)
+        self._respond(status, headers, payload, fake.bandwidth)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _dispatch
+
+    def _read_body(self, bandwidth):
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        while length:
+            chunk = self.rfile.read(min(length, CHUNK))
+            if not chunk:
+                break
+            length -= len(chunk)
+            chunks.append(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+        return b''.join(chunks)
+
+    def _respond(self, status, headers, payload, bandwidth):
+        if isinstance(payload, type(u'')):
+            payload = payload.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if not any(name.lower() == 'content-length' for name, _ in headers):
+            self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for idx in range(0, len(payload), CHUNK):
+            self.wfile.write(payload[idx:idx + CHUNK])
+            if bandwidth:
+                time.sleep(min(CHUNK, len(payload) - idx) / bandwidth)
+
+def _xml(text):
+    return [('Content-Type', 'application/xml')], \
+        '<?xml version="1.0" encoding="UTF-8"?>\n' + text
+
+def _error(status, code, message):
+    headers, body = _xml(
+        '<Error><Code>{}</Code><Message>{}</Message></Error>'.format(
+            code, escape(message)))
+    return status, headers, body
+
+class _Fake(object):
+    '''
+    Common lifecycle for the fake endpoints.
+    '''
+    def __init__(self, latency=0.0, bandwidth=None, throttle=0.0, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle = throttle
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.fake = self
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+class _Object(object):
+    def __init__(self, data, headers):
+        self.data = data
+        self.size = len(data)
+        self.etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+        self.headers = headers
+        self.modified = time.time()
+
+class FakeS3(_Fake):
+    '''
+    A path-style S3 endpoint holding buckets in memory.
+
+    If 'keep_data' is False, object bodies are discarded after hashing, so
+    large benchmark trees don't have to fit in memory; GETs then return
+    zero bytes.  It may also be a function of the key name, returning True
+    for the objects whose bodies should be kept.
+    '''
+    PAGE_SIZE = 1000
+
+    def __init__(self, keep_data=True, **kwargs):
+        super(FakeS3, self).__init__(**kwargs)
+        self.keep_data = keep_data
+        self.buckets = {}
+        self.websites = {}
+        # website configurations stored with PUT ?website, as sent
+        self.website_xml = {}
+        self._sorted = {}
+
+    def create_bucket(self, name, index_doc=None):
+        '''
+        Create an empty bucket, optionally configured as a website.
+        '''
+        self.buckets[name] = {}
+        self._sorted[name] = []
+        if index_doc:
+            self.websites[name] = index_doc
+        return self
+
+    def connect(self):
+        '''
+        Return a boto S3Connection talking to this server.
+        '''
+        return boto.s3.connection.S3Connection(
+            aws_access_key_id='fake',
+            aws_secret_access_key='fake',
+            host='127.0.0.1',
+            port=self.port,
+            is_secure=False,
+            calling_format=boto.s3.connection.OrdinaryCallingFormat(),
+        )
+
+    def put(self, bucket, key, data, headers=()):
+        '''
+        Store an object directly, bypassing HTTP.
+        '''
+        obj = _Object(data, list(headers))
+        keep = self.keep_data
+        if not (keep(key) if callable(keep) else keep):
+            obj.data = b''
+        with self.lock:
+            if key not in self.buckets[bucket]:
+                bisect.insort(self._sorted[bucket], key)
+            self.buckets[bucket][key] = obj
+        return obj
+
+    def copy(self, bucket, key, src_bucket, src_key):
+        '''
+        Copy an object, metadata included, as a PUT with x-amz-copy-source
+        does; return the copy, or None if the source doesn't exist.
+        '''
+        with self.lock:
+            src = self.buckets.get(src_bucket, {}).get(src_key)
+            if src is None:
+                return None
+            obj = _Object(b'', src.headers)
+            obj.data, obj.size, obj.etag = src.data, src.size, src.etag
+            if key not in self.buckets[bucket]:
+                bisect.insort(self._sorted[bucket], key)
+            self.buckets[bucket][key] = obj
+        return obj
+
+    def delete(self, bucket, key):
+        with self.lock:
+            if self.buckets[bucket].pop(key, None) is not None:
+                keys = self._sorted[bucket]
+                del keys[bisect.bisect_left(keys, key)]
+
+    def handle(self, method, path, query, headers, body):
+        bucket, _, key = path.lstrip('/').partition('/')
+        if bucket not in self.buckets:
+            return _error(404, 'NoSuchBucket', bucket)
+        if not key:
+            return self._bucket_op(method, bucket, query, body)
+        return self._object_op(method, bucket, key, headers, body)
+
+    def _bucket_op(self, method, bucket, query, body):
+        if 'website' in query:
+            if method == 'PUT':
+                self.website_xml[bucket] = body
+                return 200, [], b''
+            return self._website(bucket)
+        if method == 'POST' and 'delete' in query:
+            return self._delete_keys(bucket, body)
+        if method in ('GET', 'HEAD'):
+            return self._list(bucket, query)
+        return _error(501, 'NotImplemented', method)
+
+    def _website(self, bucket):
+        if bucket in self.website_xml:
+            return 200, [('Content-Type', 'application/xml')], \
+                self.website_xml[bucket]
+        index_doc = self.websites.get(bucket)
+        if not index_doc:
+            return _error(
+                404, 'NoSuchWebsiteConfiguration',
+                'The specified bucket does not have a website configuration')
+        headers, body = _xml(
+            '<WebsiteConfiguration xmlns="{}"><IndexDocument><Suffix>{}'
+            '</Suffix></IndexDocument></WebsiteConfiguration>'.format(
+                S3_NS, escape(index_doc)))
+        return 200, headers, body
+
+    def _list(self, bucket, query):
+        if query.get('delimiter'):
+            return self._list_grouped(bucket, query)
+        prefix = query.get('prefix', '')
+        marker = query.get('marker', '')
+        max_keys = min(int(query.get('max-keys', self.PAGE_SIZE)),
+            self.PAGE_SIZE)
+        with self.lock:
+            keys = self._sorted[bucket]
+            start = max(
+                bisect.bisect_right(keys, marker),
+                bisect.bisect_left(keys, prefix))
+            page = list(itertools.islice(
+                itertools.takewhile(
+                    lambda k: k.startswith(prefix),
+                    (keys[i] for i in range(start, len(keys)))),
+                max_keys + 1))
+            objs = self.buckets[bucket]
+            contents = [
+                '<Contents><Key>{}</Key><LastModified>{}</LastModified>'
+                '<ETag>{}</ETag><Size>{}</Size>'
+                '<StorageClass>STANDARD</StorageClass></Contents>'.format(
+                    escape(key),
+                    time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                        time.gmtime(objs[key].modified)),
+                    escape(objs[key].etag),
+                    objs[key].size)
+                for key in page[:max_keys]]
+        truncated = len(page) > max_keys
+        headers, body = _xml(
+            '<ListBucketResult xmlns="{}"><Name>{}</Name><Prefix>{}</Prefix>'
+            '<Marker>{}</Marker><MaxKeys>{}</MaxKeys>'
+            '<IsTruncated>{}</IsTruncated>{}</ListBucketResult>'.format(
+                S3_NS, bucket, escape(prefix), escape(marker), max_keys,
+                truncated and 'true' or 'false', ''.join(contents)))
+        return 200, headers, body
+
+    def _list_grouped(self, bucket, query):
+        '''
+        List keys with a delimiter, in a single page.
+        '''
+        prefix = query.get('prefix', '')
+        delimiter = query['delimiter']
+        with self.lock:
+            names = [key for key in self._sorted[bucket]
+                if key.startswith(prefix)]
+            objs = self.buckets[bucket]
+            contents = []
+            groups = []
+            for key in names:
+                rest = key[len(prefix):]
+                if delimiter in rest:
+                    group = prefix + rest.split(delimiter, 1)[0] + delimiter
+                    if not groups or groups[-1] != group:
+                        groups.append(group)
+                    continue
+                contents.append(
+                    '<Contents><Key>{}</Key><ETag>{}</ETag><Size>{}</Size>'
+                    '</Contents>'.format(
+                        escape(key), escape(objs[key].etag), objs[key].size))
+        headers, body = _xml(
+            '<ListBucketResult xmlns="{}"><Name>{}</Name><Prefix>{}</Prefix>'
+            '<Delimiter>{}</Delimiter><IsTruncated>false</IsTruncated>{}{}'
+            '</ListBucketResult>'.format(
+                S3_NS, bucket, escape(prefix), escape(delimiter),
+                ''.join(contents), ''.join(
+                    '<CommonPrefixes><Prefix>{}</Prefix></CommonPrefixes>'
+                    .format(escape(group)) for group in groups)))
+        return 200, headers, body
+
+    def _delete_keys(self, bucket, body):
+        deleted = []
+        for elem in ElementTree.fromstring(body).iter():
+            if elem.tag.split('}')[-1] == 'Key':
+                self.delete(bucket, elem.text)
+                deleted.append(elem.text)
+        headers, body = _xml('<DeleteResult xmlns="{}">{}</DeleteResult>'.format(
+            S3_NS, ''.join(
+                '<Deleted><Key>{}</Key></Deleted>'.format(escape(key))
+                for key in deleted)))
+        return 200, headers, body
+
+    def _object_op(self, method, bucket, key, headers, body):
+        if method == 'PUT' and headers.get('x-amz-copy-source'):
+            src_bucket, _, src_key = unquote(
+                headers['x-amz-copy-source']).lstrip('/').partition('/')
+            obj = self.copy(bucket, key, src_bucket, src_key)
+            if obj is None:
+                return _error(404, 'NoSuchKey', src_key)
+            headers, body = _xml(
+                '<CopyObjectResult><LastModified>{}</LastModified>'
+                '<ETag>{}</ETag></CopyObjectResult>'.format(
+                    time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                        time.gmtime(obj.modified)),
+                    escape(obj.etag)))
+            return 200, headers, body
+        if method == 'PUT':
+            stored = [(name, value) for name, value in headers.items()
+                if name.lower() in ('content-type', 'cache-control',
+                    'content-encoding', 'content-disposition')]
+            obj = self.put(bucket, key, body, stored)
+            return 200, [('ETag', obj.etag)], b''
+        if method == 'DELETE':
+            self.delete(bucket, key)
+            return 204, [], b''
+        obj = self.buckets[bucket].get(key)
+        if obj is None:
+            return _error(404, 'NoSuchKey', key)
+        headers = [
+            ('ETag', obj.etag),
+            ('Last-Modified', email.utils.formatdate(obj.modified, usegmt=True)),
+            ('Content-Length', str(len(obj.data) if method == 'GET'
+                else obj.size)),
+        ] + obj.headers
+        return 200, headers, obj.data
+
+class FakeCloudFront(_Fake):
+    '''
+    A CloudFront endpoint that completes invalidations after a delay.
+
+    At most 'max_in_progress' invalidations may be in progress per
+    distribution; more are rejected with TooManyInvalidationsInProgress.
+    '''
+    def __init__(self, invalidation_time=0.0, max_in_progress=3, **kwargs):
+        super(FakeCloudFront, self).__init__(**kwargs)
+        self.invalidation_time = invalidation_time
+        self.max_in_progress = max_in_progress
+        self.distributions = {}
+        self._ids = itertools.count(1)
+
+    def create_distribution(self, distrib_id, bucket='bucket'):
+        self.distributions[distrib_id] = {'origin': bucket, 'invalidations': []}
+        return self
+
+    def connect(self):
+        '''
+        Return a boto CloudFrontConnection talking to this server.
+
+        boto always uses HTTPS for CloudFront; we substitute a plain HTTP
+        connection for its HTTPS one.  boto strips the port from the host it
+        passes to the factory, so the factory supplies it.
+        '''
+        def factory(host, **kwargs):
+            return http_client.HTTPConnection(
+                host, self.port, timeout=kwargs.get('timeout'))
+        return boto.cloudfront.CloudFrontConnection(
+            aws_access_key_id='fake',
+            aws_secret_access_key='fake',
+            host='127.0.0.1',
+            port=self.port,
+            https_connection_factory=(factory, ()),
+        )
+
+    def invalidations(self, distrib_id):
+        '''
+        Return a list of (id, paths, status) for a distribution.
+        '''
+        return [(inval['id'], inval['paths'], self._status(inval))
+            for inval in self.distributions[distrib_id]['invalidations']]
+
+    def _status(self, inval):
+        if time.time() - inval['created'] >= self.invalidation_time:
+            return 'Completed'
+        return 'InProgress'
+
+    def handle(self, method, path, query, headers, body):
+        parts = path.strip('/').split('/')[1:]
+        if parts == ['distribution'] and method == 'GET':
+            return self._list_distributions()
+        if len(parts) < 3 or parts[0] != 'distribution' or \
+                parts[1] not in self.distributions or \
+                parts[2] != 'invalidation':
+            return _error(404, 'NoSuchResource', path)
+        distrib = self.distributions[parts[1]]
+        if len(parts) == 4:
+            for inval in distrib['invalidations']:
+                if inval['id'] == parts[3]:
+                    return self._invalidation(inval, 200)
+            return _error(404, 'NoSuchInvalidation', parts[3])
+        if method == 'POST':
+            return self._create_invalidation(distrib, body)
+        return self._list_invalidations(distrib)
+
+    def _list_distributions(self):
+        headers, body = _xml('<DistributionList><IsTruncated>false'
+            '</IsTruncated>{}</DistributionList>'.format(''.join(
+                '<DistributionSummary><Id>{0}</Id><Status>Deployed</Status>'
+                '<DomainName>{0}.cloudfront.net</DomainName><S3Origin>'
+                '<DNSName>{1}.s3.amazonaws.com</DNSName></S3Origin>'
+                '<Enabled>true</Enabled></DistributionSummary>'.format(
+                    distrib_id, distrib['origin'])
+                for distrib_id, distrib in sorted(
+                    self.distributions.items()))))
+        return 200, headers, body
+
+    def _create_invalidation(self, distrib, body):
+        with self.lock:
+            in_progress = [i for i in distrib['invalidations']
+                if self._status(i) == 'InProgress']
+            if len(in_progress) >= self.max_in_progress:
+                return _error(400, 'TooManyInvalidationsInProgress',
+                    'Too many invalidations in progress.')
+            paths = [unquote(elem.text)
+                for elem in ElementTree.fromstring(body).iter()
+                if elem.tag.split('}')[-1] == 'Path']
+            inval = {
+                'id': 'I{:05}'.format(next(self._ids)),
+                'paths': paths,
+                'created': time.time(),
+            }
+            distrib['invalidations'].append(inval)
+        return self._invalidation(inval, 201)
+
+    def _invalidation(self, inval, status):
+        headers, body = _xml(
+            '<Invalidation><Id>{}</Id><Status>{}</Status>'
+            '<InvalidationBatch>{}<CallerReference>s3pub</CallerReference>'
+            '</InvalidationBatch></Invalidation>'.format(
+                inval['id'], self._status(inval), ''.join(
+                    '<Path>{}</Path>'.format(escape(path))
+                    for path in inval['paths'])))
+        return status, headers, body
+
+    def _list_invalidations(self, distrib):
+        headers, body = _xml(
+            '<InvalidationList><IsTruncated>false</IsTruncated>'
+            '<MaxItems>100</MaxItems>{}</InvalidationList>'.format(''.join(
+                '<InvalidationSummary><Id>{}</Id><Status>{}</Status>'
+                '</InvalidationSummary>'.format(i['id'], self._status(i))
+                for i in reversed(distrib['invalidations']))))
+        return 200, headers, body
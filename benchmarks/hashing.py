@@ -0,0 +1,121 @@
+'''
+Measure the throughput of the fingerprint algorithms against MD5.
+
+Usage:
+
+    python -m benchmarks.hashing [--scale N]
+
+Each available algorithm reads the same tiny-file and huge-file trees from
+the page cache.  The 'checkout' steps time a HashCache loaded from disk after
+every modification time changed, as after a fresh checkout, with and without
+a fingerprint to check before computing MD5s again.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import s3pub.fingerprint
+import s3pub.hashcache
+import s3pub.upload
+
+from benchmarks import trees
+
+# name -> (tree generator, generator kwargs at scale 1)
+TREES = {
+    'tiny': (trees.tiny_files, {'count': 5000}),
+    'huge': (trees.huge_files, {'count': 3}),
+}
+
+def _files(root):
+    return [lpath for lpath, _ in s3pub.upload._walk(root, '')]
+
+def _throughput(files, func):
+    '''
+    Return (seconds, bytes) for calling 'func' on every file, best of three.
+    '''
+    size = sum(os.path.getsize(lpath) for lpath in files)
+    best = None
+    for _ in range(3):
+        start = time.time()
+        for lpath in files:
+            func(lpath)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+def _step(seconds, size, **extra):
+    result = {
+        'seconds': seconds,
+        'mb_per_second': seconds and size / seconds / 1e6 or None,
+    }
+    result.update(extra)
+    return result
+
+def _checkout(files, algorithm, cache_path):
+    '''
+    Return the seconds taken to look up every file in a saved HashCache after
+    their modification times changed.
+    '''
+    cache = s3pub.hashcache.HashCache(cache_path, algorithm)
+    for lpath in files:
+        cache.md5(lpath)
+    cache.save()
+    now = time.time()
+    for idx, lpath in enumerate(files):
+        os.utime(lpath, (now + idx, now + idx))
+    cache = s3pub.hashcache.HashCache(cache_path, algorithm)
+    cache.load()
+    start = time.time()
+    for lpath in files:
+        cache.md5(lpath)
+    return time.time() - start
+
+def measure(scale=1.0):
+    '''
+    Return hashing results in the same shape as benchmark scenario steps.
+    '''
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix='s3pub-bench-')
+    try:
+        for name, (generator, kwargs) in sorted(TREES.items()):
+            root = os.path.join(tmpdir, name)
+            kwargs = dict(kwargs, count=max(1, int(kwargs['count'] * scale)))
+            generator(root, **kwargs)
+            files = _files(root)
+            seconds, size = _throughput(
+                files, lambda lpath: s3pub.fingerprint.md5_and_fingerprint(
+                    lpath, 'md5'))
+            results[name + '_md5'] = _step(seconds, size)
+            for algorithm in s3pub.fingerprint.available():
+                if algorithm == 'md5':
+                    continue
+                seconds, size = _throughput(
+                    files, lambda lpath: s3pub.fingerprint.fingerprint(
+                        lpath, algorithm))
+                results[name + '_' + algorithm] = _step(seconds, size)
+            cache_path = os.path.join(tmpdir, 'hashes.json')
+            for algorithm in [s3pub.fingerprint.default(), 'md5']:
+                results['{}_checkout_{}'.format(name, algorithm)] = _step(
+                    _checkout(files, algorithm, cache_path), size)
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+        help='Multiply file counts by this factor (default: %(default)s)')
+    args = parser.parse_args(argv)
+    for step, result in sorted(measure(args.scale).items()):
+        print('{:24} {:8.3f}s {:10.1f} MB/s'.format(
+            step, result['seconds'], result['mb_per_second'] or 0))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
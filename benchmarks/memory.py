@@ -0,0 +1,149 @@
+'''
+Measure peak memory use when comparing very large trees with S3.
+
+Usage:
+
+    python -m benchmarks.memory [--entries N ...] [--mode MODE ...]
+
+Each run compares N synthetic local files with a listing of N synthetic keys,
+one in a thousand of which differ, plus N / 1000 keys that no longer exist
+locally, in a child process of its own, and reports the child's peak RSS.
+'memory' is a normal publish (s3pub.upload._todos); 'lowmem' is the on-disk
+comparison used by --low-memory (s3pub.lowmem.Index).  No files are read and
+no requests are made: digests are derived from file names, and the bucket
+only lists keys.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import hashlib
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import s3pub.lowmem
+import s3pub.upload
+import s3pub.workers
+
+MODES = ('memory', 'lowmem')
+DEFAULT_ENTRIES = (1000000, 5000000)
+PREFIX = 'www'
+# one local file in this many differs from its key
+CHANGED_EVERY = 1000
+
+def _name(idx):
+    return 'd{:04}/f{:08}.html'.format(idx // 1000, idx)
+
+def _md5(lpath):
+    return hashlib.md5(lpath.encode('utf-8')).hexdigest()
+
+class _Hashes(object):
+    '''
+    Digests derived from file names, standing in for a HashCache.
+    '''
+    def md5(self, lpath):
+        return _md5(lpath), '', 1024
+
+class _Key(object):
+    __slots__ = ('name', 'etag', 'size')
+
+    def __init__(self, name, etag, size):
+        self.name = name
+        self.etag = etag
+        self.size = size
+
+class _Bucket(object):
+    '''
+    A bucket holding 'entries' keys matching the synthetic tree, and some
+    that don't.
+    '''
+    def __init__(self, entries):
+        self.entries = entries
+
+    def list(self, prefix):
+        for idx in range(self.entries + self.entries // CHANGED_EVERY):
+            lpath = '/src/' + _name(idx)
+            etag = idx % CHANGED_EVERY and _md5(lpath) or 'stale'
+            yield _Key(
+                prefix + '/' + _name(idx), '"{}"'.format(etag), 1024)
+
+def _paths(entries):
+    for idx in range(entries):
+        yield '/src/' + _name(idx), PREFIX + '/' + _name(idx)
+
+def _peak_kib():
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return sys.platform == 'darwin' and peak // 1024 or peak
+
+def compare(mode, entries):
+    '''
+    Run one comparison in this process; return (uploads, deletions).
+    '''
+    bucket = _Bucket(entries)
+    hashes = _Hashes()
+    if mode == 'memory':
+        # as do_upload does: walk, list, then diff
+        paths = list(_paths(entries))
+        remote = s3pub.upload._list(bucket, PREFIX)
+        up, delete = s3pub.upload._todos(
+            bucket, PREFIX, paths, True, hashes=hashes, remote=remote)
+        return len(up), len(delete)
+
+    pool = s3pub.workers.WorkerPool()
+    with s3pub.lowmem.Index() as index:
+        index.add_local(_paths(entries))
+        index.add_remote(
+            (key.name, key.etag.strip('"'), key.size)
+            for key in bucket.list(PREFIX))
+        files, _ = index.diff(pool, hashes)
+        deletions = sum(len(keys) for keys in index.deletions())
+        assert sum(1 for _ in index.uploads()) == files
+    return files, deletions
+
+def measure(mode, entries):
+    '''
+    Return the results of one comparison, run in a child process.
+    '''
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.memory', '--child',
+        '--mode', mode, '--entries', str(entries)])
+    return json.loads(output.decode('utf-8'))
+
+def _child(mode, entries):
+    start = time.time()
+    uploads, deletions = compare(mode, entries)
+    json.dump({
+        'mode': mode,
+        'entries': entries,
+        'uploads': uploads,
+        'deletions': deletions,
+        'seconds': time.time() - start,
+        'peak_rss_mib': _peak_kib() / 1024,
+    }, sys.stdout)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--entries', type=int, action='append',
+        help='Number of files and keys; may be repeated (default: {})'.format(
+            ', '.join(str(entries) for entries in DEFAULT_ENTRIES)))
+    parser.add_argument('--mode', action='append', choices=MODES,
+        help='Comparison to run; may be repeated (default: all)')
+    parser.add_argument('--child', action='store_true',
+        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        _child(args.mode[0], args.entries[0])
+        return 0
+    for entries in args.entries or DEFAULT_ENTRIES:
+        for mode in args.mode or MODES:
+            result = measure(mode, entries)
+            print('{:>9} entries {:8} {:8.1f}s {:8.1f} MiB peak RSS'.format(
+                entries, mode, result['seconds'], result['peak_rss_mib']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+'''
+Time s3pub end to end against local S3 and CloudFront stand-ins.
+
+Usage:
+
+    python -m benchmarks.run [--output results.json] [--compare old.json]
+
+Each scenario generates a synthetic tree, then times an initial publish, a
+republish with no changes, a republish after touching 1% of the files, and
+the invalidation of the touched keys.  The 'startup' results time importing
+the command-line module and running 's3pub --help', and the 'hashing' results
+the throughput of each fingerprint algorithm (see benchmarks.hashing).
+
+Results are written as JSON; when '--compare' is given, timings are compared
+against an earlier results file and the exit status is non-zero if any step
+regressed beyond '--threshold'.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from six import iteritems
+
+import s3pub.invalidate
+import s3pub.manifest
+import s3pub.metrics
+import s3pub.upload
+import s3pub.workers
+
+from benchmarks import fakeaws, hashing, startup, trees
+
+BUCKET = 'bench'
+DISTRIB_ID = 'EBENCH'
+
+# name -> (tree generator, generator kwargs at scale 1)
+SCENARIOS = {
+    'tiny': (trees.tiny_files, {'count': 5000}),
+    'huge': (trees.huge_files, {'count': 3}),
+    'deep': (trees.deep_tree, {'depth': 7}),
+    'mixed': (trees.mixed_sizes, {'count': 400}),
+    'skewed': (trees.skewed_sizes, {'count': 400}),
+}
+
+def _scaled(kwargs, scale):
+    return dict((name, max(1, int(val * scale)) if name == 'count' else val)
+        for name, val in iteritems(kwargs))
+
+def _timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+def run_scenario(name, args):
+    '''
+    Run every step of a scenario; return a dict of results.
+    '''
+    generator, kwargs = SCENARIOS[name]
+    tmpdir = tempfile.mkdtemp(prefix='s3pub-bench-')
+    src = os.path.join(tmpdir, 'site')
+    results = {}
+    try:
+        generator(src, **_scaled(kwargs, args.scale))
+        fake_kwargs = dict(
+            latency=args.latency, bandwidth=args.bandwidth,
+            throttle=args.throttle)
+        s3 = fakeaws.FakeS3(
+            keep_data=lambda key: key.endswith(s3pub.manifest.NAME),
+            **fake_kwargs)
+        cf = fakeaws.FakeCloudFront(**fake_kwargs)
+        with s3, cf:
+            s3.create_bucket(BUCKET, index_doc='index.html')
+            cf.create_distribution(DISTRIB_ID, BUCKET)
+            pool = s3pub.workers.WorkerPool(args.workers)
+
+            def publish(step):
+                metrics = s3pub.metrics.Metrics()
+                requests = s3.requests
+                elapsed, keys = _timed(
+                    s3pub.upload.do_upload, src, BUCKET + '/site', True, None,
+                    metrics, pool, s3.connect())
+                results[step] = {
+                    'seconds': elapsed,
+                    'requests': s3.requests - requests,
+                    'keys': len(keys),
+                    'metrics': metrics.summary(),
+                }
+                return keys
+
+            publish('initial')
+            publish('noop')
+            trees.touch(src, 0.01)
+            keys = publish('incremental')
+
+            metrics = s3pub.metrics.Metrics()
+            elapsed, _ = _timed(
+                s3pub.invalidate.do_invalidate, DISTRIB_ID, keys, None,
+                metrics, cf.connect())
+            results['invalidate'] = {
+                'seconds': elapsed,
+                'metrics': metrics.summary(),
+            }
+            pool.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+def compare(old, new, threshold):
+    '''
+    Print per-step timing ratios; return the list of regressed steps.
+    '''
+    regressions = []
+    for scenario, steps in sorted(iteritems(new['scenarios'])):
+        for step, result in sorted(iteritems(steps)):
+            try:
+                old_result = old['scenarios'][scenario][step]
+                before = old_result['seconds']
+            except KeyError:
+                continue
+            # start-up steps list the heavy modules they load
+            loaded = set(result.get('heavy_modules') or ()) - \
+                set(old_result.get('heavy_modules') or ())
+            if loaded:
+                print('{:8} {:12} now imports {}  REGRESSION'.format(
+                    scenario, step, ', '.join(sorted(loaded))))
+                regressions.append((scenario, step))
+            if before is None or result['seconds'] is None:
+                continue
+            ratio = before and result['seconds'] / before or 1.0
+            flag = ''
+            if ratio > 1 + threshold:
+                flag = '  REGRESSION'
+                if not loaded:
+                    regressions.append((scenario, step))
+            print('{:8} {:12} {:8.3f}s -> {:8.3f}s  x{:.2f}{}'.format(
+                scenario, step, before, result['seconds'], ratio, flag))
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+        help='Scenario to run; may be repeated (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0,
+        help='Multiply file counts by this factor (default: %(default)s)')
+    parser.add_argument('--workers', type=int,
+        default=s3pub.workers.DEFAULT_WORKERS)
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='Seconds of latency injected into each request')
+    parser.add_argument('--bandwidth', type=float, default=None,
+        help='Bytes per second per connection')
+    parser.add_argument('--throttle', type=float, default=0.0,
+        help='Fraction of requests rejected with SlowDown')
+    parser.add_argument('-o', '--output', help='Write results JSON here')
+    parser.add_argument('--compare', help='Earlier results JSON to compare')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='Slowdown ratio treated as a regression (default: %(default)s)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'settings': {
+            'scale': args.scale,
+            'workers': args.workers,
+            'latency': args.latency,
+            'bandwidth': args.bandwidth,
+            'throttle': args.throttle,
+        },
+        'scenarios': {},
+    }
+    for name in args.scenario or sorted(SCENARIOS):
+        results['scenarios'][name] = run_scenario(name, args)
+    if not args.scenario:
+        results['scenarios']['startup'] = startup.measure()
+        results['scenarios']['hashing'] = hashing.measure(args.scale)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fp:
+            if compare(json.load(fp), results, args.threshold):
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
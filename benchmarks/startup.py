@@ -0,0 +1,79 @@
+'''
+Measure s3pub start-up cost.
+
+Uses 'python -X importtime' (Python 3.7+) to attribute import time to
+modules, and times 's3pub --help' as a whole.  Both list the heavy modules
+they load, which should be none.
+'''
+
+from __future__ import absolute_import, division, print_function
+
+import subprocess
+import sys
+import time
+
+# modules that should not be imported just to parse arguments
+HEAVY = ('boto', 'yaml', 'progressbar')
+
+def import_times(module='s3pub.cmdline', argv=None):
+    '''
+    Return a dict mapping module names to cumulative import time in seconds.
+
+    If 'argv' is given, the module is run with those arguments rather than
+    only imported.
+    '''
+    if argv is None:
+        command = ['-c', 'import ' + module]
+    else:
+        command = ['-m', module] + argv
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime'] + command,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    times = {}
+    for line in err.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1]) / 1e6
+    return times
+
+def _heavy(times):
+    return sorted(name for name in times if name.split('.')[0] in HEAVY)
+
+def time_help(runs=5):
+    '''
+    Return the best wall time, in seconds, of 's3pub --help' over 'runs'.
+    '''
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call(
+            [sys.executable, '-m', 's3pub.cmdline', '--help'],
+            stdout=subprocess.PIPE)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def measure():
+    '''
+    Return start-up results in the same shape as benchmark scenario steps.
+    '''
+    times = import_times()
+    help_times = import_times(argv=['--help'])
+    return {
+        'import_cmdline': {
+            'seconds': times.get('s3pub.cmdline'),
+            'heavy_modules': _heavy(times),
+        },
+        'help': {
+            'seconds': time_help(),
+            'heavy_modules': _heavy(help_times),
+        },
+    }
+
+if __name__ == '__main__':
+    for step, result in sorted(measure().items()):
+        print(step, result)
@@ -0,0 +1,93 @@
+'''
+Generators for synthetic content trees.
+
+Every generator writes deterministic content for a given seed, so repeated
+runs publish identical trees.
+'''
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import random
+
+def _write(path, size, rand):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as fp:
+        # repeat a random block; generating every byte is slow for big files
+        block = bytearray(rand.getrandbits(8) for _ in range(min(size, 4096)))
+        remaining = size
+        while remaining:
+            chunk = block[:remaining]
+            fp.write(chunk)
+            remaining -= len(chunk)
+    return size
+
+def tiny_files(root, count=5000, size=256, per_dir=500, seed=0):
+    '''
+    Many small files spread over a flat set of directories.
+    '''
+    rand = random.Random(seed)
+    for idx in range(count):
+        _write(os.path.join(root, 'd{:04}'.format(idx // per_dir),
+            'f{:06}.html'.format(idx)), size, rand)
+
+def huge_files(root, count=3, size=32 * 1024 * 1024, seed=0):
+    '''
+    A few large files.
+    '''
+    rand = random.Random(seed)
+    for idx in range(count):
+        _write(os.path.join(root, 'big{}.bin'.format(idx)), size, rand)
+
+def deep_tree(root, depth=8, fanout=3, size=1024, seed=0):
+    '''
+    A deep hierarchy with one file in every directory.
+    '''
+    rand = random.Random(seed)
+    def walk(path, level):
+        _write(os.path.join(path, 'index.html'), size, rand)
+        if level < depth:
+            for idx in range(fanout):
+                walk(os.path.join(path, 'd{}'.format(idx)), level + 1)
+    walk(root, 1)
+
+def mixed_sizes(root, count=400, seed=0):
+    '''
+    Mostly small files with a few large ones; a skewed size distribution.
+    '''
+    rand = random.Random(seed)
+    for idx in range(count):
+        size = int(rand.paretovariate(1.2) * 2048)
+        _write(os.path.join(root, 'f{:05}.dat'.format(idx)),
+            min(size, 32 * 1024 * 1024), rand)
+
+def skewed_sizes(root, count=400, size=16 * 1024, big_count=3,
+        big_size=16 * 1024 * 1024, seed=0):
+    '''
+    Many small pages and assets with a handful of much larger files mixed in.
+    '''
+    rand = random.Random(seed)
+    for idx in range(count):
+        ext = ('.html', '.css', '.js', '.png')[idx % 4]
+        _write(os.path.join(root, 'p{:02}'.format(idx % 20),
+            'f{:05}{}'.format(idx, ext)), size, rand)
+    for idx in range(big_count):
+        _write(os.path.join(root, 'p{:02}'.format(idx * 3),
+            'video{}.mp4'.format(idx)), big_size, rand)
+
+def touch(root, fraction=0.01, seed=1):
+    '''
+    Rewrite a fraction of the files under 'root'; return the paths changed.
+    '''
+    rand = random.Random(seed)
+    paths = sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(root) for name in names)
+    changed = rand.sample(paths, max(1, int(len(paths) * fraction)))
+    for path in changed:
+        with open(path, 'ab') as fp:
+            fp.write(b'!')
+    return changed
@@ -0,0 +1,272 @@
+'''
+Publishing straight from tar and zip archives, without extracting them.
+
+An archive is read once, in order.  Each file in it is hashed while it is
+copied into a SpooledTemporaryFile, which stays in memory up to SPOOL_MEMORY
+bytes and spills to disk beyond that, then compared with S3.  Changed files of
+the first phase (see s3pub.schedule) are uploaded while the archive is still
+being read, with only a few queued at once; those of later phases are
+appended to a single temporary file, and uploaded in order once the whole
+archive has been read.  Memory use is therefore bounded whatever the size of
+the archive, and tar streams that can only be read once, such as stdin, work
+too.
+'''
+
+from __future__ import absolute_import
+
+import collections
+import functools
+import hashlib
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import zipfile
+
+import boto.s3.key
+
+import s3pub.fingerprint
+import s3pub.manifest
+import s3pub.metrics
+import s3pub.progress
+import s3pub.retry
+import s3pub.schedule
+import s3pub.upload
+import s3pub.workers
+
+# a source of '-' reads a tar stream from stdin
+STDIN = '-'
+SUFFIXES = (
+    '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.zip')
+# bytes of each file kept in memory before spilling to disk
+SPOOL_MEMORY = 1024 * 1024
+# bytes copied at once
+CHUNK = 64 * 1024
+
+def is_archive(src):
+    '''
+    Return True if 'src' names an archive, or stdin, rather than a directory.
+    '''
+    return src == STDIN or src.lower().endswith(SUFFIXES)
+
+def _name(name):
+    '''
+    Return an archive member's path relative to the root of the archive.
+    '''
+    name = posixpath.normpath(name.replace('\\', '/'))
+    if name.startswith('/') or name == '..' or name.startswith('../'):
+        raise ValueError(u'path outside the archive: {}'.format(name))
+    return name
+
+def members(src, stdin=None):
+    '''
+    Yield (name, file object) for each regular file in an archive, in the
+    order they are stored; each file object can only be read until the next
+    is yielded.
+
+    Tar archives may be compressed with gzip, bzip2 or xz.  If 'src' is
+    STDIN, a tar stream is read from 'stdin', by default sys.stdin.
+    '''
+    if src.lower().endswith('.zip'):
+        with zipfile.ZipFile(src) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                with archive.open(info) as fp:
+                    yield _name(info.filename), fp
+        return
+
+    fileobj = None
+    if src == STDIN:
+        stdin = stdin or sys.stdin
+        fileobj = getattr(stdin, 'buffer', stdin)
+        src = None
+    # streaming mode, so the archive is never seeked
+    with tarfile.open(src, 'r|*', fileobj) as archive:
+        for info in archive:
+            # links and special files have no contents of their own
+            if info.isfile():
+                yield _name(info.name), archive.extractfile(info)
+
+def _spool(fp):
+    '''
+    Copy a file object into a SpooledTemporaryFile; return (boto's MD5 tuple,
+    the spooled file).
+    '''
+    md5 = hashlib.md5()
+    spooled = tempfile.SpooledTemporaryFile(SPOOL_MEMORY)
+    size = 0
+    for data in iter(lambda: fp.read(CHUNK), b''):
+        md5.update(data)
+        spooled.write(data)
+        size += len(data)
+    spooled.seek(0)
+    return s3pub.fingerprint.md5_tuple(md5, size), spooled
+
+class _Spill(object):
+    '''
+    Files held back for a later phase, appended to one temporary file.
+    '''
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+
+    def add(self, fp):
+        '''
+        Append the contents of 'fp'; return their offset.
+        '''
+        with self._lock:
+            self._file.seek(0, 2)
+            offset = self._file.tell()
+            shutil.copyfileobj(fp, self._file, CHUNK)
+        return offset
+
+    def open(self, offset, size):
+        '''
+        Return a SpooledTemporaryFile holding 'size' bytes from 'offset'.
+        '''
+        spooled = tempfile.SpooledTemporaryFile(SPOOL_MEMORY)
+        while size > 0:
+            with self._lock:
+                self._file.seek(offset)
+                data = self._file.read(min(CHUNK, size))
+            spooled.write(data)
+            offset += len(data)
+            size -= len(data)
+        spooled.seek(0)
+        return spooled
+
+    def close(self):
+        self._file.close()
+
+def _upload(bucket, name, rpath, md5, fp, progress,
+        metrics=s3pub.metrics.NULL):
+    '''
+    Upload an archive member from 'fp', then close it.
+    '''
+    try:
+        progress.start_file(name)
+        key = boto.s3.key.Key(bucket, rpath)
+        with metrics.timer('s3_put'):
+            s3pub.retry.call(
+                key.set_contents_from_file,
+                (fp, ),
+                dict(
+                    headers={
+                        'Content-Type': s3pub.upload._content_type(rpath)},
+                    policy='public-read',
+                    cb=functools.partial(progress.update, name),
+                    md5=md5,
+                    rewind=True,
+                ),
+                metrics=metrics,
+            )
+    finally:
+        fp.close()
+    progress.finish_file(name, md5[2])
+    metrics.incr('files_uploaded')
+    metrics.incr('bytes_uploaded', md5[2])
+
+def publish(src, bucket, prefix, delete, metrics=s3pub.metrics.NULL,
+        pool=None, rebuild_manifest=False,
+        phases=s3pub.schedule.DEFAULT_PHASES, stdin=None):
+    '''
+    Synchronize 'prefix' in 'bucket' with the contents of an archive; see
+    do_upload, which calls this for archive sources.
+
+    Return a list of remote keys modified.
+    '''
+    with s3pub.workers.default_pool(pool) as pool:
+        entries = None
+        if not rebuild_manifest:
+            entries = s3pub.manifest.load(bucket, prefix, metrics)
+        fresh = entries is None
+        if fresh:
+            entries = s3pub.upload._list(bucket, prefix, metrics)
+
+        # member name -> (md5, remote path), as _finish expects
+        to_upload = {}
+        seen = set()
+        # later phases: (remote path, size, (name, remote path, md5, offset))
+        deferred = []
+        tasks = collections.deque()
+        spill = _Spill()
+        progress = None
+        indexname = []
+        is_index = lambda rpath: posixpath.basename(rpath) in indexname
+
+        def changed():
+            '''
+            Prepare for the first upload or deletion.
+            '''
+            indexname.append(s3pub.upload._get_index_doc(bucket, metrics))
+            # an interrupted publish must not leave a manifest behind
+            s3pub.manifest.discard(bucket, prefix, metrics)
+            return s3pub.progress.UploadProgress(0, 0)
+
+        try:
+            with metrics.span('read') as span:
+                for name, fp in members(src, stdin):
+                    rpath = s3pub.upload._remote_path(prefix, name, '.')
+                    if rpath in seen:
+                        # both copies could be uploading at once
+                        raise ValueError(
+                            u'{} appears twice in the archive'.format(name))
+                    seen.add(rpath)
+                    md5, spooled = _spool(fp)
+                    if entries.get(rpath, (None, ))[0] == md5[0]:
+                        spooled.close()
+                        continue
+
+                    progress = progress or changed()
+                    progress.add_file(md5[2])
+                    to_upload[name] = (md5, rpath)
+                    if s3pub.schedule.phase_index(rpath, phases, is_index):
+                        offset = spill.add(spooled)
+                        deferred.append(
+                            (rpath, md5[2], (name, rpath, md5, offset)))
+                        spooled.close()
+                        continue
+                    # bound the files spooled for uploads not yet started
+                    while len(tasks) >= 2 * pool.size:
+                        tasks.popleft().result()
+                    tasks.append(pool.submit(
+                        _upload, bucket, name, rpath, md5, spooled, progress,
+                        metrics))
+                span.set('files', len(seen))
+                while tasks:
+                    tasks.popleft().result()
+
+            if deferred:
+                with metrics.span('upload', files=len(deferred)):
+                    for phase in s3pub.schedule.phases(
+                            deferred, phases, is_index):
+                        pool.map(
+                            lambda item: _upload(
+                                bucket, item[0], item[1], item[2],
+                                spill.open(item[3], item[2][2]), progress,
+                                metrics),
+                            phase,
+                        )
+        finally:
+            # uploads already queued close their own files; let them finish
+            # before raising
+            for task in tasks:
+                try:
+                    task.result()
+                except Exception:
+                    pass
+            spill.close()
+        if progress:
+            progress.finish()
+
+        to_delete = []
+        if delete:
+            to_delete = [rpath for rpath in entries if rpath not in seen]
+        if to_delete and not progress:
+            changed()
+        return s3pub.upload._finish(
+            bucket, prefix, to_upload, to_delete, delete,
+            indexname and indexname[0], metrics, entries, fresh)
@@ -0,0 +1,173 @@
+'''
+Publishing many sites from one process.
+
+A batch file is a YAML list of sites:
+
+    - src: sites/blog
+      dest: mybucket/blog
+      distrib_id: EDFDVBD632BHDS5
+    - src: sites/docs
+      dest: otherbucket
+      delete: false
+
+Relative source paths are relative to the batch file.  All sites share one S3
+connection, one pool of upload workers, so that its size caps uploads across
+every site, and one cache of file digests.  Invalidations are collected as
+sites finish and sent at the end, in one request per distribution.
+'''
+
+from __future__ import absolute_import, print_function
+
+import os.path
+
+from six import iteritems, string_types
+
+import s3pub.hashcache
+import s3pub.invalidate
+import s3pub.metrics
+import s3pub.progress
+import s3pub.schedule
+import s3pub.upload
+import s3pub.workers
+
+# sites compared and published at once
+DEFAULT_CONCURRENCY = 4
+
+class Site(object):
+    '''
+    One entry in a batch file.
+    '''
+    def __init__(self, src, dest, distrib_id=None, delete=True):
+        self.src = src
+        self.dest = dest
+        self.distrib_id = distrib_id
+        self.delete = delete
+
+def load(entries, base_dir='.'):
+    '''
+    Return a list of Sites from the parsed contents of a batch file.
+    '''
+    if not isinstance(entries, list):
+        raise ValueError('a batch file must be a list of sites')
+    sites = []
+    for idx, entry in enumerate(entries):
+        if not isinstance(entry, dict) or \
+                not isinstance(entry.get('src'), string_types) or \
+                not isinstance(entry.get('dest'), string_types):
+            raise ValueError(
+                'site {} needs a "src" and a "dest"'.format(idx + 1))
+        unknown = set(entry) - set(['src', 'dest', 'distrib_id', 'delete'])
+        if unknown:
+            raise ValueError('site {} has unknown settings: {}'.format(
+                idx + 1, ', '.join(sorted(unknown))))
+        sites.append(Site(
+            os.path.join(base_dir, os.path.expanduser(entry['src'])),
+            entry['dest'],
+            entry.get('distrib_id'),
+            entry.get('delete', True),
+        ))
+    return sites
+
+def publish(sites, conn, pool, metrics=s3pub.metrics.NULL,
+        concurrency=DEFAULT_CONCURRENCY, hashes=None,
+        phases=s3pub.schedule.DEFAULT_PHASES):
+    '''
+    Publish each site with do_upload, 'concurrency' at a time.
+
+    Uploads for every site run on 'pool'.  Return (results, errors): dicts
+    mapping each Site to its modified keys, or to the exception that stopped
+    it.  A failing site doesn't stop the others.
+    '''
+    if hashes is None:
+        hashes = s3pub.hashcache.HashCache()
+    results = {}
+    errors = {}
+
+    def publish_site(site):
+        try:
+            with metrics.span('site', dest=site.dest):
+                results[site] = s3pub.upload.do_upload(
+                    site.src, site.dest, site.delete, None, metrics, pool,
+                    conn, hashes=hashes, phases=phases)
+        except Exception as exc:
+            errors[site] = exc
+
+    # a separate pool, since sites wait on uploads queued to 'pool'
+    site_pool = s3pub.workers.WorkerPool(concurrency)
+    try:
+        site_pool.map(publish_site, sites)
+    finally:
+        site_pool.close()
+    return results, errors
+
+def _prefix(dest):
+    '''
+    Return the key prefix of 'dest', without a trailing slash.
+    '''
+    return s3pub.upload._split_dest(dest)[1].strip('/')
+
+def _wildcard(prefix):
+    '''
+    Return an invalidation path covering everything under 'prefix'.
+    '''
+    return prefix and prefix + '/*' or '*'
+
+def _common_prefix(prefixes):
+    '''
+    Return the longest run of directories shared by all of 'prefixes'.
+    '''
+    parts = [prefix.split('/') for prefix in prefixes]
+    common = []
+    for names in zip(*parts):
+        if len(set(names)) != 1:
+            break
+        common.append(names[0])
+    return '/'.join(common)
+
+def group_invalidations(results):
+    '''
+    Return the paths to invalidate for each distribution, from the results of
+    publish.
+
+    If a distribution would need more than MAX_INVALIDATION_PATHS (see
+    s3pub.invalidate), each site's paths are replaced by a wildcard covering
+    its prefix instead.  CloudFront only allows MAX_WILDCARD_PATHS wildcards
+    in progress at once, so past that the sites share one wildcard covering
+    their common prefix.
+    '''
+    sites = {}
+    for site, keys in iteritems(results):
+        if site.distrib_id and keys:
+            sites.setdefault(site.distrib_id, []).append((site, keys))
+    paths = {}
+    for distrib_id, entries in iteritems(sites):
+        keys = set()
+        for _, site_keys in entries:
+            keys.update(site_keys)
+        if len(keys) > s3pub.invalidate.MAX_INVALIDATION_PATHS:
+            prefixes = set(_prefix(site.dest) for site, _ in entries)
+            if len(prefixes) > s3pub.invalidate.MAX_WILDCARD_PATHS:
+                prefixes = [_common_prefix(prefixes)]
+            keys = set(_wildcard(prefix) for prefix in prefixes)
+        paths[distrib_id] = sorted(keys)
+    return paths
+
+def invalidate(cf_conn, paths, metrics=s3pub.metrics.NULL):
+    '''
+    Send invalidations for each distribution in 'paths', as returned by
+    group_invalidations, then wait for them all to complete.
+    '''
+    requests = []
+    for distrib_id, keys in sorted(iteritems(paths)):
+        req = s3pub.invalidate.submit(cf_conn, distrib_id, keys, metrics)
+        print('Invalidating {} paths in {} ({})'.format(
+            len(keys), distrib_id, req.id))
+        requests.append((distrib_id, req))
+    # they complete in parallel; wait for each in turn
+    for distrib_id, req in requests:
+        with metrics.span('invalidate', distribution=distrib_id):
+            pbar = s3pub.progress.invalidation_progress(req.id)
+            for _ in pbar(s3pub.invalidate.Monitor(
+                    cf_conn, distrib_id, req.id, metrics)):
+                pass
+    return len(requests)
@@ -0,0 +1,242 @@
+'''
+Sources of change sets for incremental publishing.
+
+A change set is a set of paths relative to the source directory, using
+forward slashes.  Whether a path was modified or removed is decided when it
+is published, by checking whether it still exists.  Paths ending in a slash
+name directories: everything under them is published, or removed if the
+directory is gone.  An empty path stands for the whole tree, and forces a
+full reconciliation.
+'''
+
+from __future__ import absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import posixpath
+import select
+import struct
+import subprocess
+import time
+
+from six import iteritems
+
+def _normalize(path, src):
+    '''
+    Return 'path' relative to 'src', with forward slashes.
+
+    Relative paths are taken to be relative to 'src' already.
+    '''
+    is_dir = path.endswith(('/', os.sep))
+    if os.path.isabs(path):
+        path = os.path.relpath(path, src)
+    path = posixpath.normpath(path.replace('\\', '/'))
+    if path == '.' or path.startswith('../'):
+        raise ValueError(u'path is outside the source: {}'.format(path))
+    return is_dir and path + '/' or path
+
+def from_lines(lines, src):
+    '''
+    Return a change set from an iterable of paths, e.g. a file of them.
+    '''
+    return set(
+        _normalize(line.rstrip('\r\n'), src) for line in lines
+        if line.strip())
+
+def from_git(src, revisions):
+    '''
+    Return a change set of the files under 'src' that differ between two
+    git revisions.
+
+    'revisions' is 'A..B' to compare two commits, or 'A' to compare a commit
+    against the working tree.
+    '''
+    output = subprocess.check_output(
+        ['git', 'diff', '--name-only', '--no-renames', '-z', '--relative',
+            revisions, '--', '.'],
+        cwd=src,
+    )
+    return set(
+        _normalize(path.decode('utf-8'), src)
+        for path in output.split(b'\0') if path)
+
+def parse_spec(spec, src, stdin):
+    '''
+    Return the change set described by a --changes command-line value.
+    '''
+    if spec == '-':
+        return from_lines(stdin, src)
+    kind, _, arg = spec.partition(':')
+    if kind == 'git' and arg:
+        return from_git(src, arg)
+    if kind == 'watch' and arg:
+        return watch_session(src, float(arg))
+    raise ValueError(u'invalid change set: {}'.format(spec))
+
+def watch_session(src, duration):
+    '''
+    Collect changes made under 'src' for 'duration' seconds, or until
+    interrupted with Ctrl-C.
+    '''
+    watcher = make_watcher(src)
+    changes = set()
+    deadline = time.time() + duration
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            changes |= watcher.poll(remaining)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return changes
+
+def make_watcher(src):
+    '''
+    Return an InotifyWatcher where available, else a PollingWatcher.
+    '''
+    try:
+        return InotifyWatcher(src)
+    except OSError:
+        return PollingWatcher(src)
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE
+EVENT = struct.Struct('iIII')
+
+class InotifyWatcher(object):
+    '''
+    Report changes under a directory tree using Linux inotify.
+
+    Files are reported once closed after writing, so half-written files are
+    not published.  New directories are watched as they appear.
+    '''
+    def __init__(self, src):
+        libname = ctypes.util.find_library('c')
+        if not libname:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.src = src
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> path relative to src ('' for src itself)
+        self._dirs = {}
+        self._add_tree('')
+
+    def _add_tree(self, rel):
+        '''
+        Watch a directory and its subdirectories; return the files within.
+        '''
+        found = set()
+        for root, _, files in os.walk(os.path.join(self.src, rel)):
+            relroot = os.path.relpath(root, self.src).replace(os.sep, '/')
+            relroot = relroot != '.' and relroot + '/' or ''
+            wd = self._libc.inotify_add_watch(
+                self.fd, root.encode('utf-8'), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+            self._dirs[wd] = relroot
+            found.update(relroot + name for name in files)
+        return found
+
+    def poll(self, timeout):
+        '''
+        Wait up to 'timeout' seconds for changes; return the paths changed.
+        '''
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        changes = set()
+        if readable:
+            changes = self._read()
+        return changes
+
+    def _read(self):
+        changes = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return changes
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost; report the whole tree
+                changes.add('')
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if wd not in self._dirs:
+                continue
+            path = self._dirs[wd] + name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # files may be written before we start watching
+                    changes.update(self._add_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    changes.add(path + '/')
+            elif not mask & IN_CREATE:
+                changes.add(path)
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher(object):
+    '''
+    Report changes by periodically comparing file sizes and mtimes.
+    '''
+    INTERVAL = 1.0
+
+    def __init__(self, src):
+        self.src = src
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root, _, files in os.walk(self.src):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                rel = os.path.relpath(path, self.src).replace(os.sep, '/')
+                snapshot[rel] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.INTERVAL))
+        current = self._scan()
+        changes = set(
+            path for path, info in iteritems(current)
+            if self._snapshot.get(path) != info)
+        changes.update(set(self._snapshot) - set(current))
+        self._snapshot = current
+        return changes
+
+    def close(self):
+        pass
@@ -1,26 +1,65 @@
 '''
 Command-line interface routines.
+
+Start-up time matters here, since s3pub is often run from hooks: boto,
+PyYAML and the rest of s3pub are imported only on the code paths that need
+them, so that e.g. '--help' doesn't pay for them.
 '''
 
-from __future__ import absolute_import
+from __future__ import absolute_import, print_function
 
 import argparse
 import os.path
-import yaml
-from yaml.error import YAMLError
+import sys
 
-import s3pub.invalidate
-import s3pub.upload
+import s3pub.workers
 
 DEFAULT_CONFIG_PATH = os.path.expanduser('~/.s3pub.conf')
+DEFAULT_SPOOL_PATH = os.path.expanduser('~/.s3pub-invalidations.json')
+DEFAULT_HASH_CACHE_PATH = os.path.expanduser('~/.s3pub-hashes.json')
+# copies of those in s3pub.warm and s3pub.verify, which are only imported
+# when used; the tests check they agree
+WARM_METHODS = ('GET', 'HEAD')
+DEFAULT_WARM_CONCURRENCY = 8
+VERIFY_METHODS = ('head', 'list')
 DESCRIPTION = '''\
 Publish content to S3 for use with web hosting.
 
 Mirrors local directories to S3, uploading only files that have changed or been
-added, and optionally removing files that have been deleted.
+added, and optionally removing files that have been deleted. The source may also
+be a tar or zip archive, or "-" for a tar stream on stdin, which is published
+without being extracted.
 
 Also optionally issues CloudFront invalidations for files modified or removed.
 '''
+WATCH_DESCRIPTION = '''\
+Watch local content and publish changes to S3 as they are made.
+
+Stays running until interrupted, publishing bursts of changes once they
+settle and sending CloudFront invalidations in batches.
+'''
+DEPLOY_DESCRIPTION = '''\
+Publish content to S3 as a new version, and switch the website to it.
+
+The whole tree is stored under a new prefix, copying files unchanged since the
+live version within S3, and then made live at once by a routing rule in the
+bucket's website configuration. Old versions are kept for rolling back.
+'''
+ROLLBACK_DESCRIPTION = '''\
+Switch a website published with "s3pub deploy" back to an earlier version.
+'''
+FLUSH_DESCRIPTION = '''\
+Send the CloudFront invalidations queued with --spool.
+
+Paths queued for a distribution are sent as one request once its previous
+request has completed.
+'''
+BATCH_DESCRIPTION = '''\
+Publish many sites, listed in a YAML file, from one process.
+
+Sites share one connection, one pool of upload workers and one cache of file
+digests; CloudFront invalidations are sent once every site is published.
+'''
 EPILOG = '''
 With regards to the mirroring of paths: this program does not follow
 the rsync convention of trailing slashes; i.e. local paths with and without
@@ -75,27 +114,67 @@ def cascade(containers, names):
     '''
     return tuple(_find_first(name, containers) for name in names)
 
-def parse_args():
-    parser = argparse.ArgumentParser(
-        description=DESCRIPTION,
-        epilog=EPILOG,
-    )
+def _add_common_arguments(parser, multiple=False):
+    '''
+    Add the arguments shared by publishing and watching.
+
+    If 'multiple' is True, several destinations may be given.
+    '''
     parser.add_argument('src', help='Path to local content to upload')
-    parser.add_argument(
-        'dest',
-        help='Destination for uploaded content (bucket/key)',
-    )
-    parser.add_argument(
-        '-d',
-        '--distrib-id',
-        help='If provided, CloudFront distribution ID to invalidate.',
-    )
+    if multiple:
+        parser.add_argument(
+            'dest',
+            nargs='+',
+            help='Destinations for uploaded content (bucket/key); the tree '
+                'is scanned once and published to each',
+        )
+        parser.add_argument(
+            '-d',
+            '--distrib-id',
+            action='append',
+            help='If provided, CloudFront distribution ID to invalidate; '
+                'with several destinations, give one per destination, in '
+                'the same order',
+        )
+    else:
+        parser.add_argument(
+            'dest',
+            help='Destination for uploaded content (bucket/key)',
+        )
+        parser.add_argument(
+            '-d',
+            '--distrib-id',
+            help='If provided, CloudFront distribution ID to invalidate.',
+        )
     parser.add_argument(
         '--no-delete',
         dest='delete',
         action='store_false',
         help='Do not remove files from S3 that don\'t exist locally',
     )
+    _add_credential_arguments(parser)
+    _add_workers_argument(parser)
+    _add_hash_arguments(parser)
+    _add_phase_arguments(parser)
+    _add_metrics_arguments(parser)
+
+def _add_phase_arguments(parser):
+    parser.add_argument(
+        '--phase',
+        dest='phases',
+        action='append',
+        metavar='PATTERNS',
+        help='Upload files whose names match these comma-separated patterns '
+            'after all others; repeat for later phases. Index documents '
+            'always go last (default: *.html,*.htm)',
+    )
+    parser.add_argument(
+        '--no-phases',
+        action='store_true',
+        help='Upload all files together, largest first',
+    )
+
+def _add_credential_arguments(parser):
     parser.add_argument(
         '--aws-access-key', 
         help='AWS Access Key',
@@ -109,26 +188,184 @@ def parse_args():
         default=DEFAULT_CONFIG_PATH,
         help='Path to configuration file (optional; default: %(default)s)',
     )
-    args = parser.parse_args()
 
-    if args.config and args.config != DEFAULT_CONFIG_PATH \
-            and not os.path.isfile(args.config):
-        parser.error(
-            'Could not read configuration file: {0}'.format(args.config))
+def _add_hash_arguments(parser):
+    parser.add_argument(
+        '--hash-cache',
+        nargs='?',
+        const=DEFAULT_HASH_CACHE_PATH,
+        metavar='PATH',
+        help='Keep digests of local files between runs, so that unchanged '
+            'files aren\'t read again, and files whose modification time '
+            'changed are only fingerprinted (default PATH: {})'.format(
+                DEFAULT_HASH_CACHE_PATH),
+    )
+    parser.add_argument(
+        '--fingerprint',
+        metavar='{xxh3,blake3,sha1,crc32,md5}',
+        help='Hash used to tell whether a file changed before computing its '
+            'MD5 again; xxh3 and blake3 need the xxhash and blake3 packages '
+            '(default: the first of xxh3, blake3 and sha1 installed)',
+    )
+
+def _add_workers_argument(parser):
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=s3pub.workers.DEFAULT_WORKERS,
+        help='Number of concurrent uploads (default: %(default)s)',
+    )
+
+def _add_spool_argument(parser):
+    parser.add_argument(
+        '--spool',
+        nargs='?',
+        const=DEFAULT_SPOOL_PATH,
+        metavar='PATH',
+        help='Queue invalidations in a spool shared with other runs instead '
+            'of waiting for them; while one is in progress, later paths are '
+            'merged into the next request, sent by "s3pub flush" or the next '
+            'run (default PATH: {})'.format(DEFAULT_SPOOL_PATH),
+    )
+
+def _add_warm_arguments(parser):
+    parser.add_argument(
+        '--warm',
+        action='append',
+        metavar='URL',
+        help='Once invalidations complete, request each changed path under '
+            'this base URL (e.g. https://d111111abcdef8.cloudfront.net) to '
+            'fill the CDN cache; with several destinations, give one per '
+            'destination, in the same order',
+    )
+    parser.add_argument(
+        '--warm-method',
+        choices=WARM_METHODS,
+        default='GET',
+        help='Request method used for warming; HEAD is cheaper, but may not '
+            'cache the contents (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--warm-concurrency',
+        type=int,
+        default=DEFAULT_WARM_CONCURRENCY,
+        metavar='N',
+        help='Number of URLs requested at once when warming '
+            '(default: %(default)s)',
+    )
+
+def _add_verify_arguments(parser):
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help='After publishing, check that each key matches the size, MD5 '
+            'and Content-Type of its local file, and exit with an error if '
+            'any don\'t',
+    )
+    parser.add_argument(
+        '--verify-method',
+        choices=VERIFY_METHODS,
+        default='head',
+        help='Request each key\'s headers concurrently (on --workers '
+            'threads), or list the destination, which is cheaper for large '
+            'trees, skips the Content-Type and also reports keys missing '
+            'locally (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--verify-sample',
+        type=int,
+        metavar='N',
+        help='Only verify N files picked at random',
+    )
 
+def _add_metrics_arguments(parser):
+    parser.add_argument(
+        '--metrics-json',
+        metavar='PATH',
+        help='Write a JSON summary of phase timings and request latencies',
+    )
+    parser.add_argument(
+        '--metrics-prom',
+        metavar='PATH',
+        help='Write metrics in the Prometheus text format',
+    )
+    parser.add_argument(
+        '--trace',
+        metavar='PATH',
+        help='Write timing spans to a file, one JSON object per line',
+    )
+
+def _read_config(parser, path):
+    '''
+    Return the parsed configuration file, or None if it doesn't exist.
+    '''
     try:
-        with open(args.config) as config_fp:
-            config = yaml.load(config_fp)
+        config_fp = open(path)
     except IOError:
         # file doesn't exist, just assume creds come from args
-        creds = (args.aws_access_key, args.aws_secret_key)
-    except YAMLError:
-        parser.error(
-            'Configuration file is improperly formatted: {}'.format(
-                args.config))
+        return None
+
+    import yaml
+    with config_fp:
+        try:
+            return yaml.safe_load(config_fp)
+        except yaml.YAMLError:
+            parser.error(
+                'Configuration file is improperly formatted: {}'.format(path))
+
+def _check_common_arguments(parser, args):
+    '''
+    Validate shared arguments, and read credentials into 'args.creds'.
+    '''
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    _check_phases(args)
+    _check_fingerprint(parser, args)
+    _check_credentials(parser, args)
+
+def _check_fingerprint(parser, args):
+    '''
+    Validate --fingerprint; optional packages are only tried if it's given.
+    '''
+    if args.fingerprint is None:
+        return
+    import s3pub.fingerprint
+    available = s3pub.fingerprint.available()
+    if args.fingerprint not in available:
+        parser.error('--fingerprint must be one of: {}'.format(
+            ', '.join(available)))
+
+def _check_phases(args):
+    '''
+    Turn the --phase and --no-phases arguments into 'args.phases'.
+    '''
+    import s3pub.schedule
+    if args.no_phases:
+        args.phases = ()
+    elif args.phases:
+        args.phases = s3pub.schedule.parse_phases(args.phases)
     else:
-        # file was read properly; conditionally override args over config.
-        creds = cascade([args, config], ['aws_access_key', 'aws_secret_key'])
+        args.phases = s3pub.schedule.DEFAULT_PHASES
+
+def _check_credentials(parser, args):
+    '''
+    Read credentials into 'args.creds', from the configuration file if they
+    weren't given as arguments.
+    '''
+    if args.config and args.config != DEFAULT_CONFIG_PATH \
+            and not os.path.isfile(args.config):
+        parser.error(
+            'Could not read configuration file: {0}'.format(args.config))
+
+    creds = (args.aws_access_key, args.aws_secret_key)
+    if not all(creds):
+        # only parse the configuration file if we need something from it
+        config = _read_config(parser, args.config)
+        if config is not None:
+            # conditionally override args over config.
+            creds = cascade(
+                [args, config], ['aws_access_key', 'aws_secret_key'])
     
     if not all(i for i in creds):
         parser.error(
@@ -137,19 +374,655 @@ def parse_args():
         )
     args.creds = Credentials(*creds)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=DESCRIPTION,
+        epilog=EPILOG,
+    )
+    _add_common_arguments(parser, multiple=True)
+    parser.add_argument(
+        '--changes',
+        metavar='SPEC',
+        help='Publish only the paths in a change set: "-" reads paths '
+            '(relative to src) from stdin, "git:REV1..REV2" uses files '
+            'differing between git revisions, "watch:SECONDS" watches src '
+            'for changes for that long',
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='Compare the whole tree with a listing of S3, even if '
+            '--changes is given or a manifest of the last publish exists; '
+            'run periodically to correct drift',
+    )
+    parser.add_argument(
+        '--low-memory',
+        action='store_true',
+        help='Compare the tree with S3 in a temporary database on disk '
+            'rather than in memory, for trees of millions of files; the '
+            'bucket is always listed',
+    )
+    _add_spool_argument(parser)
+    _add_warm_arguments(parser)
+    _add_verify_arguments(parser)
+    args = parser.parse_args(argv)
+    _check_common_arguments(parser, args)
+
+    if args.distrib_id and len(args.distrib_id) != len(args.dest):
+        if len(args.dest) > 1:
+            parser.error('Give one --distrib-id per destination')
+        parser.error('Only one --distrib-id may be given per destination')
+    if args.warm and len(args.warm) != len(args.dest):
+        if len(args.dest) > 1:
+            parser.error('Give one --warm URL per destination')
+        parser.error('Only one --warm URL may be given per destination')
+    if args.warm and args.spool:
+        parser.error('--warm waits for invalidations, so can\'t be used with '
+            '--spool')
+    if args.warm_concurrency < 1:
+        parser.error('--warm-concurrency must be at least 1')
+    if args.verify_sample is not None and args.verify_sample < 1:
+        parser.error('--verify-sample must be at least 1')
+    if args.low_memory:
+        for option, value in [('--changes', args.changes),
+                ('--hash-cache', args.hash_cache), ('--verify', args.verify)]:
+            if value:
+                parser.error(
+                    '{} can\'t be used with --low-memory'.format(option))
+        if len(args.dest) > 1:
+            parser.error('--low-memory takes a single destination')
+    if args.changes or len(args.dest) > 1 or args.verify or args.low_memory:
+        import s3pub.archive
+        if s3pub.archive.is_archive(args.src):
+            if args.changes:
+                parser.error('--changes can\'t be used with an archive')
+            if args.verify:
+                parser.error('--verify can\'t be used with an archive')
+            if args.low_memory:
+                parser.error('--low-memory can\'t be used with an archive; '
+                    'archives are never held in memory')
+            parser.error('An archive can only be published to one '
+                'destination')
+
+    args.change_set = None
+    if args.changes and not args.full:
+        import subprocess
+        import s3pub.changes
+        try:
+            args.change_set = s3pub.changes.parse_spec(
+                args.changes, args.src, sys.stdin)
+        except (ValueError, OSError, subprocess.CalledProcessError) as exc:
+            parser.error(
+                'Could not read change set {}: {}'.format(args.changes, exc))
+
     return args
 
+def parse_watch_args(argv):
+    import s3pub.watch
+    parser = argparse.ArgumentParser(
+        prog='s3pub watch',
+        description=WATCH_DESCRIPTION,
+    )
+    _add_common_arguments(parser)
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=s3pub.watch.DEFAULT_DEBOUNCE,
+        metavar='SECONDS',
+        help='Publish once no changes have been seen for this long '
+            '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--invalidate-every',
+        type=float,
+        default=s3pub.watch.DEFAULT_INVALIDATE_INTERVAL,
+        metavar='SECONDS',
+        help='Send collected invalidations at most this often '
+            '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--reconcile-every',
+        type=float,
+        metavar='SECONDS',
+        help='Compare the whole tree with S3 this often, to correct drift',
+    )
+    parser.add_argument(
+        '--status-file',
+        metavar='PATH',
+        help='Keep a JSON status report, with queue depth and last publish '
+            'latency, at this path',
+    )
+    args = parser.parse_args(argv)
+    _check_common_arguments(parser, args)
+
+    if args.status_file and not os.path.relpath(
+            os.path.abspath(args.status_file),
+            os.path.abspath(args.src)).startswith(os.pardir):
+        parser.error('--status-file must not be inside src')
+
+    return args
+
+def parse_deploy_args(argv):
+    import s3pub.archive
+    import s3pub.deploy
+    parser = argparse.ArgumentParser(
+        prog='s3pub deploy',
+        description=DEPLOY_DESCRIPTION,
+    )
+    parser.add_argument('src', help='Path to local content to upload')
+    parser.add_argument(
+        'dest',
+        help='Destination for uploaded content (bucket/key); the bucket must '
+            'have website hosting enabled',
+    )
+    parser.add_argument(
+        '-d',
+        '--distrib-id',
+        help='If provided, CloudFront distribution ID to invalidate.',
+    )
+    parser.add_argument(
+        '--keep',
+        type=int,
+        default=s3pub.deploy.DEFAULT_KEEP,
+        metavar='N',
+        help='Number of versions to keep for rolling back to; older ones are '
+            'deleted (default: %(default)s)',
+    )
+    _add_credential_arguments(parser)
+    _add_spool_argument(parser)
+    _add_workers_argument(parser)
+    _add_hash_arguments(parser)
+    _add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.keep < 1:
+        parser.error('--keep must be at least 1')
+    if s3pub.archive.is_archive(args.src):
+        parser.error('Only directories can be deployed, not archives')
+    _check_fingerprint(parser, args)
+    _check_credentials(parser, args)
+    return args
+
+def parse_rollback_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='s3pub rollback',
+        description=ROLLBACK_DESCRIPTION,
+    )
+    parser.add_argument('dest', help='Destination deployed to (bucket/key)')
+    parser.add_argument(
+        '-d',
+        '--distrib-id',
+        help='If provided, CloudFront distribution ID to invalidate.',
+    )
+    parser.add_argument(
+        '--to',
+        metavar='VERSION',
+        help='Version to switch to (default: the one before the live version)',
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='List the versions available, marking the live one, and exit',
+    )
+    _add_credential_arguments(parser)
+    _add_spool_argument(parser)
+    _add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    _check_credentials(parser, args)
+    return args
+
+def parse_batch_args(argv):
+    import s3pub.batch
+    parser = argparse.ArgumentParser(
+        prog='s3pub batch',
+        description=BATCH_DESCRIPTION,
+    )
+    parser.add_argument(
+        'batch_file',
+        help='YAML list of sites, each with "src" and "dest", and optionally '
+            '"distrib_id" and "delete"',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=s3pub.batch.DEFAULT_CONCURRENCY,
+        metavar='N',
+        help='Number of sites published at once; uploads for all of them '
+            'share --workers (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--no-delete',
+        dest='delete',
+        action='store_false',
+        help='Do not remove files from S3 that don\'t exist locally, unless '
+            'a site sets "delete"',
+    )
+    _add_credential_arguments(parser)
+    _add_spool_argument(parser)
+    _add_workers_argument(parser)
+    _add_hash_arguments(parser)
+    _add_phase_arguments(parser)
+    _add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    _check_common_arguments(parser, args)
+
+    import yaml
+    try:
+        with open(args.batch_file) as fp:
+            entries = yaml.safe_load(fp)
+    except IOError:
+        parser.error('Could not read batch file: {}'.format(args.batch_file))
+    except yaml.YAMLError:
+        parser.error(
+            'Batch file is improperly formatted: {}'.format(args.batch_file))
+    if isinstance(entries, list) and not args.delete:
+        for entry in entries:
+            if isinstance(entry, dict):
+                entry.setdefault('delete', False)
+    try:
+        args.sites = s3pub.batch.load(
+            entries, os.path.dirname(args.batch_file))
+    except ValueError as exc:
+        parser.error('{}: {}'.format(args.batch_file, exc))
+    return args
+
+def parse_flush_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='s3pub flush',
+        description=FLUSH_DESCRIPTION,
+    )
+    parser.add_argument(
+        '-d',
+        '--distrib-id',
+        action='append',
+        help='Only send invalidations for this distribution; may be repeated',
+    )
+    parser.add_argument(
+        '--spool',
+        default=DEFAULT_SPOOL_PATH,
+        metavar='PATH',
+        help='Path to the spool (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--wait',
+        action='store_true',
+        help='Wait for requests in progress, sending queued paths as each '
+            'completes, until none are left',
+    )
+    _add_credential_arguments(parser)
+    _add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    _check_credentials(parser, args)
+    return args
+
+def write_metrics(metrics, args):
+    '''
+    Write collected metrics to each of the files requested on the command line.
+    '''
+    for path, writer in [
+            (args.metrics_json, metrics.write_json),
+            (args.metrics_prom, metrics.write_prometheus),
+            (args.trace, metrics.write_spans)]:
+        if path:
+            with open(path, 'w') as fp:
+                writer(fp)
+
+def _make_metrics(args):
+    import s3pub.metrics
+    if args.metrics_json or args.metrics_prom or args.trace:
+        return s3pub.metrics.Metrics()
+    return s3pub.metrics.NULL
+
+def _decode(value):
+    '''
+    Return command-line values as text; Python 2 gives us bytes.
+    '''
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+def _make_hashes(args):
+    import s3pub.hashcache
+    hashes = s3pub.hashcache.HashCache(args.hash_cache, args.fingerprint)
+    if args.hash_cache:
+        hashes.load()
+    return hashes
+
+def _save_hashes(args, hashes, metrics):
+    metrics.incr('hash_cache_hits', hashes.hits)
+    metrics.incr('hash_fingerprint_hits', hashes.fingerprint_hits)
+    metrics.incr('hash_misses', hashes.misses)
+    if args.hash_cache:
+        hashes.save()
+
+def _report_flush(results):
+    for distrib_id, req_id, count, sent in results:
+        if sent:
+            print('Invalidating {} paths in {} ({})'.format(
+                count, distrib_id, req_id))
+        else:
+            print('{} paths queued for {} until {} completes'.format(
+                count, distrib_id, req_id))
+
+def _invalidate(args, paths, metrics):
+    '''
+    Invalidate 'paths', a dict of distribution ID -> paths, waiting for each
+    request to complete; or with --spool, queue them and send what the spool
+    allows without waiting.
+    '''
+    import s3pub.invalidate
+    if not args.spool:
+        for distrib_id, keys in sorted(paths.items()):
+            s3pub.invalidate.do_invalidate(
+                distrib_id, keys, args.creds, metrics)
+        return
+
+    import s3pub.spool
+    with s3pub.spool.Spool(args.spool) as spool:
+        for distrib_id, keys in paths.items():
+            spool.add(distrib_id, keys)
+        _report_flush(spool.flush(
+            s3pub.invalidate.connect(args.creds), metrics, set(paths)))
+
+def _warm(args, targets, metrics):
+    '''
+    Request the URLs for 'targets', a list of (base URL, paths), and report
+    the latency of each.
+    '''
+    import s3pub.warm
+    urls = []
+    for base_url, keys in targets:
+        urls.extend(s3pub.warm.urls(base_url, keys))
+    results = s3pub.warm.warm(
+        urls, args.warm_concurrency, args.warm_method, metrics=metrics)
+    for url, status, seconds, error in results:
+        print(u'{:>3} {:8.1f} ms  {}{}'.format(
+            status or 'ERR', seconds * 1000, url,
+            error and u' ({})'.format(error) or ''))
+    times = sorted(seconds for _, _, seconds, _ in results)
+    if times:
+        print('Warmed {} URLs: median {:.1f} ms, slowest {:.1f} ms, {} '
+            'failed'.format(len(times), times[len(times) // 2] * 1000,
+                times[-1] * 1000,
+                sum(1 for _, status, _, _ in results
+                    if status is None or status >= 500)))
+
+def _verify(args, conn, targets, pool, hashes, metrics):
+    '''
+    Verify each destination in 'targets' against the source, and report any
+    mismatches; return True if there were none.
+    '''
+    import s3pub.upload
+    import s3pub.verify
+    ok = True
+    for dest in targets:
+        bucket_name, prefix = s3pub.upload._split_dest(dest)
+        checked, mismatches = s3pub.verify.verify(
+            conn.get_bucket(bucket_name), prefix, _decode(args.src),
+            args.delete, args.verify_method, args.verify_sample, pool,
+            hashes, metrics)
+        for rpath, problem in mismatches:
+            print(u'MISMATCH {}/{}: {}'.format(bucket_name, rpath, problem))
+        print(u'Verified {} files in {}: {} mismatches'.format(
+            checked, dest, len(mismatches)))
+        ok = ok and not mismatches
+    return ok
+
+def watch_main(argv):
+    import signal
+    import s3pub.invalidate
+    import s3pub.upload
+    import s3pub.watch
+
+    args = parse_watch_args(argv)
+    metrics = _make_metrics(args)
+
+    def stop(*_):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    hashes = _make_hashes(args)
+    s3pub.watch.Daemon(
+        _decode(args.src),
+        _decode(args.dest),
+        args.delete,
+        s3pub.upload.connect(args.creds),
+        s3pub.workers.WorkerPool(args.workers),
+        cf_conn=args.distrib_id and s3pub.invalidate.connect(args.creds),
+        distrib_id=args.distrib_id,
+        debounce=args.debounce,
+        invalidate_interval=args.invalidate_every,
+        reconcile_interval=args.reconcile_every,
+        status_path=args.status_file,
+        phases=args.phases,
+        hashes=hashes,
+        metrics=metrics,
+        after_publish=metrics.enabled and
+            (lambda: write_metrics(metrics, args)) or None,
+    ).run()
+    if args.hash_cache:
+        hashes.save()
+
+def deploy_main(argv):
+    import s3pub.deploy
+
+    args = parse_deploy_args(argv)
+    metrics = _make_metrics(args)
+    hashes = _make_hashes(args)
+    try:
+        try:
+            version, inval_keys = s3pub.deploy.deploy(
+                _decode(args.src),
+                _decode(args.dest),
+                args.creds,
+                metrics,
+                s3pub.workers.WorkerPool(args.workers),
+                keep=args.keep,
+                hashes=hashes,
+            )
+        finally:
+            _save_hashes(args, hashes, metrics)
+        if inval_keys:
+            print('Version {} is live.'.format(version))
+        else:
+            print('Unchanged; version {} is live.'.format(version))
+        if args.distrib_id and inval_keys:
+            _invalidate(args, {args.distrib_id: inval_keys}, metrics)
+    finally:
+        if metrics.enabled:
+            write_metrics(metrics, args)
+
+def rollback_main(argv):
+    import s3pub.deploy
+
+    args = parse_rollback_args(argv)
+    metrics = _make_metrics(args)
+    dest = _decode(args.dest)
+    try:
+        if args.list:
+            versions, live = s3pub.deploy.versions(dest, args.creds)
+            for version in versions:
+                print('{} {}'.format(version == live and '*' or ' ', version))
+            return
+
+        version, inval_keys = s3pub.deploy.rollback(
+            dest, args.creds, args.to, metrics)
+        print('Version {} is live.'.format(version))
+        if args.distrib_id and inval_keys:
+            _invalidate(args, {args.distrib_id: inval_keys}, metrics)
+    finally:
+        if metrics.enabled:
+            write_metrics(metrics, args)
+
+def batch_main(argv):
+    import s3pub.batch
+    import s3pub.upload
+
+    args = parse_batch_args(argv)
+    metrics = _make_metrics(args)
+    hashes = _make_hashes(args)
+    try:
+        try:
+            results, errors = s3pub.batch.publish(
+                args.sites,
+                s3pub.upload.connect(args.creds),
+                s3pub.workers.WorkerPool(args.workers),
+                metrics,
+                args.concurrency,
+                hashes,
+                phases=args.phases,
+            )
+        finally:
+            _save_hashes(args, hashes, metrics)
+        for site in args.sites:
+            if site in errors:
+                print(u'{}: failed: {}'.format(
+                    site.dest, str(errors[site]).strip()))
+            else:
+                print(u'{}: {} keys modified'.format(
+                    site.dest, len(results[site])))
+
+        paths = s3pub.batch.group_invalidations(results)
+        if paths and args.spool:
+            _invalidate(args, paths, metrics)
+        elif paths:
+            import s3pub.invalidate
+            s3pub.batch.invalidate(
+                s3pub.invalidate.connect(args.creds), paths, metrics)
+        if errors:
+            sys.exit(1)
+    finally:
+        if metrics.enabled:
+            write_metrics(metrics, args)
+
+def flush_main(argv):
+    import s3pub.invalidate
+    import s3pub.progress
+    import s3pub.spool
+
+    args = parse_flush_args(argv)
+    metrics = _make_metrics(args)
+    cf_conn = s3pub.invalidate.connect(args.creds)
+    spool = s3pub.spool.Spool(args.spool)
+    try:
+        while True:
+            with spool:
+                results = spool.flush(cf_conn, metrics, args.distrib_id)
+                waiting = spool.in_progress(args.distrib_id)
+            _report_flush(results)
+            if not args.wait or not waiting:
+                break
+            # the spool is unlocked meanwhile, so other runs can add to it
+            for distrib_id, req_id in sorted(waiting.items()):
+                pbar = s3pub.progress.invalidation_progress(req_id)
+                for _ in pbar(s3pub.invalidate.Monitor(
+                        cf_conn, distrib_id, req_id, metrics)):
+                    pass
+    finally:
+        if metrics.enabled:
+            write_metrics(metrics, args)
+
+# subcommands, which otherwise would be taken for source paths
+COMMANDS = {
+    'watch': watch_main,
+    'deploy': deploy_main,
+    'rollback': rollback_main,
+    'batch': batch_main,
+    'flush': flush_main,
+}
+
 def main():
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        if os.path.isdir(sys.argv[1]):
+            # before subcommands, this published the directory
+            sys.stderr.write(
+                u's3pub: error: {0} is both a command and a directory here; '
+                u'write ./{0} to publish the directory\n'.format(sys.argv[1]))
+            sys.exit(2)
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
     args = parse_args()
-    
-    inval_keys = s3pub.upload.do_upload(
-        args.src.decode('utf-8'),
-        args.dest.decode('utf-8'),
-        args.delete,
-        args.creds,
-    )
-    if args.distrib_id and inval_keys:
-        s3pub.invalidate.do_invalidate(args.distrib_id, inval_keys, args.creds)
+    metrics = _make_metrics(args)
+
+    import s3pub.upload
+    dests = [_decode(dest) for dest in args.dest]
+    hashes = _make_hashes(args)
+    conn = s3pub.upload.connect(args.creds)
+    pool = s3pub.workers.WorkerPool(args.workers)
+    try:
+        if len(dests) == 1:
+            try:
+                inval_keys = s3pub.upload.do_upload(
+                    _decode(args.src),
+                    dests[0],
+                    args.delete,
+                    args.creds,
+                    metrics,
+                    pool,
+                    conn,
+                    changes=args.change_set,
+                    # the cache would hold a digest for every file
+                    hashes=None if args.low_memory else hashes,
+                    rebuild_manifest=args.full,
+                    phases=args.phases,
+                    low_memory=args.low_memory,
+                )
+            finally:
+                _save_hashes(args, hashes, metrics)
+            verified = not args.verify or \
+                _verify(args, conn, dests, pool, hashes, metrics)
+            if args.distrib_id and inval_keys:
+                _invalidate(args, {args.distrib_id[0]: inval_keys}, metrics)
+            if args.warm and inval_keys:
+                _warm(args, [(args.warm[0], inval_keys)], metrics)
+            if not verified:
+                sys.exit(1)
+            return
+
+        failed = None
+        try:
+            results = s3pub.upload.do_upload(
+                _decode(args.src),
+                dests,
+                args.delete,
+                args.creds,
+                metrics,
+                pool,
+                conn,
+                changes=args.change_set,
+                hashes=hashes,
+                rebuild_manifest=args.full,
+                phases=args.phases,
+            )
+        except s3pub.upload.FanoutError as exc:
+            # still invalidate the destinations that were published
+            results, failed = exc.results, exc
+        finally:
+            _save_hashes(args, hashes, metrics)
+        verified = not args.verify or _verify(
+            args, conn, [dest for dest in dests if dest in results], pool,
+            hashes, metrics)
+        if args.distrib_id:
+            paths = {}
+            for dest, distrib_id in zip(dests, args.distrib_id):
+                if results.get(dest):
+                    paths.setdefault(distrib_id, []).extend(results[dest])
+            if paths:
+                _invalidate(args, paths, metrics)
+        if args.warm:
+            _warm(args, [(base_url, results[dest])
+                for dest, base_url in zip(dests, args.warm)
+                if results.get(dest)], metrics)
+        if failed or not verified:
+            sys.exit(1)
+    finally:
+        if metrics.enabled:
+            write_metrics(metrics, args)
 
 if __name__ == '__main__':
     main()
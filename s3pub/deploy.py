@@ -0,0 +1,340 @@
+'''
+Versioned deploys with instant rollback.
+
+A normal publish changes the live keys in place, so visitors can see a mix of
+old and new files while it runs.  A deploy instead uploads the tree as a new
+version under VERSIONS_ROOT, then makes it live with a single change to the
+bucket's website configuration: a routing rule redirects (with a 302)
+requests under the prefix that find no object to the same path in the live
+version.  Rolling back changes the rule to point at an older version, with no
+data transferred.
+
+Files unchanged since the live version are copied on the S3 side rather than
+uploaded again.  Versions beyond the newest few are deleted after each
+deploy.
+
+CloudFront origin paths would avoid the redirect, but boto's CloudFront API
+predates them, so the pointer lives in the bucket's website configuration.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import re
+import time
+
+import boto.exception
+import boto.s3.website
+from six import iteritems
+
+import s3pub.hashcache
+import s3pub.manifest
+import s3pub.metrics
+import s3pub.progress
+import s3pub.retry
+import s3pub.schedule
+import s3pub.upload
+import s3pub.workers
+
+VERSIONS_ROOT = '.s3pub-versions/'
+# number of versions kept for rolling back to
+DEFAULT_KEEP = 5
+REDIRECT_CODE = '302'
+# version names: when they were deployed, and a digest of their contents
+VERSION_FORMAT = '%Y%m%dT%H%M%SZ'
+VERSION_RE = re.compile(r'^\d{8}T\d{6}Z-[0-9a-f]{10}$')
+
+class DeployError(Exception):
+    '''
+    Raised when a bucket or prefix can't be deployed to or rolled back.
+    '''
+
+def _base(prefix):
+    prefix = prefix.rstrip('/')
+    return prefix and prefix + '/'
+
+def versions_prefix(prefix):
+    '''
+    Return the key prefix under which versions of 'prefix' are stored.
+    '''
+    return VERSIONS_ROOT + _base(prefix)
+
+def version_prefix(prefix, version):
+    return versions_prefix(prefix) + version + '/'
+
+def _get_website(bucket, metrics):
+    try:
+        with metrics.timer('s3_get_website'):
+            return s3pub.retry.call(
+                bucket.get_website_configuration_obj, metrics=metrics)
+    except boto.exception.S3ResponseError:
+        raise DeployError(
+            u'website hosting is not enabled on bucket {}'.format(
+                bucket.name))
+
+def _is_ours(rule, prefix):
+    '''
+    Return True if a routing rule was added by s3pub for 'prefix'.
+    '''
+    condition = rule.condition
+    redirect = rule.redirect
+    if condition is None or redirect is None:
+        return False
+    if (condition.key_prefix or '') == _base(prefix) and \
+            (redirect.replace_key_prefix or '').startswith(
+                versions_prefix(prefix)):
+        return True
+    # see _rules
+    return not _base(prefix) and condition.key_prefix == VERSIONS_ROOT
+
+def _rules(config, prefix, version):
+    '''
+    Return the routing rules that send requests under 'prefix' to 'version'.
+    '''
+    rules = []
+    if not _base(prefix) and config.error_key:
+        # requests for missing keys within a version would otherwise match
+        # the rule below again, and redirect forever; _check_error_page
+        # makes sure the error document exists
+        rules.append(boto.s3.website.RoutingRule.when(
+            key_prefix=VERSIONS_ROOT, http_error_code='404',
+        ).then_redirect(
+            replace_key=version_prefix(prefix, version) +
+                (config.error_key or ''),
+            http_redirect_code=REDIRECT_CODE,
+        ))
+    rules.append(boto.s3.website.RoutingRule.when(
+        key_prefix=_base(prefix) or None, http_error_code='404',
+    ).then_redirect(
+        replace_key_prefix=version_prefix(prefix, version),
+        http_redirect_code=REDIRECT_CODE,
+    ))
+    return rules
+
+def _check_error_page(config, prefix, exists):
+    '''
+    At the root of a bucket, raise DeployError unless the website's error
+    document is in the version; 'exists' is called with its name there.
+
+    Missing keys within the version are redirected to it, and a redirect to
+    any other missing key would match the same rule again.
+    '''
+    if _base(prefix):
+        return
+    if not config.error_key or not exists(config.error_key):
+        raise DeployError(
+            u'deploying to the root of a bucket needs the website\'s error '
+            u'document in every version')
+
+def live_version(config, prefix):
+    '''
+    Return the version that the website configuration points at, or None.
+    '''
+    start = len(versions_prefix(prefix))
+    for rule in config.routing_rules:
+        if _is_ours(rule, prefix) and rule.redirect.replace_key_prefix:
+            return rule.redirect.replace_key_prefix[start:].rstrip('/')
+
+def _switch(bucket, config, prefix, version, metrics):
+    '''
+    Point the website at 'version'; a single request, so it takes effect all
+    at once.
+    '''
+    rules = boto.s3.website.RoutingRules()
+    for rule in config.routing_rules:
+        if not _is_ours(rule, prefix):
+            rules.add_rule(rule)
+    for rule in _rules(config, prefix, version):
+        rules.add_rule(rule)
+    config.routing_rules = rules
+    with metrics.span('switch', version=version):
+        with metrics.timer('s3_put_website'):
+            s3pub.retry.call(
+                bucket.set_website_configuration, (config, ), metrics=metrics)
+
+def list_versions(bucket, prefix, metrics=s3pub.metrics.NULL):
+    '''
+    Return the versions stored for 'prefix', oldest first.
+
+    Versions of prefixes nested within 'prefix' are stored below its own, and
+    are left out.
+    '''
+    root = versions_prefix(prefix)
+    with metrics.timer('s3_list'):
+        names = [entry.name[len(root):].rstrip('/')
+            for entry in bucket.list(root, '/')]
+    return sorted(name for name in names if VERSION_RE.match(name))
+
+def collect(bucket, prefix, keep=DEFAULT_KEEP, live=None,
+        metrics=s3pub.metrics.NULL):
+    '''
+    Delete all but the newest 'keep' versions, and the live one; return the
+    versions deleted.
+    '''
+    versions = list_versions(bucket, prefix, metrics)
+    retained = set(versions[-keep:]) | set([live])
+    doomed = [version for version in versions if version not in retained]
+    if not doomed:
+        return []
+    with metrics.span('collect', versions=len(doomed)) as span:
+        with metrics.timer('s3_list'):
+            names = [
+                key.name for version in doomed
+                for key in bucket.list(version_prefix(prefix, version))]
+        span.set('keys', len(names))
+        # boto sends these a thousand at a time
+        with metrics.timer('s3_delete'):
+            mdr = s3pub.retry.call(
+                bucket.delete_keys, (names, ), {'quiet': True},
+                metrics=metrics)
+    if mdr.errors:
+        raise DeployError(u'could not delete {} keys of old versions'.format(
+            len(mdr.errors)))
+    return doomed
+
+def _digest(files):
+    '''
+    Return a short digest identifying the contents of a tree.
+    '''
+    digest = hashlib.sha1()
+    for rel, (_, md5) in sorted(iteritems(files)):
+        digest.update(u'{}\0{}\n'.format(rel, md5[0]).encode('utf-8'))
+    return digest.hexdigest()[:10]
+
+def _copy(bucket, src_name, dst_name, metrics):
+    with metrics.timer('s3_copy'):
+        s3pub.retry.call(
+            bucket.copy_key, (dst_name, bucket.name, src_name),
+            {'headers': {'x-amz-acl': 'public-read'}}, metrics=metrics)
+    metrics.incr('files_copied')
+
+def _inval_paths(prefix):
+    '''
+    Return the paths to invalidate after switching versions: the redirects
+    cached for the old version, under the whole prefix.
+    '''
+    return [_base(prefix) + '*']
+
+def deploy(src, dst, creds, metrics=s3pub.metrics.NULL, pool=None,
+        conn=None, keep=DEFAULT_KEEP, hashes=None, clock=time.time):
+    '''
+    Upload 'src' as a new version of 'dst', make it live and delete old
+    versions.
+
+    Return (version, paths to invalidate).  If the tree is identical to the
+    live version, nothing is uploaded, and there is nothing to invalidate.
+    '''
+    conn = conn or s3pub.upload.connect(creds)
+    with s3pub.workers.default_pool(pool) as pool:
+        if hashes is None:
+            hashes = s3pub.hashcache.HashCache()
+
+        bucket_name, prefix = s3pub.upload._split_dest(dst)
+        bucket = conn.get_bucket(bucket_name)
+        config = _get_website(bucket, metrics)
+        live = live_version(config, prefix)
+
+        with metrics.span('scan') as span:
+            paths = s3pub.upload._walk(src, '')
+            span.set('files', len(paths))
+        with metrics.span('hash') as span:
+            md5s = pool.map(hashes.md5, [lpath for lpath, _ in paths])
+            span.set('files', len(paths))
+        # relative path -> (local path, md5 tuple)
+        files = dict(
+            (rel, (lpath, md5)) for (lpath, rel), md5 in zip(paths, md5s))
+        _check_error_page(config, prefix, lambda name: name in files)
+
+        digest = _digest(files)
+        if live and live.endswith('-' + digest):
+            return live, []
+        version = time.strftime(VERSION_FORMAT, time.gmtime(clock())) + \
+            '-' + digest
+        target = version_prefix(prefix, version)
+
+        # keys of the live version that can be copied rather than uploaded, by
+        # contents and type
+        sources = {}
+        if live:
+            source = version_prefix(prefix, live)
+            entries = s3pub.manifest.load(bucket, source, metrics)
+            if entries is None:
+                entries = s3pub.upload._list(bucket, source, metrics)
+            for name, (etag, _) in iteritems(entries):
+                sources.setdefault(
+                    (etag, s3pub.upload._content_type(name)), name)
+
+        copies = []
+        uploads = []
+        for rel, (lpath, md5) in iteritems(files):
+            etag = md5[0].strip('"')
+            name = sources.get((etag, s3pub.upload._content_type(rel)))
+            if name:
+                copies.append((name, target + rel))
+            else:
+                uploads.append((rel, md5[2], (lpath, (md5, target + rel))))
+
+        if copies:
+            with metrics.span('copy', keys=len(copies)):
+                pool.map(lambda pair: _copy(bucket, pair[0], pair[1], metrics),
+                    copies)
+        if uploads:
+            with metrics.span('upload', files=len(uploads)):
+                progress = s3pub.progress.UploadProgress(
+                    len(uploads), sum(size for _, size, _ in uploads))
+                for phase in s3pub.schedule.phases(uploads, ()):
+                    pool.map(
+                        lambda item: s3pub.upload._upload(
+                            bucket, item[0], item[1][1], item[1][0], progress,
+                            metrics),
+                        phase,
+                    )
+                progress.finish()
+
+        s3pub.manifest.save(bucket, target, dict(
+            (target + rel, (md5[0].strip('"'), md5[2]))
+            for rel, (_, md5) in iteritems(files)), metrics)
+        _switch(bucket, config, prefix, version, metrics)
+        collect(bucket, prefix, keep, version, metrics)
+        return version, _inval_paths(prefix)
+
+def versions(dst, creds, conn=None):
+    '''
+    Return the versions stored for 'dst', oldest first, and the live one.
+    '''
+    conn = conn or s3pub.upload.connect(creds)
+    bucket_name, prefix = s3pub.upload._split_dest(dst)
+    bucket = conn.get_bucket(bucket_name)
+    config = _get_website(bucket, s3pub.metrics.NULL)
+    return list_versions(bucket, prefix), live_version(config, prefix)
+
+def rollback(dst, creds, version=None, metrics=s3pub.metrics.NULL,
+        conn=None):
+    '''
+    Point 'dst' at an earlier version; by default, the one before the live
+    version.
+
+    Return (version, paths to invalidate).
+    '''
+    conn = conn or s3pub.upload.connect(creds)
+    bucket_name, prefix = s3pub.upload._split_dest(dst)
+    bucket = conn.get_bucket(bucket_name)
+    config = _get_website(bucket, metrics)
+    live = live_version(config, prefix)
+    versions = list_versions(bucket, prefix, metrics)
+
+    if version is None:
+        older = [v for v in versions if live is None or v < live]
+        if not older:
+            raise DeployError(u'no version older than {} to roll back to'
+                .format(live))
+        version = older[-1]
+    elif version not in versions:
+        raise DeployError(u'no such version: {}'.format(version))
+    if version == live:
+        return version, []
+
+    _check_error_page(config, prefix, lambda name: bucket.get_key(
+        version_prefix(prefix, version) + name) is not None)
+    _switch(bucket, config, prefix, version, metrics)
+    return version, _inval_paths(prefix)
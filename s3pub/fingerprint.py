@@ -0,0 +1,106 @@
+'''
+Fast fingerprints of file contents.
+
+S3 compares files by MD5, but deciding whether a local file changed since its
+MD5 was last computed only needs a hash that is fast: when a file's size or
+modification time changed but its fingerprint didn't, its MD5 is reused.
+xxHash and BLAKE3 are used if installed; otherwise SHA-1, which the standard
+library computes faster than MD5 on most machines.
+'''
+
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import zlib
+
+# bytes read from a file at once
+CHUNK = 1024 * 1024
+
+class _CRC32(object):
+    '''
+    zlib's CRC-32 with a hashlib-like interface.
+    '''
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        return '{:08x}'.format(self._value & 0xffffffff)
+
+def _xxh3():
+    import xxhash
+    return xxhash.xxh3_128()
+
+def _blake3():
+    import blake3
+    return blake3.blake3()
+
+# name -> factory, in order of preference; 'md5' means no separate
+# fingerprint, only MD5
+ALGORITHMS = [
+    ('xxh3', _xxh3),
+    ('blake3', _blake3),
+    ('sha1', hashlib.sha1),
+    ('crc32', _CRC32),
+    ('md5', None),
+]
+
+def available():
+    '''
+    Return the names of the algorithms that can be used here.
+    '''
+    names = []
+    for name, factory in ALGORITHMS:
+        try:
+            factory and factory()
+        except (ImportError, AttributeError):
+            continue
+        names.append(name)
+    return names
+
+def default():
+    return available()[0]
+
+def new(name):
+    '''
+    Return a new hash object for an algorithm, or None for 'md5'.
+    '''
+    factory = dict(ALGORITHMS)[name]
+    return factory and factory()
+
+def md5_tuple(md5, size):
+    '''
+    Return boto's (hex_md5, base64_md5, filesize) tuple.
+    '''
+    return (md5.hexdigest(), base64.b64encode(md5.digest()).decode('ascii'),
+        size)
+
+def fingerprint(lpath, name):
+    '''
+    Return the fingerprint of a local file.
+    '''
+    digest = new(name)
+    with open(lpath, 'rb') as fp:
+        for data in iter(lambda: fp.read(CHUNK), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def md5_and_fingerprint(lpath, name):
+    '''
+    Return (boto's MD5 tuple, fingerprint) for a local file, reading it once.
+
+    The fingerprint is None for 'md5'.
+    '''
+    md5 = hashlib.md5()
+    digest = new(name)
+    size = 0
+    with open(lpath, 'rb') as fp:
+        for data in iter(lambda: fp.read(CHUNK), b''):
+            md5.update(data)
+            if digest is not None:
+                digest.update(data)
+            size += len(data)
+    return md5_tuple(md5, size), digest and digest.hexdigest()
@@ -0,0 +1,114 @@
+'''
+A cache of local file digests, for processes that publish repeatedly.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+
+import s3pub.fingerprint
+import s3pub.jsonfile
+
+VERSION = 1
+
+class HashCache(object):
+    '''
+    Remember the MD5s of local files, keyed on path.
+
+    An entry is reused while the file's size, modification time and inode are
+    unchanged, so a file is only read again after it has been modified.  Once
+    it has, its fingerprint (see s3pub.fingerprint) is computed first, and
+    only if that changed is its MD5 computed again; a fresh checkout changes
+    every modification time, but few contents.
+
+    With a 'path', entries can be saved and loaded again by later runs.
+    Without one, fingerprints aren't computed: within one process, a new
+    modification time nearly always means new contents.
+
+    One cache can be shared by several threads; files are read outside its
+    lock.
+    '''
+    def __init__(self, path=None, algorithm=None):
+        self.path = path
+        self.algorithm = algorithm or s3pub.fingerprint.default()
+        # lpath -> ((size, mtime, inode), md5 tuple, fingerprint)
+        self._entries = {}
+        # paths looked up since loading; only these are saved
+        self._used = set()
+        self.hits = 0
+        self.fingerprint_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def md5(self, lpath):
+        '''
+        Return boto's (hex_md5, base64_md5, filesize) tuple for a local file.
+        '''
+        stat = os.stat(lpath)
+        key = (stat.st_size, stat.st_mtime, stat.st_ino)
+        with self._lock:
+            entry = self._entries.get(lpath)
+            self._used.add(lpath)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+        if entry is not None and entry[2] and entry[1][2] == stat.st_size:
+            digest = s3pub.fingerprint.fingerprint(lpath, self.algorithm)
+            if digest == entry[2]:
+                with self._lock:
+                    self.fingerprint_hits += 1
+                    self._entries[lpath] = (key, entry[1], digest)
+                return entry[1]
+        md5, digest = s3pub.fingerprint.md5_and_fingerprint(
+            lpath, self.path and self.algorithm or 'md5')
+        with self._lock:
+            self.misses += 1
+            self._entries[lpath] = (key, md5, digest)
+        return md5
+
+    def load(self):
+        '''
+        Read entries saved to 'path', if any; fingerprints made with another
+        algorithm are ignored, and so is a file that can't be read.
+        '''
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            return
+        same = data.get('algorithm') == self.algorithm
+        entries = {}
+        try:
+            for lpath, (size, mtime, inode, hex_md5, b64_md5, digest) in \
+                    data['entries'].items():
+                entries[lpath] = (
+                    (size, mtime, inode),
+                    (hex_md5, b64_md5, size),
+                    same and digest or None,
+                )
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # damaged or edited by hand; start again, like another version
+            return
+        self._entries.update(entries)
+
+    def save(self):
+        '''
+        Write the entries of files looked up since loading to 'path'.
+        '''
+        entries = {}
+        with self._lock:
+            for lpath in self._used:
+                (size, mtime, inode), md5, digest = self._entries[lpath]
+                entries[lpath] = [size, mtime, inode, md5[0], md5[1], digest]
+        s3pub.jsonfile.write_json_atomic(self.path, {
+            'version': VERSION,
+            'algorithm': self.algorithm,
+            'entries': entries,
+        })
+
+    def __len__(self):
+        return len(self._entries)
@@ -4,32 +4,63 @@ CloudFront invalidation routines.
 
 from __future__ import absolute_import, print_function
 
-from boto.cloudfront import CloudFrontConnection
 import time
 
+import s3pub.metrics
 import s3pub.progress
+import s3pub.retry
 
-def get_distribution(connection, distrib_id):
+# paths CloudFront accepts in a single invalidation request
+MAX_INVALIDATION_PATHS = 3000
+# wildcard paths CloudFront allows in progress at once, per distribution
+MAX_WILDCARD_PATHS = 15
+
+def connect(creds):
+    '''
+    Return a new CloudFrontConnection using the given Credentials.
+    '''
+    # boto.cloudfront is slow to import; only load it when it's used
+    from boto.cloudfront import CloudFrontConnection
+    return CloudFrontConnection(**creds.as_dict())
+
+def get_distribution(connection, distrib_id, metrics=s3pub.metrics.NULL):
     '''
     Return a boto Distribution object for a distribution ID.
     '''
-    dists = [i for i in connection.get_all_distributions() if
-        i.id == distrib_id]
+    with metrics.timer('cf_list_distributions'):
+        dists = [i for i in connection.get_all_distributions() if
+            i.id == distrib_id]
     if dists:
         return dists[0]
     raise ValueError('invalid distribution id: {}'.format(distrib_id))
 
-def do_invalidate(distrib_id, inval_keys, creds):
+def submit(connection, distrib_id, inval_keys, metrics=s3pub.metrics.NULL):
+    '''
+    Create an invalidation request without waiting for it; return it.
+    '''
+    distrib = get_distribution(connection, distrib_id, metrics)
+    with metrics.timer('cf_create_invalidation'):
+        return s3pub.retry.call(
+            connection.create_invalidation_request,
+            (distrib.id, inval_keys),
+            metrics=metrics,
+        )
+
+def do_invalidate(distrib_id, inval_keys, creds, metrics=s3pub.metrics.NULL,
+        conn=None):
     '''
     Send a CloudFront invalidation request for the given objects.
+
+    'conn' is a CloudFrontConnection to reuse; if omitted, one is opened using
+    'creds'.
     '''
-    cf = CloudFrontConnection(**creds.as_dict())
-    distrib = get_distribution(cf, distrib_id)
-    req = cf.create_invalidation_request(distrib.id, inval_keys)
+    cf = conn or connect(creds)
+    with metrics.span('invalidate', paths=len(inval_keys)):
+        req = submit(cf, distrib_id, inval_keys, metrics)
 
-    pbar = s3pub.progress.InvalidationProgressBar(req.id)
-    for _ in pbar(Monitor(cf, distrib_id, req.id)):
-        pass
+        pbar = s3pub.progress.invalidation_progress(req.id)
+        for _ in pbar(Monitor(cf, distrib_id, req.id, metrics)):
+            pass
     print('Done.')
 
 class Monitor(object):
@@ -41,10 +72,12 @@ class Monitor(object):
     # seconds to wait between CloudFront invalidation request status updates
     POLL_DELAY = 5
 
-    def __init__(self, connection, distrib_id, req_id):
+    def __init__(self, connection, distrib_id, req_id,
+            metrics=s3pub.metrics.NULL):
         self.connection = connection
         self.distrib_id = distrib_id
         self.req_id = req_id
+        self.metrics = metrics
         self.last_req = 0
 
     def __iter__(self):
@@ -54,11 +87,15 @@ class Monitor(object):
         now = time.time()
         if now - self.last_req > self.POLL_DELAY:
             self.last_req = now
-            if self.connection.invalidation_request_status(
-                    self.distrib_id, self.req_id).status == 'Completed':
+            with self.metrics.timer('cf_invalidation_status'):
+                status = self.connection.invalidation_request_status(
+                    self.distrib_id, self.req_id).status
+            if status == 'Completed':
                 raise StopIteration
         
         time.sleep(self.ANIMATE_DELAY)
         # iterate indefinitely
         return True
 
+    __next__ = next
+
@@ -0,0 +1,22 @@
+'''
+State files kept as JSON: the watch status, the invalidation spool and the
+hash cache.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import os.path
+import tempfile
+
+def write_json_atomic(path, data):
+    '''
+    Replace the file at 'path' with 'data' as JSON, without ever leaving a
+    partially written file in its place.
+    '''
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.s3pub-')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(data, fp, indent=2, sort_keys=True)
+    os.rename(tmp, path)
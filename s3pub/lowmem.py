@@ -0,0 +1,264 @@
+'''
+Publishing trees with more files than can be compared in memory.
+
+A normal publish holds the local tree, the listing of the destination and the
+differences between them in memory, which for millions of files is more than
+many machines have.  Here the local tree and the listing are written to an
+SQLite database in a temporary file as they are read, and compared there;
+uploads and deletions are read back from it a batch at a time.  Memory use
+then stays the same whatever the number of files.
+
+The manifest (see s3pub.manifest) would have to be held in memory too, so
+the bucket is always listed, and a manifest left by an earlier publish is
+removed if anything changes.
+'''
+
+from __future__ import absolute_import
+
+import collections
+import os
+import posixpath
+import sqlite3
+import tempfile
+
+import s3pub.invalidate
+import s3pub.manifest
+import s3pub.metrics
+import s3pub.progress
+import s3pub.schedule
+import s3pub.upload
+import s3pub.workers
+
+# files hashed at once, and keys removed per request
+BATCH = 1000
+# KiB of database pages SQLite may keep in memory
+CACHE_KIB = 8 * 1024
+
+SCHEMA = '''
+CREATE TABLE local (
+    rpath TEXT PRIMARY KEY,
+    lpath TEXT NOT NULL
+);
+CREATE TABLE remote (
+    rpath TEXT PRIMARY KEY,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE upload (
+    rpath TEXT PRIMARY KEY,
+    lpath TEXT NOT NULL,
+    md5 TEXT NOT NULL,
+    b64 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    phase INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+class Index(object):
+    '''
+    Local files and remote keys, compared in a temporary SQLite database.
+
+    Rows are only ever read back through cursors or in batches, so none of
+    the tables has to fit in memory.
+    '''
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='s3pub-', suffix='.sqlite')
+        os.close(fd)
+        self._db = sqlite3.connect(self.path)
+        # the database is thrown away afterwards, so needn't survive a crash
+        for pragma in ['journal_mode = OFF', 'synchronous = OFF',
+                'temp_store = FILE', 'cache_size = -{}'.format(CACHE_KIB)]:
+            self._db.execute('PRAGMA ' + pragma)
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._db.close()
+        os.remove(self.path)
+
+    def _insert(self, sql, rows):
+        '''
+        Insert rows from an iterable, without holding them all; return the
+        number inserted.
+        '''
+        count = self._db.executemany(sql, rows).rowcount
+        self._db.commit()
+        return count
+
+    def add_local(self, paths):
+        '''
+        Record (local, remote) paths, as yielded by s3pub.upload._iwalk.
+        '''
+        return self._insert(
+            'INSERT INTO local (rpath, lpath) VALUES (?, ?)',
+            ((rpath, lpath) for lpath, rpath in paths))
+
+    def add_remote(self, keys):
+        '''
+        Record (key name, etag, size) for the keys in the destination.
+        '''
+        return self._insert(
+            'INSERT INTO remote (rpath, etag, size) VALUES (?, ?, ?)', keys)
+
+    def diff(self, pool, hashes=None):
+        '''
+        Hash the local files, BATCH at a time on 'pool', and record those
+        that differ from their keys for upload.
+
+        Return (files, bytes) to upload.
+        '''
+        last = ''
+        while True:
+            # a page at a time, since inserting would reset an open cursor
+            # on some versions of Python
+            rows = self._db.execute(
+                'SELECT local.rpath, local.lpath, remote.etag FROM local '
+                'LEFT JOIN remote ON remote.rpath = local.rpath '
+                'WHERE local.rpath > ? ORDER BY local.rpath LIMIT ?',
+                (last, BATCH)).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            md5s = pool.map(
+                lambda row: s3pub.upload._compute_md5(row[1], hashes), rows)
+            self._db.executemany(
+                'INSERT INTO upload (rpath, lpath, md5, b64, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(rpath, lpath, md5[0], md5[1], md5[2])
+                    for (rpath, lpath, etag), md5 in zip(rows, md5s)
+                    if etag != md5[0].strip('"')])
+        self._db.commit()
+        return tuple(self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM upload').fetchone())
+
+    def has_deletions(self):
+        '''
+        Return True if there are keys that don't exist locally.
+        '''
+        return self._db.execute(
+            'SELECT EXISTS (SELECT 1 FROM remote WHERE rpath NOT IN '
+            '(SELECT rpath FROM local))').fetchone()[0] == 1
+
+    def deletions(self):
+        '''
+        Yield lists of up to BATCH keys that don't exist locally.
+        '''
+        cursor = self._db.execute(
+            'SELECT rpath FROM remote WHERE rpath NOT IN '
+            '(SELECT rpath FROM local) ORDER BY rpath')
+        while True:
+            rows = cursor.fetchmany(BATCH)
+            if not rows:
+                return
+            yield [rpath for rpath, in rows]
+
+    def uploads(self, patterns=s3pub.schedule.DEFAULT_PHASES,
+            is_index=lambda name: False):
+        '''
+        Yield (phase, local path, remote path, boto's MD5 tuple) for each
+        upload, in the order given by s3pub.schedule.phases.
+        '''
+        self._db.create_function(
+            'phase_index', 1,
+            lambda rpath: s3pub.schedule.phase_index(
+                rpath, patterns, is_index))
+        self._db.execute('UPDATE upload SET phase = phase_index(rpath)')
+        self._db.commit()
+        cursor = self._db.execute(
+            'SELECT phase, lpath, rpath, md5, b64, size FROM upload '
+            'ORDER BY phase, size DESC, rpath')
+        for phase, lpath, rpath, md5, b64, size in cursor:
+            yield phase, lpath, rpath, (md5, b64, size)
+
+class _Modified(object):
+    '''
+    The paths to invalidate, until there are too many to list.
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix.rstrip('/')
+        self.paths = []
+        self.overflowed = False
+
+    def extend(self, paths):
+        if self.overflowed:
+            return
+        self.paths.extend(paths)
+        if len(self.paths) > s3pub.invalidate.MAX_INVALIDATION_PATHS:
+            self.paths = [self.prefix and self.prefix + '/*' or '*']
+            self.overflowed = True
+
+def publish(src, bucket, prefix, delete, metrics=s3pub.metrics.NULL,
+        pool=None, phases=s3pub.schedule.DEFAULT_PHASES, hashes=None):
+    '''
+    Synchronize 'prefix' in 'bucket' with the local tree 'src', keeping the
+    comparison on disk; see do_upload, which calls this if 'low_memory' is
+    set.
+
+    Return a list of remote keys modified; if there are more than
+    MAX_INVALIDATION_PATHS (see s3pub.invalidate), a wildcard covering the
+    prefix instead.
+    '''
+    manifest_name = s3pub.manifest.key_name(prefix)
+    modified = _Modified(prefix)
+    with s3pub.workers.default_pool(pool) as pool, Index() as index:
+        with metrics.span('scan') as span:
+            span.set('files', index.add_local(
+                s3pub.upload._iwalk(src, prefix)))
+        with metrics.span('list') as span:
+            span.set('keys', index.add_remote(
+                (key.name, key.etag.strip('"'), key.size)
+                for key in bucket.list(prefix) if key.name != manifest_name))
+        with metrics.span('hash') as span:
+            files, total = index.diff(pool, hashes)
+            span.set('changed', files)
+
+        removed = delete and index.has_deletions()
+        if not files and not removed:
+            return []
+        indexname = s3pub.upload._get_index_doc(bucket, metrics)
+        # the manifest can't be brought up to date without holding it
+        s3pub.manifest.discard(bucket, prefix, metrics)
+
+        if files:
+            with metrics.span('upload', files=files):
+                progress = s3pub.progress.UploadProgress(files, total)
+                tasks = collections.deque()
+                current = None
+                for phase, lpath, rpath, md5 in index.uploads(
+                        phases,
+                        lambda name: posixpath.basename(name) == indexname):
+                    if phase != current:
+                        # a phase starts once the last one is done
+                        while tasks:
+                            tasks.popleft().result()
+                        current = phase
+                    # bound the uploads queued ahead of the workers
+                    while len(tasks) >= 2 * pool.size:
+                        tasks.popleft().result()
+                    tasks.append(pool.submit(
+                        s3pub.upload._upload, bucket, lpath, rpath, md5,
+                        progress, metrics))
+                    modified.extend([rpath])
+                    if posixpath.basename(rpath) == indexname:
+                        # index paths with and without trailing slash
+                        modified.extend([
+                            posixpath.dirname(rpath),
+                            posixpath.dirname(rpath) + '/'])
+                while tasks:
+                    tasks.popleft().result()
+                progress.finish()
+
+        if removed:
+            with metrics.span('delete') as span:
+                count = 0
+                for keys in index.deletions():
+                    s3pub.upload._delete_keys(bucket, keys, metrics)
+                    modified.extend(keys)
+                    count += len(keys)
+                span.set('keys', count)
+    return modified.paths
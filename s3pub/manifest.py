@@ -0,0 +1,135 @@
+'''
+A record of the keys under a prefix, stored in the bucket beside them.
+
+Listing a large prefix takes a request per thousand keys; after a publish,
+s3pub already knows what it left behind, so it writes that down as a single
+gzipped JSON object, and the next publish diffs against it instead.  The
+manifest is removed before a publish changes anything and rewritten once it
+has finished, so an interrupted publish leaves no manifest rather than a
+wrong one.
+
+Anything that changes the bucket by other means makes the manifest stale.
+A manifest is only trusted if it is younger than MAX_AGE and a small random
+sample of the keys it lists still match when fetched with HEAD requests;
+otherwise the prefix is listed as usual.
+'''
+
+from __future__ import absolute_import
+
+import gzip
+import io
+import json
+import random
+import time
+
+import boto.exception
+
+import s3pub.metrics
+import s3pub.retry
+
+NAME = '.s3pub-manifest.json.gz'
+VERSION = 1
+# seconds after which a manifest is replaced by a fresh listing
+MAX_AGE = 24 * 60 * 60
+# keys checked with HEAD requests before a manifest is trusted
+SAMPLE_SIZE = 3
+
+def key_name(prefix):
+    '''
+    Return the name of the manifest for keys under 'prefix'.
+    '''
+    prefix = prefix.rstrip('/')
+    return (prefix and prefix + '/' or '') + NAME
+
+def encode(prefix, entries, now=None):
+    '''
+    Return a manifest of 'entries', a dict of key -> (etag, size), as bytes.
+    '''
+    data = json.dumps({
+        'version': VERSION,
+        'prefix': prefix,
+        'written': time.time() if now is None else now,
+        'keys': entries,
+    }, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fp:
+        fp.write(data)
+    return buf.getvalue()
+
+def decode(prefix, data, now=None):
+    '''
+    Return the entries in a manifest, or None if it isn't usable.
+    '''
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(data)) as fp:
+            manifest = json.loads(fp.read().decode('utf-8'))
+        if manifest['version'] != VERSION or manifest['prefix'] != prefix:
+            return None
+        now = time.time() if now is None else now
+        if not 0 <= now - manifest['written'] <= MAX_AGE:
+            return None
+        return dict(
+            (name, (etag, size))
+            for name, (etag, size) in manifest['keys'].items())
+    except (IOError, EOFError, ValueError, TypeError, KeyError):
+        return None
+
+def _consistent(bucket, entries, metrics):
+    '''
+    Return True if a sample of 'entries' matches the keys in the bucket.
+    '''
+    for name in random.sample(
+            sorted(entries), min(SAMPLE_SIZE, len(entries))):
+        with metrics.timer('s3_head'):
+            key = s3pub.retry.call(bucket.get_key, (name, ), metrics=metrics)
+        if key is None or (key.etag.strip('"'), key.size) != entries[name]:
+            return False
+    return True
+
+def load(bucket, prefix, metrics=s3pub.metrics.NULL):
+    '''
+    Return the entries recorded for 'prefix', or None if there is no
+    manifest that can be trusted.
+    '''
+    with metrics.span('manifest') as span:
+        try:
+            with metrics.timer('s3_get'):
+                key = s3pub.retry.call(
+                    bucket.get_key, (key_name(prefix), ), metrics=metrics)
+                data = key and s3pub.retry.call(
+                    key.get_contents_as_string, metrics=metrics)
+        except boto.exception.S3ResponseError:
+            data = None
+        entries = decode(prefix, data) if data else None
+        if entries is not None and not _consistent(bucket, entries, metrics):
+            entries = None
+        span.set('used', entries is not None)
+        if entries is not None:
+            span.set('keys', len(entries))
+    if entries is None:
+        metrics.incr('manifest_misses')
+    return entries
+
+def discard(bucket, prefix, metrics=s3pub.metrics.NULL):
+    '''
+    Remove the manifest for 'prefix', if there is one.
+    '''
+    with metrics.timer('s3_delete'):
+        s3pub.retry.call(
+            bucket.delete_key, (key_name(prefix), ), metrics=metrics)
+
+def save(bucket, prefix, entries, metrics=s3pub.metrics.NULL):
+    '''
+    Write the manifest for 'prefix'.
+
+    A PUT replaces an object all at once, so readers see either the old
+    manifest or the new one.
+    '''
+    data = encode(prefix, entries)
+    key = bucket.new_key(key_name(prefix))
+    with metrics.span('manifest_write', keys=len(entries), bytes=len(data)):
+        with metrics.timer('s3_put'):
+            s3pub.retry.call(
+                key.set_contents_from_string, (data, ),
+                {'headers': {'Content-Type': 'application/gzip'}},
+                metrics=metrics)
@@ -0,0 +1,283 @@
+'''
+Timing spans, counters and latency histograms for publish runs.
+
+Instrumented code receives a recorder and calls 'span', 'timer', 'observe'
+and 'incr' on it.  By default it receives NULL, whose methods do nothing, so
+the cost of instrumentation when disabled is a method call per event.
+'''
+
+from __future__ import absolute_import, division
+
+import binascii
+import bisect
+import json
+import os
+import threading
+import time
+
+from six import iteritems
+
+# upper bounds, in seconds, of request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _NullSpan(object):
+    '''
+    A context manager that does nothing.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, name, value):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class NullMetrics(object):
+    '''
+    A recorder that discards everything; used when metrics are disabled.
+    '''
+    enabled = False
+
+    def span(self, name, **attrs):
+        return _NULL_SPAN
+
+    def timer(self, name):
+        return _NULL_SPAN
+
+    def observe(self, name, seconds):
+        pass
+
+    def incr(self, name, amount=1):
+        pass
+
+NULL = NullMetrics()
+
+def _new_id(nbytes):
+    return binascii.hexlify(os.urandom(nbytes)).decode('ascii')
+
+class _Span(object):
+    '''
+    A timed phase of work; nests under whichever span is open on this thread.
+    '''
+    def __init__(self, metrics, name, attrs):
+        self.metrics = metrics
+        self.name = name
+        self.attrs = attrs
+        self.span_id = _new_id(8)
+        self.parent_id = None
+        self.start = self.end = None
+
+    def set(self, name, value):
+        '''
+        Attach an attribute to the span.
+        '''
+        self.attrs[name] = value
+
+    def __enter__(self):
+        stack = self.metrics._stack()
+        if stack:
+            self.parent_id = stack[-1].span_id
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.metrics._stack().pop()
+        self.metrics._finish(self)
+        return False
+
+class _Timer(object):
+    '''
+    Record the duration of a block into a latency histogram.
+    '''
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *_):
+        self.metrics.observe(self.name, time.time() - self.start)
+        return False
+
+    def set(self, name, value):
+        pass
+
+class Histogram(object):
+    '''
+    Cumulative latency histogram with fixed bucket bounds.
+    '''
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        '''
+        Return the upper bound of the bucket holding the q-th quantile.
+        '''
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+class Metrics(object):
+    '''
+    Collects spans, counters and histograms for a single run.
+
+    Safe to use from several threads at once.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.trace_id = _new_id(16)
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def span(self, name, **attrs):
+        '''
+        Return a context manager timing a phase of work.
+        '''
+        return _Span(self, name, attrs)
+
+    def timer(self, name):
+        '''
+        Return a context manager adding its duration to histogram 'name'.
+        '''
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            try:
+                hist = self.histograms[name]
+            except KeyError:
+                hist = self.histograms[name] = Histogram()
+            hist.add(seconds)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def phase_durations(self):
+        '''
+        Return a dict mapping span names to their total duration in seconds.
+        '''
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = \
+                totals.get(span.name, 0.0) + (span.end - span.start)
+        return totals
+
+    def summary(self):
+        '''
+        Return a JSON-serializable summary of the run.
+        '''
+        phases = self.phase_durations()
+        uploaded = self.counters.get('bytes_uploaded', 0)
+        upload_time = phases.get('upload')
+        return {
+            'phases': phases,
+            'requests': dict(
+                (name, hist.as_dict())
+                for name, hist in iteritems(self.histograms)),
+            'counters': dict(self.counters),
+            'bytes_per_sec':
+                upload_time and uploaded / upload_time or None,
+        }
+
+    def write_json(self, fp):
+        json.dump(self.summary(), fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+    def write_prometheus(self, fp):
+        '''
+        Write metrics in the Prometheus text exposition format.
+        '''
+        lines = [
+            '# TYPE s3pub_phase_seconds gauge',
+        ]
+        for name, total in sorted(iteritems(self.phase_durations())):
+            lines.append(
+                's3pub_phase_seconds{{phase="{}"}} {!r}'.format(name, total))
+        for name, value in sorted(iteritems(self.counters)):
+            lines.append('# TYPE s3pub_{}_total counter'.format(name))
+            lines.append('s3pub_{}_total {}'.format(name, value))
+        for name, hist in sorted(iteritems(self.histograms)):
+            metric = 's3pub_{}_seconds'.format(name)
+            lines.append('# TYPE {} histogram'.format(metric))
+            cumulative = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                cumulative += count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(
+                    metric, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(
+                metric, hist.count))
+            lines.append('{}_sum {!r}'.format(metric, hist.sum))
+            lines.append('{}_count {}'.format(metric, hist.count))
+        fp.write('\n'.join(lines) + '\n')
+
+    def write_spans(self, fp):
+        '''
+        Write finished spans as JSON lines, modelled on OpenTelemetry spans.
+        '''
+        for span in sorted(self.spans, key=lambda s: s.start):
+            json.dump({
+                'trace_id': self.trace_id,
+                'span_id': span.span_id,
+                'parent_span_id': span.parent_id,
+                'name': span.name,
+                'start_time_unix_nano': int(span.start * 1e9),
+                'end_time_unix_nano': int(span.end * 1e9),
+                'attributes': span.attrs,
+            }, fp, sort_keys=True)
+            fp.write('\n')
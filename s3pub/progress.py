@@ -1,68 +1,188 @@
 '''
-Progress bar customizations.
+Progress reporting.
 '''
 
-import progressbar
+from __future__ import absolute_import, division
 
-# Notes about progressbar: each ProgressBar has only one maximum, but we
-# ideally want two (files and bytes).  Trying to animate two bars
-# simultaneously just confuses progressbar.  We can work around this by
-# changing text widgets in the bar during each update.
+import collections
+import itertools
+import sys
+import threading
+import time
 
-TMPL = '{filename} ({cur}/{max}) '
+# Notes about UploadProgress: boto calls back into us several times per file,
+# from as many threads as there are upload workers.  Callbacks only store
+# numbers using operations that are atomic under the GIL (dict assignment,
+# deque append, itertools.count), and drawing is rate-limited; whichever
+# thread finds a redraw due takes a non-blocking lock and draws, while the
+# others carry on uploading.
 
-class UploadProgressBar(progressbar.ProgressBar):
-    def __init__(self, files):
+# seconds between redraws when stderr is a terminal (10 Hz)
+TTY_INTERVAL = 0.1
+# seconds between log lines when stderr is not a terminal
+LOG_INTERVAL = 10
+BAR_WIDTH = 20
+DEFAULT_COLUMNS = 80
+
+def _format_bytes(num):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if num < 1024:
+            break
+        num /= 1024
+    else:
+        unit = 'TiB'
+    return '{:.1f} {}'.format(num, unit)
+
+def _format_eta(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return '{}:{:02}:{:02}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def _bar(done, total):
+    filled = total and BAR_WIDTH * done // total or BAR_WIDTH
+    return '[' + '#' * filled + ' ' * (BAR_WIDTH - filled) + ']'
+
+def _columns(stream):
+    try:
+        from shutil import get_terminal_size
+    except ImportError:
+        return DEFAULT_COLUMNS
+    return get_terminal_size((DEFAULT_COLUMNS, 24)).columns
+
+class UploadProgress(object):
+    '''
+    Report progress through a set of uploads, as both file and byte counts.
+
+    On a terminal this redraws a line holding two bars at most 10 times a
+    second; otherwise it writes a log line every LOG_INTERVAL seconds.
+    '''
+    def __init__(self, total_files, total_bytes, stream=None, is_tty=None,
+            clock=time.time):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream or sys.stderr
+        if is_tty is None:
+            is_tty = getattr(self.stream, 'isatty', lambda: False)()
+        self.is_tty = is_tty
+        self.interval = is_tty and TTY_INTERVAL or LOG_INTERVAL
+        self.clock = clock
+        self.start_time = clock()
+        self.last_file = ''
+        # bytes sent so far for files currently being uploaded
+        self._inflight = {}
+        # sizes of completed files not yet counted into _done_bytes
+        self._completed = collections.deque()
+        self._done_bytes = 0
+        self._file_counter = itertools.count(1)
+        self._done_files = 0
+        self._next_draw = self.start_time + self.interval
+        self._draw_lock = threading.Lock()
+
+    def add_file(self, size):
         '''
-        Ctor.  'files' is a dictionary mapping local paths to file sizes.
+        Count one more file of 'size' bytes into the totals, for uploads that
+        are only known once they have started.
         '''
-        self.files = files
-        self.upload_num = 0
-        # 'uploaded_bytes' stores the number of bytes uploaded as of the last
-        # completed file.  This is important because 'update' expects the
-        # number of bytes towards the entire file set.
-        self.uploaded_bytes = 0
-        self.last_file = None
-        widgets = [
-            'placeholder',
-            progressbar.Percentage(),
-            ' ',
-            progressbar.Bar(left='[', right=']'),
-            ' ',
-            progressbar.ETA(),
-            ' ',
-            progressbar.FileTransferSpeed()
-        ]
-        super(UploadProgressBar, self).__init__(
-            widgets=widgets, maxval=sum(i for i in files.values()))
-
-    def change_file(self, path):
+        self.total_files += 1
+        self.total_bytes += size
+
+    def start_file(self, path):
         '''
-        Must be called before each 'update' call for a new file.
+        Called by a worker before it starts uploading 'path'.
         '''
-        if self.last_file:
-            self.uploaded_bytes += self.files[self.last_file]
+        self._inflight[path] = 0
         self.last_file = path
-        self.upload_num += 1
-        self.widgets[0] = TMPL.format(
-            filename=path, cur=self.upload_num, max=len(self.files))
 
-        # first call to this function should run the parent class's 'start'
-        if not self.start_time:
-            super(UploadProgressBar, self).start()
+    def update(self, path, done, _total=None):
+        '''
+        Record that 'done' bytes of 'path' have been sent; a boto callback.
+        '''
+        self._inflight[path] = done
+        self._maybe_draw()
+
+    def finish_file(self, path, size):
+        '''
+        Called by a worker once 'path', of 'size' bytes, is uploaded.
+        '''
+        self._inflight.pop(path, None)
+        self._completed.append(size)
+        self._done_files = next(self._file_counter)
+        self._maybe_draw()
+
+    def _maybe_draw(self):
+        now = self.clock()
+        if now < self._next_draw:
+            return
+        if not self._draw_lock.acquire(False):
+            return
+        try:
+            self._next_draw = now + self.interval
+            self._draw(now)
+        finally:
+            self._draw_lock.release()
+
+    def _drain(self):
+        '''
+        Return the number of bytes sent, folding in newly completed files.
+        '''
+        while True:
+            try:
+                self._done_bytes += self._completed.popleft()
+            except IndexError:
+                break
+        return self._done_bytes + sum(list(self._inflight.values()))
+
+    def _line(self, now):
+        sent = min(self._drain(), self.total_bytes)
+        elapsed = now - self.start_time
+        rate = elapsed > 0 and sent / elapsed or 0
+        eta = rate and (self.total_bytes - sent) / rate or None
+        files = self._done_files
+        if self.is_tty:
+            return '{}/{} files {} {}/{} {} {}/s ETA {} {}'.format(
+                files, self.total_files, _bar(files, self.total_files),
+                _format_bytes(sent), _format_bytes(self.total_bytes),
+                _bar(sent, self.total_bytes), _format_bytes(rate),
+                _format_eta(eta), self.last_file)
+        return 'uploaded {}/{} files, {}/{} ({}/s)'.format(
+            files, self.total_files, _format_bytes(sent),
+            _format_bytes(self.total_bytes), _format_bytes(rate))
 
-    def increment(self, val):
-        self.update(self.uploaded_bytes + val)
+    def _draw(self, now):
+        line = self._line(now)
+        if self.is_tty:
+            width = _columns(self.stream) - 1
+            self.stream.write('\r' + line[:width].ljust(width))
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
 
-    def start(self):
-        raise NotImplementedError('use change_file instead')
+    def finish(self):
+        '''
+        Draw the final state.
+        '''
+        with self._draw_lock:
+            self.last_file = ''
+            self._draw(self.clock())
+            if self.is_tty:
+                self.stream.write('\n')
 
-class InvalidationProgressBar(progressbar.ProgressBar):
+def invalidation_progress(req_id, stream=None):
     '''
-    Display an animated spinner, and periodically poll for completion.
+    Return a wrapper for an iterable that animates while it is consumed.
+
+    On a terminal this is a progressbar spinner; otherwise a single line is
+    written, and progressbar isn't imported at all.
     '''
-    def __init__(self, req_id):
-        super(InvalidationProgressBar, self).__init__(widgets=[
-            'Invalidation request {}: '.format(req_id),
-            progressbar.AnimatedMarker()
-        ])
+    stream = stream or sys.stderr
+    if not getattr(stream, 'isatty', lambda: False)():
+        stream.write('Waiting for invalidation request {}\n'.format(req_id))
+        return iter
+
+    import progressbar
+    return progressbar.ProgressBar(widgets=[
+        'Invalidation request {}: '.format(req_id),
+        progressbar.AnimatedMarker()
+    ])
@@ -0,0 +1,49 @@
+'''
+Retrying of requests rejected by AWS for exceeding request rates.
+
+boto already retries connection failures and most 5xx responses internally;
+this covers the throttling errors it passes through, so they can be counted.
+'''
+
+from __future__ import absolute_import
+
+import time
+
+import boto.exception
+
+import s3pub.metrics
+
+# error codes AWS uses to tell us to slow down
+THROTTLE_CODES = frozenset([
+    'SlowDown',
+    'Throttling',
+    'RequestLimitExceeded',
+    'TooManyInvalidationsInProgress',
+])
+MAX_ATTEMPTS = 5
+# seconds to wait before the first retry; doubles on each attempt
+BACKOFF = 0.5
+
+def is_throttle(exc):
+    '''
+    Return True if 'exc' is a boto error signalling request throttling.
+    '''
+    if not isinstance(exc, boto.exception.BotoServerError):
+        return False
+    return exc.status == 503 or exc.error_code in THROTTLE_CODES
+
+def call(func, args=(), kwargs=None, metrics=s3pub.metrics.NULL):
+    '''
+    Call func(*args, **kwargs), retrying with backoff while throttled.
+    '''
+    delay = BACKOFF
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return func(*args, **(kwargs or {}))
+        except boto.exception.BotoServerError as exc:
+            if not is_throttle(exc) or attempt == MAX_ATTEMPTS:
+                raise
+            metrics.incr('throttles')
+            metrics.incr('retries')
+        time.sleep(delay)
+        delay *= 2
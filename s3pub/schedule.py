@@ -0,0 +1,61 @@
+'''
+Ordering of uploads.
+
+Uploads run in phases, one after another, so that pages don't go live before
+the stylesheets, scripts and images they refer to.  Within a phase the
+largest files are started first: a big file started last keeps one worker
+busy long after the others have run out of work.
+'''
+
+from __future__ import absolute_import
+
+import fnmatch
+import posixpath
+
+# patterns, matched against file names, for each phase after the first;
+# files matching no pattern are uploaded in the first phase
+DEFAULT_PHASES = (('*.html', '*.htm'), )
+
+def parse_phases(values):
+    '''
+    Return phases from comma-separated lists of patterns, e.g. from the
+    command line.
+    '''
+    return tuple(
+        tuple(pattern.strip() for pattern in value.split(',')
+            if pattern.strip())
+        for value in values)
+
+def _matches(name, patterns):
+    name = posixpath.basename(name).lower()
+    return any(
+        fnmatch.fnmatchcase(name, pattern.lower()) for pattern in patterns)
+
+def phase_index(name, patterns=DEFAULT_PHASES, is_index=lambda name: False):
+    '''
+    Return the number of the phase a file belongs to; 0 is the first.
+    '''
+    if is_index(name):
+        return len(patterns) + 1
+    return next(
+        (idx + 1 for idx, group in enumerate(patterns)
+            if _matches(name, group)),
+        0)
+
+def phases(items, patterns=DEFAULT_PHASES, is_index=lambda name: False):
+    '''
+    Group uploads into phases; return a list of lists of items.
+
+    'items' is an iterable of (name, size, item) tuples.  Items whose name
+    matches none of 'patterns' come first, then those matching each group of
+    patterns in turn, then those for which 'is_index' is true.  Each phase is
+    sorted largest first, and empty phases are left out.
+    '''
+    groups = [[] for _ in range(len(patterns) + 2)]
+    for name, size, item in items:
+        groups[phase_index(name, patterns, is_index)].append(
+            (size, name, item))
+    return [
+        [item for _, _, item in sorted(
+            group, key=lambda entry: (-entry[0], entry[1]))]
+        for group in groups if group]
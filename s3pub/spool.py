@@ -0,0 +1,136 @@
+'''
+A local spool of CloudFront invalidations, shared between runs.
+
+CloudFront allows only a few invalidations in progress per distribution, and
+each takes minutes to complete, so deploys landing minutes apart shouldn't
+each send their own request and wait for it.  Instead their paths are queued
+here, per distribution.  While a request is in progress, newly queued paths
+are merged into the next one; a flush sends the merged batch once the earlier
+request has completed.
+
+The spool is a JSON file, locked while in use so that concurrent runs don't
+lose each other's paths.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os.path
+
+try:
+    import fcntl
+except ImportError:
+    # no locking on Windows
+    fcntl = None
+
+import s3pub.invalidate
+import s3pub.jsonfile
+import s3pub.metrics
+import s3pub.retry
+
+class Spool(object):
+    '''
+    Invalidations queued for each distribution, and the request last sent.
+
+    Use as a context manager: the spool is locked and read on entry, and
+    written back and unlocked on exit.  A Spool may be entered again later.
+    '''
+    def __init__(self, path):
+        self.path = path
+        # distribution ID -> {'pending': [path, ...], 'in_progress': ID}
+        self.entries = {}
+        self._lock = None
+
+    def __enter__(self):
+        self._lock = open(self.path + '.lock', 'a')
+        if fcntl is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            with open(self.path) as fp:
+                self.entries = json.load(fp)
+        except IOError:
+            self.entries = {}
+        except ValueError:
+            self.__exit__()
+            raise ValueError(
+                'invalidation spool is corrupt: {}'.format(self.path))
+        return self
+
+    def __exit__(self, *_):
+        try:
+            if self.entries or os.path.exists(self.path):
+                s3pub.jsonfile.write_json_atomic(self.path, self.entries)
+        finally:
+            # closing the file releases the lock
+            self._lock.close()
+            self._lock = None
+
+    def add(self, distrib_id, keys):
+        '''
+        Queue 'keys' for invalidation in 'distrib_id'.
+
+        Paths already queued aren't repeated, but paths in a request already
+        sent are queued again, since they may have been processed before the
+        latest upload.
+        '''
+        entry = self.entries.setdefault(
+            distrib_id, {'pending': [], 'in_progress': None})
+        entry['pending'] = sorted(set(entry['pending']) | set(keys))
+
+    def pending(self, distrib_id):
+        return list(self.entries.get(distrib_id, {}).get('pending', []))
+
+    def in_progress(self, distrib_ids=None):
+        '''
+        Return {distribution ID: request ID} for requests last seen in
+        progress.
+        '''
+        return dict(
+            (distrib_id, entry['in_progress'])
+            for distrib_id, entry in self.entries.items()
+            if entry['in_progress'] and
+                (distrib_ids is None or distrib_id in distrib_ids))
+
+    def flush(self, cf_conn, metrics=s3pub.metrics.NULL, distrib_ids=None):
+        '''
+        Send queued paths for each distribution (or those in 'distrib_ids')
+        whose last request has completed, without waiting for them.
+
+        Return a list of (distribution ID, request ID, number of paths, sent)
+        for every distribution with paths queued; the request ID is that of
+        the request sent, or if 'sent' is False, of the one still in progress
+        that holds them back.
+        '''
+        results = []
+        for distrib_id, entry in sorted(self.entries.items()):
+            if distrib_ids is not None and distrib_id not in distrib_ids:
+                continue
+            if entry['in_progress'] and _completed(
+                    cf_conn, distrib_id, entry['in_progress'], metrics):
+                entry['in_progress'] = None
+            keys = entry['pending']
+            if not keys:
+                if not entry['in_progress']:
+                    del self.entries[distrib_id]
+                continue
+            if entry['in_progress']:
+                results.append(
+                    (distrib_id, entry['in_progress'], len(keys), False))
+                continue
+
+            batch = keys[:s3pub.invalidate.MAX_INVALIDATION_PATHS]
+            with metrics.span('invalidate', paths=len(batch)):
+                req = s3pub.invalidate.submit(
+                    cf_conn, distrib_id, batch, metrics)
+            entry['in_progress'] = req.id
+            entry['pending'] = keys[len(batch):]
+            metrics.incr('invalidations_sent')
+            results.append((distrib_id, req.id, len(batch), True))
+        return results
+
+def _completed(cf_conn, distrib_id, req_id, metrics):
+    with metrics.timer('cf_invalidation_status'):
+        status = s3pub.retry.call(
+            cf_conn.invalidation_request_status, (distrib_id, req_id),
+            metrics=metrics).status
+    return status == 'Completed'
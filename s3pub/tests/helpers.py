@@ -0,0 +1,54 @@
+'''
+Fixtures shared by the tests.
+'''
+
+from __future__ import absolute_import
+
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+
+import mock
+
+# a small site, as written by with_tree
+FILES = {
+    'index.html': b'<html>',
+    'about/index.html': b'<html>about',
+    'css/site.css': b'body {}',
+    'img/logo.png': b'\x89PNG' * 100,
+}
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+def with_tree(func):
+    '''
+    Call func with a temporary directory holding FILES.
+    '''
+    @functools.wraps(func)
+    def wrapped():
+        tmp = tempfile.mkdtemp()
+        try:
+            for name, data in FILES.items():
+                path = os.path.join(tmp, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as fp:
+                    fp.write(data)
+            func(tmp)
+        finally:
+            shutil.rmtree(tmp)
+    return wrapped
+
+def key(name, data, content_type=None):
+    '''
+    Return a mock of a boto Key holding 'data', as listed or requested with
+    HEAD.
+    '''
+    result = mock.Mock(etag='"{}"'.format(md5(data)), size=len(data),
+        content_type=content_type)
+    # 'name' is taken by Mock's constructor
+    result.name = name
+    return result
@@ -0,0 +1,138 @@
+'''
+Tests for s3pub.archive.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+import mock
+from nose.tools import assert_equals, assert_false, assert_true, raises
+
+from s3pub import archive, workers
+
+FILES = [
+    ('index.html', b'<html>'),
+    ('css/site.css', b'body {}'),
+    ('about/index.html', b'<html>about'),
+    ('img/logo.png', b'\x89PNG' * 1000),
+]
+
+def _tar(mode='w:gz', files=FILES):
+    '''
+    Return the bytes of a tar archive holding 'files', a directory and a
+    symlink.
+    '''
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        info = tarfile.TarInfo('./css')
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+        for name, data in files:
+            info = tarfile.TarInfo('./' + name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('./link.html')
+        info.type = tarfile.SYMTYPE
+        info.linkname = 'index.html'
+        tar.addfile(info)
+    return buf.getvalue()
+
+def _read(src, stdin=None):
+    return [(name, fp.read()) for name, fp in archive.members(src, stdin)]
+
+def test_is_archive():
+    yield assert_true, archive.is_archive('site.tar.gz')
+    yield assert_true, archive.is_archive('SITE.ZIP')
+    yield assert_true, archive.is_archive('-')
+    yield assert_false, archive.is_archive('site')
+    yield assert_false, archive.is_archive('site.gz')
+
+def test_members():
+    '''
+    members: yields regular files with paths relative to the archive, from
+    files and from stdin.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        for suffix, mode in [('.tar', 'w'), ('.tar.gz', 'w:gz'),
+                ('.tar.bz2', 'w:bz2')]:
+            path = os.path.join(tmp, 'site' + suffix)
+            with open(path, 'wb') as fp:
+                fp.write(_tar(mode))
+            assert_equals(_read(path), FILES)
+
+        path = os.path.join(tmp, 'site.zip')
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('css/', b'')
+            for name, data in FILES:
+                zf.writestr(name, data)
+        assert_equals(_read(path), FILES)
+    finally:
+        shutil.rmtree(tmp)
+
+    stdin = mock.MagicMock(buffer=io.BytesIO(_tar()))
+    assert_equals(_read('-', stdin), FILES)
+
+@raises(ValueError)
+def test_members_outside():
+    _read('-', io.BytesIO(_tar(files=[('../etc/passwd', b'')])))
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+def test_publish():
+    '''
+    publish: uploads changed members, pages after other files and index
+    documents last, and deletes keys missing from the archive.
+    '''
+    entries = {
+        'www/css/site.css': (_md5(b'body {}'), 7),
+        'www/old.html': (_md5(b'old'), 3),
+    }
+    order = []
+    def upload(bucket, name, rpath, md5, fp, progress, metrics):
+        order.append((rpath, fp.read()))
+        fp.close()
+    bucket = mock.MagicMock()
+    bucket.delete_keys.return_value.errors = []
+
+    with mock.patch('s3pub.manifest.load', return_value=entries), \
+            mock.patch('s3pub.manifest.save') as save, \
+            mock.patch('s3pub.manifest.discard'), \
+            mock.patch('s3pub.upload._get_index_doc',
+                return_value='index.html'), \
+            mock.patch('s3pub.archive._upload', side_effect=upload), \
+            mock.patch('s3pub.progress.UploadProgress'):
+        inval = archive.publish(
+            '-', bucket, 'www', True, pool=workers.WorkerPool(1),
+            stdin=io.BytesIO(_tar()))
+
+    assert_equals(order, [
+        ('www/img/logo.png', b'\x89PNG' * 1000),
+        ('www/about/index.html', b'<html>about'),
+        ('www/index.html', b'<html>'),
+    ])
+    bucket.delete_keys.assert_called_once_with(['www/old.html'])
+    assert_equals(sorted(inval), [
+        'www', 'www/', 'www/about', 'www/about/', 'www/about/index.html',
+        'www/img/logo.png', 'www/index.html', 'www/old.html'])
+    assert_equals(sorted(save.call_args[0][2]), [
+        'www/about/index.html', 'www/css/site.css', 'www/img/logo.png',
+        'www/index.html'])
+
+@raises(ValueError)
+def test_publish_duplicate():
+    bucket = mock.MagicMock()
+    with mock.patch('s3pub.manifest.load', return_value={}), \
+            mock.patch('s3pub.manifest.discard'), \
+            mock.patch('s3pub.upload._get_index_doc', return_value=None), \
+            mock.patch('s3pub.archive._upload'):
+        archive.publish('-', bucket, '', True, pool=workers.WorkerPool(1),
+            stdin=io.BytesIO(_tar(files=FILES + FILES[:1])))
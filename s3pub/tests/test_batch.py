@@ -0,0 +1,159 @@
+'''
+Tests for s3pub.batch.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from nose.tools import assert_equals
+
+from s3pub import batch, hashcache, workers
+
+def test_load():
+    sites = batch.load([
+        {'src': 'blog', 'dest': 'bucket/blog', 'distrib_id': 'ABC'},
+        {'src': '/srv/docs', 'dest': 'other', 'delete': False},
+    ], '/batch')
+    yield assert_equals, [site.src for site in sites], \
+        ['/batch/blog', '/srv/docs']
+    yield assert_equals, [site.distrib_id for site in sites], ['ABC', None]
+    yield assert_equals, [site.delete for site in sites], [True, False]
+
+def check_load_invalid(entries):
+    try:
+        batch.load(entries)
+    except ValueError:
+        return
+    raise AssertionError('no ValueError for {!r}'.format(entries))
+
+def test_load_invalid():
+    for entries in [
+            None,
+            {'src': 'a', 'dest': 'b'},
+            [{'src': 'a'}],
+            [{'src': 'a', 'dest': 1}],
+            [{'src': 'a', 'dest': 'b', 'distrib': 'ABC'}]]:
+        yield check_load_invalid, entries
+
+def test_publish():
+    '''
+    publish: sites share the pool and hash cache, and one failing doesn't
+    stop the others.
+    '''
+    sites = [batch.Site('a', 'bucket/a'), batch.Site('b', 'bucket/b'),
+        batch.Site('c', 'bucket/c', delete=False)]
+    def do_upload(src, dest, delete, creds, metrics, pool, conn, **kwargs):
+        if src == 'b':
+            raise IOError('no such directory')
+        return [dest + '/index.html']
+    conn = mock.MagicMock()
+    pool = mock.MagicMock()
+    hashes = mock.MagicMock()
+
+    with mock.patch('s3pub.upload.do_upload', side_effect=do_upload) as up:
+        results, errors = batch.publish(sites, conn, pool, hashes=hashes)
+    assert_equals(results, {
+        sites[0]: ['bucket/a/index.html'],
+        sites[2]: ['bucket/c/index.html'],
+    })
+    assert_equals(list(errors), [sites[1]])
+    for args, kwargs in up.call_args_list:
+        assert_equals(args[5:], (pool, conn))
+        assert_equals(kwargs['hashes'], hashes)
+    assert_equals(
+        sorted((args[0], args[2]) for args, _ in up.call_args_list),
+        [('a', True), ('b', True), ('c', False)])
+
+def test_group_invalidations():
+    one = batch.Site('a', 'bucket/a', 'ONE')
+    two = batch.Site('b', 'bucket/b', 'ONE')
+    other = batch.Site('c', 'other', 'TWO')
+    results = {
+        one: ['a/x', 'a/y'],
+        two: ['b/x'],
+        other: [],
+        batch.Site('d', 'bucket/d'): ['d/x'],
+    }
+    yield assert_equals, batch.group_invalidations(results), \
+        {'ONE': ['a/x', 'a/y', 'b/x']}
+
+    results[other] = ['x']
+    with mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 2):
+        yield assert_equals, batch.group_invalidations(results), \
+            {'ONE': ['a/*', 'b/*'], 'TWO': ['x']}
+    with mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 0):
+        yield assert_equals, batch.group_invalidations(results), \
+            {'ONE': ['a/*', 'b/*'], 'TWO': ['*']}
+
+def test_group_invalidations_many_sites():
+    '''
+    group_invalidations: many sites on one distribution share a wildcard
+    covering their common prefix.
+    '''
+    results = dict(
+        (batch.Site(str(idx), 'bucket/docs/v{}/'.format(idx), 'ONE'),
+            ['docs/v{}/x'.format(idx)])
+        for idx in range(20))
+    with mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 10):
+        assert_equals(batch.group_invalidations(results),
+            {'ONE': ['docs/*']})
+    results[batch.Site('blog', 'bucket/blog', 'ONE')] = ['blog/x']
+    with mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 10):
+        assert_equals(batch.group_invalidations(results), {'ONE': ['*']})
+
+def test_invalidate():
+    '''
+    invalidate: sends one request per distribution, then waits for each.
+    '''
+    cf_conn = mock.MagicMock()
+    with mock.patch('s3pub.invalidate.submit') as submit:
+        with mock.patch('s3pub.invalidate.Monitor', return_value=[]) as mon:
+            assert_equals(
+                batch.invalidate(cf_conn, {'ONE': ['a'], 'TWO': ['b', 'c']}),
+                2)
+    assert_equals(
+        [args[1:3] for args, _ in submit.call_args_list],
+        [('ONE', ['a']), ('TWO', ['b', 'c'])])
+    assert_equals(mon.call_count, 2)
+
+def test_publish_hash_cache():
+    '''
+    publish: sites fill the HashCache they are given, even while that is
+    empty.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        sites = []
+        for name in ['a', 'b']:
+            os.mkdir(os.path.join(tmp, name))
+            with open(os.path.join(tmp, name, 'index.html'), 'w') as fp:
+                fp.write(name)
+            sites.append(batch.Site(
+                os.path.join(tmp, name), 'bucket/' + name))
+        bucket = mock.MagicMock()
+        bucket.list.return_value = []
+        bucket.get_key.return_value = None
+        conn = mock.MagicMock()
+        conn.get_bucket.return_value = bucket
+        cache_path = os.path.join(tmp, 'hashes.json')
+        hashes = hashcache.HashCache(cache_path)
+
+        with mock.patch('boto.s3.key.Key'), \
+                mock.patch('s3pub.progress.UploadProgress'):
+            results, errors = batch.publish(
+                sites, conn, workers.WorkerPool(2), hashes=hashes)
+        hashes.save()
+
+        assert_equals(errors, {})
+        with open(cache_path) as fp:
+            entries = json.load(fp)['entries']
+        assert_equals(sorted(entries), [
+            os.path.join(tmp, 'a', 'index.html'),
+            os.path.join(tmp, 'b', 'index.html')])
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,87 @@
+'''
+Tests for s3pub.changes.
+'''
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import shutil
+import subprocess
+import tempfile
+
+from nose.tools import assert_equals, raises
+
+from s3pub import changes
+
+def test_from_lines():
+    args_ls = [
+        (['a/b.html\n', 'c\n'], set(['a/b.html', 'c'])),
+        (['\n', './a//b\r\n'], set(['a/b'])),
+        (['/site/a/b', '/site/c/'], set(['a/b', 'c/'])),
+        (['d\\e'], set(['d/e'])),
+    ]
+    for args in args_ls:
+        yield (_test_from_lines, ) + args
+
+def _test_from_lines(lines, expected):
+    assert_equals(changes.from_lines(lines, '/site'), expected)
+
+@raises(ValueError)
+def test_from_lines_outside_src():
+    changes.from_lines(['../etc/passwd'], '/site')
+
+def _git(cwd, *args):
+    subprocess.check_call(
+        ('git', '-c', 'user.name=t', '-c', 'user.email=t@t') + args,
+        cwd=cwd, stdout=open(os.devnull, 'w'))
+
+def test_from_git():
+    '''
+    from_git: lists added, modified and removed files under src only.
+    '''
+    repo = tempfile.mkdtemp()
+    try:
+        site = os.path.join(repo, 'site')
+        os.makedirs(os.path.join(site, 'sub'))
+        for path in ['site/a', 'site/sub/b', 'other']:
+            with open(os.path.join(repo, path), 'w') as fp:
+                fp.write('1')
+        _git(repo, 'init', '-q')
+        _git(repo, 'add', '.')
+        _git(repo, 'commit', '-q', '-m', 'one')
+        with open(os.path.join(site, 'a'), 'w') as fp:
+            fp.write('2')
+        with open(os.path.join(site, 'c'), 'w') as fp:
+            fp.write('1')
+        with open(os.path.join(repo, 'other'), 'w') as fp:
+            fp.write('2')
+        os.remove(os.path.join(site, 'sub', 'b'))
+        _git(repo, 'add', '-A')
+        _git(repo, 'commit', '-q', '-m', 'two')
+        assert_equals(
+            changes.from_git(site, 'HEAD~1..HEAD'),
+            set(['a', 'c', 'sub/b']),
+        )
+    finally:
+        shutil.rmtree(repo)
+
+def test_polling_watcher():
+    '''
+    PollingWatcher: reports modified, created and removed files.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        for name in ['a', 'b']:
+            with open(os.path.join(src, name), 'w') as fp:
+                fp.write('1')
+        watcher = changes.PollingWatcher(src)
+        with open(os.path.join(src, 'a'), 'w') as fp:
+            fp.write('22')
+        with open(os.path.join(src, 'c'), 'w') as fp:
+            fp.write('1')
+        os.remove(os.path.join(src, 'b'))
+        assert_equals(watcher.poll(0), set(['a', 'b', 'c']))
+        assert_equals(watcher.poll(0), set())
+    finally:
+        shutil.rmtree(src)
@@ -4,8 +4,11 @@ Tests for s3pub.cmdline.
 
 from __future__ import absolute_import
 
+import mock
 from nose.tools import assert_equal
 from six import iteritems
+import subprocess
+import sys
 
 from s3pub import cmdline
 
@@ -57,3 +60,77 @@ def test_cascade():
 
 def _test_cascade(containers, names, expected):
     assert_equal(expected, cmdline.cascade(containers, names))
+
+def _loaded_modules(statement):
+    '''
+    Return the boto, PyYAML, progressbar and s3pub modules loaded by running
+    'statement' in a new interpreter.
+    '''
+    code = (
+        'import sys, s3pub.cmdline\n'
+        'try:\n'
+        '    {}\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        'sys.stderr.write(" ".join(sorted(m for m in sys.modules if '
+        'm.split(".")[0] in ("boto", "yaml", "progressbar", "s3pub"))))'
+    ).format(statement)
+    proc = subprocess.Popen([sys.executable, '-c', code],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    return err.decode('ascii').split()
+
+def test_lazy_imports():
+    '''
+    Importing the command-line module, or asking it for help, doesn't load
+    boto, PyYAML or progressbar.
+    '''
+    assert_equal(
+        _loaded_modules('pass'),
+        ['s3pub', 's3pub.cmdline', 's3pub.workers'],
+    )
+    assert_equal(
+        _loaded_modules('s3pub.cmdline.parse_args(["--help"])'),
+        ['s3pub', 's3pub.cmdline', 's3pub.workers'],
+    )
+
+def test_verify_methods():
+    '''
+    The --verify-method choices, kept here to parse arguments cheaply, are
+    those s3pub.verify accepts.
+    '''
+    import s3pub.verify
+    assert_equal(cmdline.VERIFY_METHODS, s3pub.verify.METHODS)
+
+def test_warm_defaults():
+    '''
+    The --warm-method choices and the default --warm-concurrency, kept here
+    to parse arguments cheaply, are those of s3pub.warm.
+    '''
+    import s3pub.warm
+    assert_equal(cmdline.WARM_METHODS, s3pub.warm.METHODS)
+    assert_equal(cmdline.DEFAULT_WARM_CONCURRENCY,
+        s3pub.warm.DEFAULT_CONCURRENCY)
+
+def test_command_or_directory():
+    '''
+    main: a subcommand's name that is also a directory is an error, rather
+    than quietly running the subcommand instead of publishing it.
+    '''
+    command = mock.Mock()
+    with mock.patch.dict(cmdline.COMMANDS, {'deploy': command}):
+        with mock.patch('sys.argv', ['s3pub', 'deploy', 'bucket/www']):
+            with mock.patch('sys.stderr') as stderr:
+                with mock.patch('os.path.isdir', return_value=True):
+                    try:
+                        cmdline.main()
+                    except SystemExit as exc:
+                        assert_equal(exc.code, 2)
+                    else:
+                        raise AssertionError('SystemExit not raised')
+                assert_equal(command.called, False)
+                assert './deploy' in stderr.write.call_args[0][0]
+
+                with mock.patch('os.path.isdir', return_value=False):
+                    cmdline.main()
+    command.assert_called_once_with(['bucket/www'])
@@ -0,0 +1,254 @@
+'''
+Tests for s3pub.deploy.
+'''
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import tempfile
+import xml.sax
+
+import boto.handler
+import boto.s3.website
+import mock
+from nose.tools import assert_equals, raises
+
+from s3pub import deploy
+
+V1 = '20240101T000000Z-0000000001'
+V2 = '20240102T000000Z-0000000002'
+V3 = '20240103T000000Z-0000000003'
+
+def _parse(config):
+    '''
+    Return 'config' after a round trip through XML, as S3 would return it.
+    '''
+    parsed = boto.s3.website.WebsiteConfiguration()
+    xml.sax.parseString(
+        config.to_xml().encode('utf-8'), boto.handler.XmlHandler(parsed, None))
+    return parsed
+
+def _bucket(config):
+    '''
+    Return a mock bucket whose website configuration starts as 'config'.
+    '''
+    bucket = mock.MagicMock()
+    bucket.name = 'bucket'
+    bucket.list.return_value = []
+    bucket.get_website_configuration_obj.return_value = config
+    def set_website(new):
+        bucket.get_website_configuration_obj.return_value = _parse(new)
+    bucket.set_website_configuration.side_effect = set_website
+    return bucket
+
+def _entry(name):
+    entry = mock.MagicMock()
+    entry.name = name
+    return entry
+
+def test_switch():
+    '''
+    _switch: replaces only s3pub's rule, and live_version reads it back.
+    '''
+    other = boto.s3.website.RoutingRule.when(key_prefix='old/').then_redirect(
+        replace_key_prefix='new/')
+    config = boto.s3.website.WebsiteConfiguration(
+        'index.html', routing_rules=boto.s3.website.RoutingRules([other]))
+    bucket = _bucket(config)
+
+    for version in [V1, V2]:
+        deploy._switch(bucket, bucket.get_website_configuration_obj(), 'www',
+            version, deploy.s3pub.metrics.NULL)
+        config = bucket.get_website_configuration_obj()
+        assert_equals(deploy.live_version(config, 'www'), version)
+        assert_equals(len(config.routing_rules), 2)
+        assert_equals(config.routing_rules[0].redirect.replace_key_prefix,
+            'new/')
+        redirect = config.routing_rules[1].redirect
+        assert_equals(redirect.replace_key_prefix,
+            '.s3pub-versions/www/' + version + '/')
+        assert_equals(redirect.http_redirect_code, '302')
+    assert_equals(deploy.live_version(config, ''), None)
+
+def test_switch_root():
+    '''
+    _switch: at the root of a bucket, adds a rule that stops redirect loops.
+    '''
+    config = boto.s3.website.WebsiteConfiguration('index.html', '404.html')
+    bucket = _bucket(config)
+    for version in [V1, V2]:
+        deploy._switch(bucket, bucket.get_website_configuration_obj(), '',
+            version, deploy.s3pub.metrics.NULL)
+    config = bucket.get_website_configuration_obj()
+    assert_equals(deploy.live_version(config, ''), V2)
+    assert_equals(
+        [(rule.condition.key_prefix, rule.redirect.replace_key)
+            for rule in config.routing_rules],
+        [
+            ('.s3pub-versions/', '.s3pub-versions/' + V2 + '/404.html'),
+            (None, None),
+        ],
+    )
+    # without an error document, there is nothing to send missing keys to
+    assert_equals(len(deploy._rules(
+        boto.s3.website.WebsiteConfiguration('index.html'), '', V1)), 1)
+
+def test_list_versions():
+    bucket = mock.MagicMock()
+    bucket.list.return_value = [_entry('.s3pub-versions/' + name)
+        for name in [V2 + '/', 'www/', V1 + '/', '.s3pub-manifest.json.gz']]
+    assert_equals(deploy.list_versions(bucket, ''), [V1, V2])
+    bucket.list.assert_called_once_with('.s3pub-versions/', '/')
+
+def test_collect():
+    '''
+    collect: deletes the keys of old versions in one batch, keeping the
+    newest and the live one.
+    '''
+    bucket = mock.MagicMock()
+    def list_keys(prefix, delimiter=None):
+        if delimiter:
+            return [_entry(prefix + version + '/')
+                for version in [V1, V2, V3]]
+        return [_entry(prefix + 'a'), _entry(prefix + 'b')]
+    bucket.list.side_effect = list_keys
+    bucket.delete_keys.return_value.errors = []
+
+    assert_equals(deploy.collect(bucket, 'www', 1, V2), [V1])
+    bucket.delete_keys.assert_called_once_with(
+        ['.s3pub-versions/www/' + V1 + '/a',
+            '.s3pub-versions/www/' + V1 + '/b'],
+        quiet=True)
+
+    bucket.delete_keys.reset_mock()
+    assert_equals(deploy.collect(bucket, 'www', 3, V3), [])
+    assert_equals(bucket.delete_keys.call_count, 0)
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+def test_deploy():
+    '''
+    deploy: copies unchanged files from the live version, uploads the rest,
+    then switches to the new version.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        for name, data in [('same.css', b'same'), ('new.html', b'new')]:
+            with open(os.path.join(src, name), 'wb') as fp:
+                fp.write(data)
+        live = '.s3pub-versions/www/' + V1 + '/'
+        config = _parse(boto.s3.website.WebsiteConfiguration('index.html'))
+        bucket = _bucket(config)
+        deploy._switch(bucket, config, 'www', V1, deploy.s3pub.metrics.NULL)
+        conn = mock.MagicMock()
+        conn.get_bucket.return_value = bucket
+        entries = {
+            live + 'same.css': (_md5(b'same'), 4),
+            live + 'new.html': (_md5(b'old'), 3),
+        }
+
+        with mock.patch('s3pub.manifest.load', return_value=entries):
+            with mock.patch('s3pub.manifest.save'):
+                with mock.patch('s3pub.upload._upload') as upload:
+                    version, inval = deploy.deploy(
+                        src, 'bucket/www', None, conn=conn,
+                        clock=lambda: 86400 * 365)
+        target = '.s3pub-versions/www/' + version + '/'
+        assert_equals(inval, ['www/*'])
+        assert_equals(version[:16], '19710101T000000Z')
+        bucket.copy_key.assert_called_once_with(
+            target + 'same.css', 'bucket', live + 'same.css',
+            headers={'x-amz-acl': 'public-read'})
+        assert_equals(
+            [args[2] for args, _ in upload.call_args_list],
+            [target + 'new.html'])
+        assert_equals(deploy.live_version(
+            bucket.get_website_configuration_obj(), 'www'), version)
+
+        # deploying the same tree again changes nothing
+        with mock.patch('s3pub.manifest.save'):
+            assert_equals(
+                deploy.deploy(src, 'bucket/www', None, conn=conn),
+                (version, []))
+    finally:
+        shutil.rmtree(src)
+
+def test_rollback():
+    '''
+    rollback: switches to the version before the live one, or the one given.
+    '''
+    config = _parse(boto.s3.website.WebsiteConfiguration('index.html'))
+    bucket = mock.MagicMock()
+    bucket.get_website_configuration_obj.return_value = config
+    bucket.list.return_value = [
+        _entry('.s3pub-versions/www/' + version + '/')
+        for version in [V1, V2, V3]]
+    deploy._switch(bucket, config, 'www', V3, deploy.s3pub.metrics.NULL)
+    conn = mock.MagicMock()
+    conn.get_bucket.return_value = bucket
+
+    assert_equals(deploy.rollback('bucket/www', None, conn=conn),
+        (V2, ['www/*']))
+    assert_equals(deploy.live_version(config, 'www'), V2)
+    assert_equals(deploy.rollback('bucket/www', None, V3, conn=conn),
+        (V3, ['www/*']))
+    assert_equals(deploy.rollback('bucket/www', None, V3, conn=conn),
+        (V3, []))
+
+def test_deploy_root_error_page():
+    '''
+    deploy: at the root of a bucket, refuses a tree without the website's
+    error document, which missing keys are redirected to.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(src, 'index.html'), 'wb') as fp:
+            fp.write(b'index')
+        for error_key in [None, '404.html']:
+            conn = mock.MagicMock()
+            conn.get_bucket.return_value = _bucket(_parse(
+                boto.s3.website.WebsiteConfiguration('index.html', error_key)))
+            with mock.patch('s3pub.upload._upload') as upload:
+                try:
+                    deploy.deploy(src, 'bucket', None, conn=conn)
+                except deploy.DeployError:
+                    pass
+                else:
+                    raise AssertionError('DeployError not raised')
+            assert_equals(upload.called, False)
+    finally:
+        shutil.rmtree(src)
+
+@raises(deploy.DeployError)
+def test_rollback_root_error_page():
+    '''
+    rollback: at the root of a bucket, refuses a version without the
+    website's error document.
+    '''
+    config = _parse(
+        boto.s3.website.WebsiteConfiguration('index.html', '404.html'))
+    bucket = _bucket(config)
+    bucket.list.return_value = [
+        _entry('.s3pub-versions/' + version + '/') for version in [V1, V2]]
+    bucket.get_key.return_value = None
+    deploy._switch(bucket, config, '', V2, deploy.s3pub.metrics.NULL)
+    conn = mock.MagicMock()
+    conn.get_bucket.return_value = bucket
+    try:
+        deploy.rollback('bucket', None, conn=conn)
+    finally:
+        bucket.get_key.assert_called_once_with(
+            '.s3pub-versions/' + V1 + '/404.html')
+
+@raises(deploy.DeployError)
+def test_rollback_unknown():
+    bucket = mock.MagicMock()
+    bucket.get_website_configuration_obj.return_value = \
+        boto.s3.website.WebsiteConfiguration('index.html')
+    bucket.list.return_value = []
+    conn = mock.MagicMock()
+    conn.get_bucket.return_value = bucket
+    deploy.rollback('bucket/www', None, V1, conn=conn)
@@ -0,0 +1,40 @@
+'''
+Tests for s3pub.fingerprint.
+'''
+
+from __future__ import absolute_import
+
+import os
+import tempfile
+
+import boto.s3.key
+from nose.tools import assert_equals, assert_not_equals, assert_true
+
+from s3pub import fingerprint
+
+def _check_algorithm(name):
+    fd, lpath = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(b'x' * (fingerprint.CHUNK + 10))
+        md5, digest = fingerprint.md5_and_fingerprint(lpath, name)
+        with open(lpath, 'rb') as fp:
+            assert_equals(md5, boto.s3.key.compute_md5(fp))
+        if name == 'md5':
+            assert_equals(digest, None)
+            return
+        assert_equals(digest, fingerprint.fingerprint(lpath, name))
+        with open(lpath, 'ab') as fp:
+            fp.write(b'!')
+        assert_not_equals(fingerprint.fingerprint(lpath, name), digest)
+    finally:
+        os.remove(lpath)
+
+def test_algorithms():
+    '''
+    md5_and_fingerprint: returns boto's MD5 tuple, and a fingerprint that
+    changes with the contents.
+    '''
+    assert_true(set(['sha1', 'crc32', 'md5']) <= set(fingerprint.available()))
+    for name in fingerprint.available():
+        yield _check_algorithm, name
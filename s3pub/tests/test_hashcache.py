@@ -0,0 +1,115 @@
+'''
+Tests for s3pub.hashcache.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from nose.tools import assert_equals
+
+from s3pub import hashcache, workers
+
+def _write(lpath, data, mtime):
+    with open(lpath, 'wb') as fp:
+        fp.write(data)
+    os.utime(lpath, (mtime, mtime))
+
+def test_persisted():
+    '''
+    HashCache: a later run reuses saved MD5s, computing them again only for
+    files whose fingerprint changed.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        same, changed = [os.path.join(tmp, name) for name in 'ab']
+        _write(same, b'same', 1000)
+        _write(changed, b'old', 1000)
+        path = os.path.join(tmp, 'hashes.json')
+        first = hashcache.HashCache(path, 'sha1')
+        md5s = [first.md5(same), first.md5(changed)]
+        first.save()
+
+        # a fresh checkout: new modification times
+        _write(same, b'same', 2000)
+        _write(changed, b'new', 2000)
+        second = hashcache.HashCache(path, 'sha1')
+        second.load()
+        assert_equals(second.md5(same), md5s[0])
+        assert_equals(second.md5(changed)[0], '22af645d1859cb5ca6da0c484f1f37ea')
+        assert_equals(
+            (second.hits, second.fingerprint_hits, second.misses), (0, 1, 1))
+        assert_equals(second.md5(same), md5s[0])
+        assert_equals(second.hits, 1)
+
+        # fingerprints made with another algorithm aren't trusted
+        second.save()
+        os.utime(same, (3000, 3000))
+        third = hashcache.HashCache(path, 'crc32')
+        third.load()
+        third.md5(same)
+        assert_equals((third.fingerprint_hits, third.misses), (0, 1))
+    finally:
+        shutil.rmtree(tmp)
+
+def test_damaged():
+    '''
+    HashCache: a file that isn't a valid cache is ignored.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'hashes.json')
+        for entries in [
+            {'a': [1, 2]},
+            {'a': None},
+            [],
+        ]:
+            with open(path, 'w') as fp:
+                json.dump({'version': hashcache.VERSION, 'algorithm': 'md5',
+                    'entries': entries}, fp)
+            cache = hashcache.HashCache(path)
+            cache.load()
+            yield assert_equals, len(cache), 0
+    finally:
+        shutil.rmtree(tmp)
+
+def test_in_memory():
+    '''
+    HashCache: without a path, doesn't compute fingerprints.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        lpath = os.path.join(tmp, 'a')
+        _write(lpath, b'data', 1000)
+        cache = hashcache.HashCache()
+        with mock.patch('s3pub.fingerprint.new', return_value=None) as new:
+            cache.md5(lpath)
+            cache.md5(lpath)
+        new.assert_called_once_with('md5')
+        assert_equals((cache.hits, cache.misses), (1, 1))
+    finally:
+        shutil.rmtree(tmp)
+
+def test_threads():
+    '''
+    HashCache: counts every lookup when shared by several threads.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(tmp, str(idx)) for idx in range(10)]
+        for lpath in paths:
+            _write(lpath, b'data', 1000)
+        cache = hashcache.HashCache()
+        pool = workers.WorkerPool(8)
+        try:
+            pool.map(cache.md5, paths * 50)
+        finally:
+            pool.close()
+        assert_equals(cache.hits + cache.misses, 500)
+        assert_equals(len(cache), 10)
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,95 @@
+'''
+Tests for s3pub.lowmem.
+'''
+
+from __future__ import absolute_import
+
+import os
+
+import mock
+from nose.tools import assert_equals, assert_false, assert_true
+
+from s3pub import lowmem, workers
+from s3pub.tests.helpers import FILES, key, md5, with_tree
+
+def test_index():
+    '''
+    Index: finds changed and removed files, and orders uploads by phase and
+    size.
+    '''
+    hashes = mock.Mock()
+    hashes.md5.side_effect = lambda lpath: (md5(lpath.encode('ascii')),
+        'b64', len(lpath))
+    with lowmem.Index() as index:
+        path = index.path
+        assert_equals(index.add_local(
+            [('/a.html', 'a.html'), ('/bb.css', 'bb.css'),
+                ('/ccc.css', 'ccc.css'), ('/same', 'same')]), 4)
+        assert_equals(index.add_remote(
+            [('same', md5(b'/same'), 5), ('ccc.css', 'x', 1),
+                ('gone', 'y', 1)]), 3)
+        assert_equals(index.diff(workers.WorkerPool(2), hashes), (3, 22))
+        assert_true(index.has_deletions())
+        assert_equals(list(index.deletions()), [['gone']])
+        assert_equals([upload[:3] for upload in index.uploads()], [
+            (0, '/ccc.css', 'ccc.css'),
+            (0, '/bb.css', 'bb.css'),
+            (1, '/a.html', 'a.html'),
+        ])
+    assert_false(os.path.exists(path))
+
+def test_modified():
+    modified = lowmem._Modified('www/')
+    modified.extend(['www/a'])
+    assert_equals(modified.paths, ['www/a'])
+    with mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 2):
+        modified.extend(['www/b', 'www/c'])
+        assert_equals(modified.paths, ['www/*'])
+        modified.extend(['www/d'])
+    assert_equals(modified.paths, ['www/*'])
+
+@with_tree
+def test_publish(tmp):
+    '''
+    publish: uploads changed files, index documents last, and deletes keys
+    missing locally.
+    '''
+    bucket = mock.Mock()
+    bucket.list.return_value = [
+        key('www/css/site.css', b'body {}'),
+        key('www/old.html', b'old'),
+        key('www/.s3pub-manifest.json.gz', b'manifest'),
+    ]
+    bucket.delete_keys.return_value.errors = []
+    uploads = []
+    def upload(bucket, lpath, rpath, md5, progress, metrics):
+        uploads.append((rpath, md5[2]))
+    with mock.patch('s3pub.upload._upload', side_effect=upload), \
+            mock.patch('s3pub.upload._get_index_doc',
+                return_value='index.html'), \
+            mock.patch('s3pub.manifest.discard') as discard, \
+            mock.patch('s3pub.progress.UploadProgress'):
+        inval = lowmem.publish(tmp, bucket, 'www', True,
+            pool=workers.WorkerPool(1))
+
+    assert_equals(uploads, [
+        ('www/img/logo.png', 400),
+        ('www/about/index.html', 11),
+        ('www/index.html', 6),
+    ])
+    bucket.delete_keys.assert_called_once_with(['www/old.html'])
+    assert_true(discard.called)
+    assert_equals(sorted(inval), [
+        'www', 'www/', 'www/about', 'www/about/', 'www/about/index.html',
+        'www/img/logo.png', 'www/index.html', 'www/old.html'])
+
+@with_tree
+def test_publish_unchanged(tmp):
+    bucket = mock.Mock()
+    bucket.list.return_value = [
+        key('www/' + name, data) for name, data in FILES.items()] + [
+        key('www/old.html', b'old')]
+    with mock.patch('s3pub.manifest.discard') as discard:
+        assert_equals(lowmem.publish(tmp, bucket, 'www', False), [])
+    assert_false(discard.called)
+    assert_false(bucket.delete_keys.called)
@@ -0,0 +1,77 @@
+'''
+Tests for s3pub.manifest.
+'''
+
+from __future__ import absolute_import
+
+import mock
+from nose.tools import assert_equals, assert_true
+
+from s3pub import manifest
+
+ENTRIES = {
+    'site/a': ('abcd', 10),
+    'site/b/c': ('bcde', 20),
+}
+
+def test_key_name():
+    yield assert_equals, manifest.key_name(''), manifest.NAME
+    yield assert_equals, manifest.key_name('site/'), 'site/' + manifest.NAME
+    yield assert_equals, manifest.key_name('site'), 'site/' + manifest.NAME
+
+def test_round_trip():
+    '''
+    decode: returns what was encoded, unless it is stale or unreadable.
+    '''
+    data = manifest.encode('site', ENTRIES, now=1000)
+    assert_equals(manifest.decode('site', data, now=1001), ENTRIES)
+    assert_equals(
+        manifest.decode('site', data, now=1000 + manifest.MAX_AGE + 1), None)
+    assert_equals(manifest.decode('other', data, now=1001), None)
+    assert_equals(manifest.decode('site', data[:-8], now=1001), None)
+    assert_equals(manifest.decode('site', b'junk', now=1001), None)
+
+def _bucket(heads):
+    '''
+    Return a mock bucket holding a fresh manifest of ENTRIES, whose other
+    keys are described by 'heads', a dict of name -> (etag, size).
+    '''
+    stored = mock.MagicMock()
+    stored.get_contents_as_string.return_value = manifest.encode(
+        'site', ENTRIES)
+    def get_key(name):
+        if name == manifest.key_name('site'):
+            return stored
+        if name not in heads:
+            return None
+        key = mock.MagicMock(etag='"{}"'.format(heads[name][0]))
+        key.size = heads[name][1]
+        return key
+    return mock.MagicMock(get_key=mock.MagicMock(side_effect=get_key))
+
+def test_load():
+    '''
+    load: trusts a manifest only if sampled keys match the bucket.
+    '''
+    assert_equals(manifest.load(_bucket(ENTRIES), 'site'), ENTRIES)
+
+    changed = dict(ENTRIES)
+    changed['site/a'] = ('ffff', 10)
+    with mock.patch('s3pub.manifest.SAMPLE_SIZE', len(ENTRIES)):
+        assert_equals(manifest.load(_bucket(changed), 'site'), None)
+        assert_equals(manifest.load(_bucket({}), 'site'), None)
+
+    missing = mock.MagicMock()
+    missing.get_key.return_value = None
+    assert_equals(manifest.load(missing, 'site'), None)
+
+def test_save():
+    '''
+    save: writes a single object that load can read back.
+    '''
+    bucket = mock.MagicMock()
+    manifest.save(bucket, 'site', ENTRIES)
+    bucket.new_key.assert_called_once_with('site/' + manifest.NAME)
+    set_contents = bucket.new_key.return_value.set_contents_from_string
+    assert_equals(set_contents.call_count, 1)
+    assert_true(manifest.decode('site', set_contents.call_args[0][0]))
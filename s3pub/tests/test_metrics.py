@@ -0,0 +1,93 @@
+'''
+Tests for s3pub.metrics and s3pub.retry.
+'''
+
+from __future__ import absolute_import
+
+import json
+
+import boto.exception
+import mock
+from nose.tools import assert_equals, assert_true, raises
+from six import StringIO
+
+from s3pub import metrics, retry
+
+def test_null_metrics():
+    '''
+    NULL: spans and timers are shared no-op context managers.
+    '''
+    with metrics.NULL.span('scan') as span:
+        span.set('files', 1)
+    assert_true(metrics.NULL.span('a') is metrics.NULL.timer('b'))
+
+def test_span_nesting():
+    '''
+    Metrics: spans record their parent and sum up per phase.
+    '''
+    recorder = metrics.Metrics()
+    with recorder.span('upload') as outer:
+        with recorder.span('put', key='a') as inner:
+            pass
+    assert_equals(inner.parent_id, outer.span_id)
+    assert_equals(outer.parent_id, None)
+    assert_equals(set(recorder.phase_durations()), set(['upload', 'put']))
+
+    out = StringIO()
+    recorder.write_spans(out)
+    lines = [json.loads(i) for i in out.getvalue().splitlines()]
+    assert_equals([i['name'] for i in lines], ['upload', 'put'])
+    assert_equals(lines[1]['attributes'], {'key': 'a'})
+
+def test_histogram():
+    '''
+    Histogram: values land in the first bucket whose bound they don't exceed.
+    '''
+    hist = metrics.Histogram(bounds=(1, 2, 3))
+    for value in [0.5, 1, 1.5, 2.5, 10]:
+        hist.add(value)
+    assert_equals(hist.counts, [2, 1, 1, 1])
+    assert_equals(hist.quantile(0.5), 2)
+    assert_equals(hist.quantile(1), 10)
+    assert_equals((hist.min, hist.max), (0.5, 10))
+
+def test_summary_and_prometheus():
+    recorder = metrics.Metrics()
+    recorder.incr('bytes_uploaded', 100)
+    recorder.incr('bytes_uploaded', 50)
+    recorder.observe('s3_put', 0.02)
+    summary = recorder.summary()
+    assert_equals(summary['counters'], {'bytes_uploaded': 150})
+    assert_equals(summary['requests']['s3_put']['count'], 1)
+    # no upload phase was recorded, so throughput is unknown
+    assert_equals(summary['bytes_per_sec'], None)
+
+    out = StringIO()
+    recorder.write_prometheus(out)
+    text = out.getvalue()
+    assert_true('s3pub_bytes_uploaded_total 150\n' in text)
+    assert_true('s3pub_s3_put_seconds_bucket{le="0.025"} 1\n' in text)
+    assert_true('s3pub_s3_put_seconds_count 1\n' in text)
+
+def _throttle_error():
+    return boto.exception.S3ResponseError(503, 'Slow Down')
+
+def test_retry_throttled():
+    '''
+    retry.call: retries throttled requests and counts them.
+    '''
+    recorder = metrics.Metrics()
+    func = mock.MagicMock(side_effect=[_throttle_error(), 'ok'])
+    with mock.patch('time.sleep') as mock_sleep:
+        assert_equals(retry.call(func, (1, ), metrics=recorder), 'ok')
+    mock_sleep.assert_called_once_with(retry.BACKOFF)
+    assert_equals(recorder.counters, {'throttles': 1, 'retries': 1})
+
+@raises(boto.exception.S3ResponseError)
+def test_retry_other_errors():
+    '''
+    retry.call: errors other than throttling are raised immediately.
+    '''
+    func = mock.MagicMock(
+        side_effect=boto.exception.S3ResponseError(403, 'Forbidden'))
+    retry.call(func)
@@ -1,37 +1,98 @@
 '''
 Tests for s3pub.progress.
 
-This isn't a unit test, because we would need to assert the results of
-curses-like drawing.  I don't want to bother with that, for now, so the
-developer must manually invoke this script and inspect the output.
-
-You will probably need to explicitly set PYTHONPATH to run this script.
+Terminal drawing is checked by rendering into a StringIO.  To eyeball the
+real thing, invoke this script directly and inspect the output; you will
+probably need to explicitly set PYTHONPATH to do so.
 '''
 
-import mock
+from __future__ import absolute_import
+
 import time
-from six import print_
+
+from nose.tools import assert_equals, assert_true
+from six import StringIO, print_
 
 import s3pub.progress
 
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def _progress(is_tty):
+    clock = FakeClock()
+    out = StringIO()
+    progress = s3pub.progress.UploadProgress(
+        2, 3000, stream=out, is_tty=is_tty, clock=clock)
+    return progress, out, clock
+
+def test_redraws_are_rate_limited():
+    '''
+    UploadProgress: callbacks within one interval don't redraw.
+    '''
+    progress, out, clock = _progress(True)
+    progress.start_file('a')
+    for done in range(0, 1000, 10):
+        progress.update('a', done)
+    assert_equals(out.getvalue(), '')
+
+    clock.now += s3pub.progress.TTY_INTERVAL
+    progress.update('a', 1000)
+    assert_equals(out.getvalue().count('\r'), 1)
+    assert_true('0/2 files' in out.getvalue())
+
+def test_counts_files_and_bytes():
+    '''
+    UploadProgress: tracks completed files and bytes of concurrent uploads.
+    '''
+    progress, out, clock = _progress(False)
+    progress.start_file('a')
+    progress.start_file('b')
+    progress.update('a', 500)
+    progress.update('b', 250)
+    progress.finish_file('a', 1000)
+    assert_equals(progress._drain(), 1250)
+    progress.finish_file('b', 2000)
+    clock.now += 1
+    progress.finish()
+    assert_equals(
+        out.getvalue(),
+        'uploaded 2/2 files, 2.9 KiB/2.9 KiB (2.9 KiB/s)\n',
+    )
+
+def test_log_lines_when_not_a_tty():
+    '''
+    UploadProgress: writes whole lines every LOG_INTERVAL without a terminal.
+    '''
+    progress, out, clock = _progress(False)
+    progress.start_file('a')
+    clock.now += s3pub.progress.TTY_INTERVAL
+    progress.update('a', 100)
+    assert_equals(out.getvalue(), '')
+    clock.now += s3pub.progress.LOG_INTERVAL
+    progress.update('a', 200)
+    assert_equals(out.getvalue().count('\n'), 1)
+    assert_true('\r' not in out.getvalue())
+
 def main():
-    print_('Starting UploadProgressBar test')
-
-    files = {
-        'something/else/blah/a.foo': 5000,
-        'something/not/dumb/stupid/b.foo': 10000,
-    }
-    pbar1 = s3pub.progress.UploadProgressBar(files)
-    assert pbar1.maxval == 15000
-    pbar1.change_file(files.keys()[0])
-    for i in range(5):
-        pbar1.increment(i * 1000)
-        time.sleep(0.5)
-    pbar1.change_file(files.keys()[1])
-    for i in range(10):
-        pbar1.increment(i * 1000)
-        time.sleep(0.5)
-    pbar1.finish()
+    print_('Starting UploadProgress test')
+
+    files = [
+        ('something/else/blah/a.foo', 5000),
+        ('something/not/dumb/stupid/b.foo', 10000),
+    ]
+    progress = s3pub.progress.UploadProgress(
+        len(files), sum(size for _, size in files))
+    for path, size in files:
+        progress.start_file(path)
+        for i in range(size // 1000):
+            progress.update(path, i * 1000)
+            time.sleep(0.5)
+        progress.finish_file(path, size)
+    progress.finish()
 
     print_('Done')
 
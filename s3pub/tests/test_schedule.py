@@ -0,0 +1,49 @@
+'''
+Tests for s3pub.schedule.
+'''
+
+from __future__ import absolute_import
+
+from nose.tools import assert_equals
+
+from s3pub import schedule
+
+def test_phases():
+    '''
+    phases: puts assets first, pages next, index documents last, and the
+    largest files first within each phase.
+    '''
+    items = [
+        ('site/a.css', 10),
+        ('site/index.html', 30),
+        ('site/b.HTML', 5),
+        ('site/big.mp4', 1000),
+        ('site/sub/index.html', 1),
+        ('site/c.htm', 50),
+        ('site/d.js', 10),
+    ]
+    assert_equals(
+        schedule.phases(
+            [(name, size, name) for name, size in items],
+            is_index=lambda name: name.endswith('/index.html')),
+        [
+            ['site/big.mp4', 'site/a.css', 'site/d.js'],
+            ['site/c.htm', 'site/b.HTML'],
+            ['site/index.html', 'site/sub/index.html'],
+        ],
+    )
+
+def test_no_phases():
+    '''
+    phases: with no patterns, everything goes in one phase, largest first.
+    '''
+    assert_equals(
+        schedule.phases([('a.html', 1, 'a'), ('b.css', 2, 'b')], ()),
+        [['b', 'a']],
+    )
+
+def test_parse_phases():
+    assert_equals(
+        schedule.parse_phases(['*.css, *.js', '*.html']),
+        (('*.css', '*.js'), ('*.html', )),
+    )
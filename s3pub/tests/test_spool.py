@@ -0,0 +1,127 @@
+'''
+Tests for s3pub.spool.
+'''
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+import mock
+from nose.tools import assert_equals, raises
+
+from s3pub import spool
+
+class FakeCloudFront(object):
+    '''
+    Records invalidation requests; each stays in progress until completed.
+    '''
+    def __init__(self):
+        self.requests = []
+        self.completed = set()
+
+    def create(self, distrib_id, keys):
+        self.requests.append((distrib_id, list(keys)))
+        return mock.MagicMock(id='I{}'.format(len(self.requests)))
+
+    def invalidation_request_status(self, distrib_id, req_id):
+        return mock.MagicMock(
+            status=req_id in self.completed and 'Completed' or 'InProgress')
+
+def _submit(cf):
+    return mock.patch('s3pub.invalidate.submit',
+        side_effect=lambda conn, distrib_id, keys, metrics: cf.create(
+            distrib_id, keys))
+
+def _with_path(test):
+    '''
+    Call 'test' with the path of a spool in a temporary directory.
+    '''
+    def wrapper():
+        tmp = tempfile.mkdtemp()
+        try:
+            test(os.path.join(tmp, 'spool.json'))
+        finally:
+            shutil.rmtree(tmp)
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+@_with_path
+def test_coalesce(path):
+    '''
+    flush: paths queued while a request is in progress are merged and
+    deduplicated into the next one.
+    '''
+    cf = FakeCloudFront()
+    with _submit(cf):
+        with spool.Spool(path) as sp:
+            sp.add('ONE', ['a', 'b'])
+            assert_equals(sp.flush(cf), [('ONE', 'I1', 2, True)])
+
+        # later runs, while I1 is in progress
+        for keys in [['b', 'c'], ['c', 'd']]:
+            with spool.Spool(path) as sp:
+                sp.add('ONE', keys)
+                sp.add('TWO', ['x'])
+                sp.flush(cf, distrib_ids=['ONE'])
+        with spool.Spool(path) as sp:
+            assert_equals(sp.pending('ONE'), ['b', 'c', 'd'])
+            assert_equals(sp.pending('TWO'), ['x'])
+            assert_equals(sp.in_progress(), {'ONE': 'I1'})
+
+        cf.completed.add('I1')
+        with spool.Spool(path) as sp:
+            assert_equals(sp.flush(cf), [
+                ('ONE', 'I2', 3, True),
+                ('TWO', 'I3', 1, True),
+            ])
+        cf.completed.update(['I2', 'I3'])
+        with spool.Spool(path) as sp:
+            assert_equals(sp.flush(cf), [])
+            assert_equals(sp.entries, {})
+
+    assert_equals(cf.requests, [
+        ('ONE', ['a', 'b']),
+        ('ONE', ['b', 'c', 'd']),
+        ('TWO', ['x']),
+    ])
+
+@_with_path
+def test_max_paths(path):
+    '''
+    flush: sends at most MAX_INVALIDATION_PATHS paths at once, keeping the
+    rest.
+    '''
+    cf = FakeCloudFront()
+    with _submit(cf), mock.patch('s3pub.invalidate.MAX_INVALIDATION_PATHS', 2):
+        with spool.Spool(path) as sp:
+            sp.add('ONE', ['a', 'b', 'c'])
+            assert_equals(sp.flush(cf), [('ONE', 'I1', 2, True)])
+            assert_equals(sp.pending('ONE'), ['c'])
+            assert_equals(sp.flush(cf), [('ONE', 'I1', 1, False)])
+
+@_with_path
+def test_failed_submit(path):
+    '''
+    flush: paths stay queued if the request can't be sent.
+    '''
+    with mock.patch('s3pub.invalidate.submit', side_effect=IOError):
+        try:
+            with spool.Spool(path) as sp:
+                sp.add('ONE', ['a'])
+                sp.flush(FakeCloudFront())
+        except IOError:
+            pass
+    with spool.Spool(path) as sp:
+        assert_equals(sp.pending('ONE'), ['a'])
+        assert_equals(sp.in_progress(), {})
+
+@raises(ValueError)
+@_with_path
+def test_corrupt(path):
+    with open(path, 'w') as fp:
+        fp.write('{')
+    with spool.Spool(path):
+        pass
@@ -5,12 +5,18 @@ Tests for s3pub.upload.
 from __future__ import absolute_import
 
 import boto.exception
+import boto.s3.key
 from functools import wraps
+import json
 import mock
+import os
+import os.path
+import shutil
+import tempfile
 from nose.tools import assert_equals, raises, nottest
 from six import iteritems
 
-from s3pub import upload
+from s3pub import hashcache, metrics, upload
 
 def test_split_dest():
     args_ls = [
@@ -52,6 +58,14 @@ def test_remote_path():
 def _test_remote_path(args, expected):
     assert_equals(upload._remote_path(*args), expected)
 
+def test_content_type():
+    for path, content_type in [
+        ('index.html', 'text/html'),
+        ('css/site.css', 'text/css'),
+        ('data', boto.s3.key.Key.DefaultContentType),
+    ]:
+        yield assert_equals, upload._content_type(path), content_type
+
 def test_todos():
     args_ls = [
         (
@@ -206,13 +220,14 @@ def test_get_index_doc():
     }
     assert_equals(upload._get_index_doc(mock_bucket), 'index.html')
 
-def _start_progressbar(bucket, local_path, remote_path, md5, pbar):
+def _start_progressbar(bucket, local_path, remote_path, md5, progress, *_):
     '''
-    Ensure we call the ProgressBar's "change_file".
+    Ensure we report progress for each file.
 
     Meant to be used as a side_effect to a mock s3pub.upload._upload.
     '''
-    pbar.change_file(local_path)
+    progress.start_file(local_path)
+    progress.finish_file(local_path, md5[2])
 
 def setup_do_upload(indexname):
     def wrapper(func):
@@ -284,3 +299,196 @@ def test_do_upload_with_website(mock_todos, mock_connection, mock_creds):
         set(upload.do_upload('bogus', 'bogus', False, mock_creds)),
         set(['/hello/index.html', '/hello/', '/hello', '/path1']),
     )
+
+    # index documents are uploaded last
+    assert_equals(
+        [args[2] for args, _ in upload._upload.call_args_list],
+        ['/path1', '/hello/index.html'],
+    )
+
+def test_changed_todos():
+    '''
+    _changed_todos: uploads changed files and deletes removed paths.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(src, 'new'))
+        for path in ['changed', 'new/a', 'new/b']:
+            with open(os.path.join(src, path), 'w') as fp:
+                fp.write(path)
+        removed_dir = mock.MagicMock()
+        removed_dir.name = 'dst/gone/x'
+        bucket = mock.MagicMock()
+        bucket.list.return_value = [removed_dir]
+
+        up, delete = upload._changed_todos(
+            bucket, 'dst', src, set(['changed', 'new/', 'removed', 'gone/']))
+        assert_equals(
+            dict((lpath, rpath) for lpath, (_, rpath) in iteritems(up)),
+            dict((os.path.join(src, path), 'dst/' + path)
+                for path in ['changed', 'new/a', 'new/b']),
+        )
+        assert_equals(delete, ['dst/gone/x', 'dst/removed'])
+        bucket.list.assert_called_once_with('dst/gone/')
+
+        # removals are ignored unless requested
+        assert_equals(
+            upload._changed_todos(bucket, 'dst', src, set(['removed']), False),
+            ({}, []),
+        )
+    finally:
+        shutil.rmtree(src)
+
+def test_do_upload_fanout():
+    '''
+    do_upload: publishes one scan to several destinations, reading each file
+    once, and completes healthy destinations when another fails.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        for path in ['a', 'b']:
+            with open(os.path.join(src, path), 'w') as fp:
+                fp.write(path)
+        current = mock.MagicMock()
+        current.name = 'a'
+        current.size = 1
+        current.etag = '"{}"'.format(upload._compute_md5(
+            os.path.join(src, 'a'))[0].strip('"'))
+        buckets = {
+            'one': mock.MagicMock(),
+            'two': mock.MagicMock(),
+            'three': mock.MagicMock(),
+        }
+        buckets['one'].list.return_value = [current]
+        buckets['two'].list.return_value = []
+        buckets['three'].list.side_effect = boto.exception.S3ResponseError(
+            403, 'Forbidden')
+        for bucket in buckets.values():
+            bucket.get_key.return_value = None
+            bucket.get_website_configuration.side_effect = \
+                boto.exception.S3ResponseError(404, 'Not Found')
+        conn = mock.MagicMock()
+        conn.get_bucket.side_effect = buckets.get
+
+        real_open = open
+        with mock.patch('s3pub.upload.open', side_effect=real_open,
+                create=True) as mock_open:
+            with mock.patch('boto.s3.key.Key') as mock_key:
+                try:
+                    upload.do_upload(
+                        src, ['one/', 'two/x', 'three'], False, None,
+                        conn=conn)
+                except upload.FanoutError as exc:
+                    results, errors = exc.results, exc.errors
+                else:
+                    raise AssertionError('FanoutError not raised')
+
+        assert_equals(
+            dict((dest, sorted(keys)) for dest, keys in iteritems(results)),
+            {'one/': ['b'], 'two/x': ['x/a', 'x/b']})
+        assert_equals(list(errors), ['three'])
+        assert_equals(
+            sorted(args[1] for args, _ in mock_key.call_args_list),
+            ['b', 'x/a', 'x/b'])
+        assert_equals(
+            set(kwargs['headers']['Content-Type'] for _, kwargs in
+                mock_key.return_value.set_contents_from_file.call_args_list),
+            set([mock_key.DefaultContentType]))
+        # 'b' is read once, though it is uploaded to two buckets
+        assert_equals(
+            sorted(args[0] for args, _ in mock_open.call_args_list),
+            [os.path.join(src, 'a'), os.path.join(src, 'b')])
+    finally:
+        shutil.rmtree(src)
+
+def test_do_upload_fanout_hash_cache():
+    '''
+    do_upload: a fan-out publish fills the HashCache it is given, even while
+    that is empty.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        for path in ['a', 'b']:
+            with open(os.path.join(src, path), 'w') as fp:
+                fp.write(path)
+        bucket = mock.MagicMock()
+        bucket.list.return_value = []
+        bucket.get_key.return_value = None
+        conn = mock.MagicMock()
+        conn.get_bucket.return_value = bucket
+        cache_path = os.path.join(src, 'hashes.json')
+        hashes = hashcache.HashCache(cache_path)
+
+        with mock.patch('boto.s3.key.Key'):
+            upload.do_upload(src, ['one/x', 'two/y'], False, None,
+                conn=conn, hashes=hashes)
+        hashes.save()
+
+        with open(cache_path) as fp:
+            entries = json.load(fp)['entries']
+        assert_equals(sorted(entries),
+            [os.path.join(src, 'a'), os.path.join(src, 'b')])
+        assert_equals(hashes.misses, 2)
+    finally:
+        shutil.rmtree(src)
+
+def test_upload_fanout_error():
+    '''
+    _upload_fanout: a failed upload is recorded, but not counted as uploaded.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        lpath = os.path.join(src, 'a')
+        with open(lpath, 'w') as fp:
+            fp.write('abc')
+        md5 = upload._compute_md5(lpath)
+        error = boto.exception.S3ResponseError(403, 'Forbidden')
+        keys = {'one': mock.Mock(), 'two': mock.Mock()}
+        keys['one'].set_contents_from_file.side_effect = error
+        progress = mock.Mock()
+        recorder = metrics.Metrics()
+        errors = {}
+
+        with mock.patch('boto.s3.key.Key',
+                side_effect=lambda bucket, rpath: keys[bucket]):
+            upload._upload_fanout(lpath, md5,
+                [('one', 'one', 'a'), ('two', 'two', 'a')],
+                progress, errors, recorder)
+
+        assert_equals(errors, {'one': error})
+        progress.finish_file.assert_called_once_with(lpath, 3)
+        assert_equals(recorder.counters,
+            {'files_uploaded': 1, 'bytes_uploaded': 3})
+    finally:
+        shutil.rmtree(src)
+
+def test_upload_fanout_retry():
+    '''
+    _upload_fanout: a throttled upload from a buffer is retried with the
+    whole file.
+    '''
+    src = tempfile.mkdtemp()
+    try:
+        lpath = os.path.join(src, 'a')
+        with open(lpath, 'w') as fp:
+            fp.write('abc')
+        bodies = []
+
+        def put(fp, rewind=False, **kwargs):
+            if rewind:
+                fp.seek(0)
+            bodies.append(fp.read())
+            if len(bodies) == 1:
+                raise boto.exception.S3ResponseError(503, 'Slow Down')
+        errors = {}
+
+        with mock.patch('boto.s3.key.Key') as mock_key:
+            mock_key.return_value.set_contents_from_file.side_effect = put
+            with mock.patch('time.sleep'):
+                upload._upload_fanout(lpath, upload._compute_md5(lpath),
+                    [('one', mock.Mock(), 'a')], mock.Mock(), errors)
+
+        assert_equals(errors, {})
+        assert_equals(bodies, [b'abc', b'abc'])
+    finally:
+        shutil.rmtree(src)
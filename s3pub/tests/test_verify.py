@@ -0,0 +1,90 @@
+'''
+Tests for s3pub.verify.
+'''
+
+from __future__ import absolute_import
+
+import random
+import threading
+
+import mock
+from nose.tools import assert_equals, raises
+
+from s3pub import verify, workers
+from s3pub.tests.helpers import FILES, key, md5, with_tree
+
+def test_compare():
+    expected = ('abc', 3, 'text/html')
+    cases = [
+        (('abc', 3, 'text/html'), None),
+        (('abc', 3, None), None),
+        (None, 'missing'),
+        (('abd', 4, 'text/html'), 'size 4 != 3, ETag abd != abc'),
+        (('abc-2', 3, 'text/html'), None),
+        (('abc', 3, 'text/plain'), 'Content-Type text/plain != text/html'),
+    ]
+    for found, problem in cases:
+        yield assert_equals, verify._compare(expected, found), problem
+
+@with_tree
+def test_verify_head(tmp):
+    '''
+    verify: requests each key's headers and reports the differences.
+    '''
+    keys = {
+        'www/index.html': key('www/index.html', b'<html>', 'text/html'),
+        'www/about/index.html': key(
+            'www/about/index.html', b'<html>about', 'text/plain'),
+        'www/css/site.css': key('www/css/site.css', b'body', 'text/css'),
+    }
+    bucket = mock.Mock()
+    bucket.get_key.side_effect = keys.get
+
+    checked, mismatches = verify.verify(
+        bucket, 'www', tmp, pool=workers.WorkerPool(2))
+
+    assert_equals(checked, 4)
+    assert_equals(mismatches, [
+        ('www/about/index.html', 'Content-Type text/plain != text/html'),
+        ('www/css/site.css', 'size 4 != 7, ETag {} != {}'.format(
+            md5(b'body'), md5(b'body {}'))),
+        ('www/img/logo.png', 'missing'),
+    ])
+    assert not bucket.list.called
+
+@with_tree
+def test_verify_list(tmp):
+    '''
+    verify: compares with a listing, reporting keys missing locally unless
+    nothing is deleted.
+    '''
+    bucket = mock.Mock()
+    bucket.list.return_value = [
+        key('www/' + name, data) for name, data in FILES.items()] + [
+        key('www/old.html', b'old')]
+
+    assert_equals(verify.verify(bucket, 'www', tmp, method='list'),
+        (4, [('www/old.html', 'not in the local tree')]))
+    assert_equals(
+        verify.verify(bucket, 'www', tmp, delete=False, method='list'),
+        (4, []))
+    assert not bucket.get_key.called
+
+@with_tree
+def test_verify_sample(tmp):
+    '''
+    verify: checks a random sample, without leaving worker threads behind.
+    '''
+    bucket = mock.Mock()
+    bucket.get_key.return_value = None
+    threads = threading.active_count()
+    checked, mismatches = verify.verify(
+        bucket, '', tmp, sample=2, rng=random.Random(0))
+    assert_equals(checked, 2)
+    assert_equals(bucket.get_key.call_count, 2)
+    assert_equals([problem for _, problem in mismatches], ['missing'] * 2)
+    assert_equals(threading.active_count(), threads)
+
+@raises(ValueError)
+def test_verify_method():
+    verify.verify(mock.Mock(), '', '.', method='get')
@@ -0,0 +1,85 @@
+'''
+Tests for s3pub.warm, against a local HTTP server.
+'''
+
+from __future__ import absolute_import
+
+import threading
+
+from nose.tools import assert_equals, assert_true
+from six.moves import BaseHTTPServer, socketserver
+
+from s3pub import warm
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *_):
+        pass
+
+    def _respond(self, body):
+        self.server.requests.append((self.command, self.path))
+        status = self.path == '/missing' and 404 or 200
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond(b'<html></html>')
+
+    do_HEAD = do_GET
+
+def _serve():
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def test_urls():
+    assert_equals(
+        warm.urls('https://cdn.example.com/', [
+            'a/index.html', 'a/', 'a', '', '/', 'b c/d~e.html']),
+        [
+            'https://cdn.example.com/a/index.html',
+            'https://cdn.example.com/a/',
+            'https://cdn.example.com/a',
+            'https://cdn.example.com/',
+            'https://cdn.example.com/b%20c/d~e.html',
+        ])
+
+def test_warm():
+    '''
+    warm: requests every URL, and reports the status of each.
+    '''
+    server = _serve()
+    try:
+        base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        urls = warm.urls(base, ['a.html', 'b/', 'missing'])
+        for method in warm.METHODS:
+            del server.requests[:]
+            results = warm.warm(urls, concurrency=2, method=method)
+            assert_equals(
+                [(url, status, error) for url, status, _, error in results],
+                [(urls[0], 200, None), (urls[1], 200, None),
+                    (urls[2], 404, None)])
+            assert_equals(sorted(server.requests), [
+                (method, '/a.html'), (method, '/b/'), (method, '/missing')])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_warm_unreachable():
+    server = _serve()
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    results = warm.warm(['http://127.0.0.1:{}/a'.format(port)])
+    assert_equals(results[0][1], None)
+    assert_true(results[0][3])
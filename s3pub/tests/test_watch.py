@@ -0,0 +1,109 @@
+'''
+Tests for s3pub.watch.
+'''
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+from nose.tools import assert_equals, assert_true
+
+from s3pub import watch
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class FakeWatcher(object):
+    '''
+    Returns queued change sets from 'poll', advancing the clock each time.
+    '''
+    def __init__(self, clock, batches):
+        self.clock = clock
+        self.batches = list(batches)
+
+    def poll(self, timeout):
+        self.clock.now += timeout
+        return self.batches and self.batches.pop(0) or set()
+
+def _daemon(**kwargs):
+    clock = FakeClock()
+    daemon = watch.Daemon(
+        'src', 'bucket/prefix', True, mock.sentinel.conn, mock.sentinel.pool,
+        debounce=1.0, clock=clock, **kwargs)
+    return daemon, clock
+
+def test_debounce():
+    '''
+    Daemon: publishes a burst of changes once it settles.
+    '''
+    daemon, clock = _daemon()
+    watcher = FakeWatcher(clock, [set(), set(['a']), set(['b']), set(), set()])
+    with mock.patch('s3pub.upload.do_upload', return_value=[]) as do_upload:
+        daemon.step(watcher)
+        # the first step always compares the whole tree
+        assert_equals(do_upload.call_args[1]['changes'], None)
+        do_upload.reset_mock()
+        for _ in range(3):
+            daemon.step(watcher)
+        assert_equals(do_upload.call_count, 0)
+        daemon.step(watcher)
+    assert_equals(do_upload.call_count, 1)
+    assert_equals(do_upload.call_args[1]['changes'], set(['a', 'b']))
+    assert_equals(daemon.pending, set())
+
+def test_failed_publish_is_retried():
+    daemon, clock = _daemon()
+    daemon.last_reconcile = clock.now
+    daemon.add_changes(set(['a']))
+    with mock.patch('s3pub.upload.do_upload', side_effect=IOError('boom')):
+        daemon.publish()
+    assert_equals(daemon.pending, set(['a']))
+    assert_equals(daemon.status['errors'], 1)
+    clock.now += 5
+    assert_true(not daemon.publish_due(clock.now))
+    clock.now += watch.RETRY_DELAY
+    assert_true(daemon.publish_due(clock.now))
+
+def test_invalidations_are_batched():
+    '''
+    Daemon: invalidations are collected and sent at most once per interval.
+    '''
+    daemon, clock = _daemon(
+        cf_conn=mock.sentinel.cf, distrib_id='D', invalidate_interval=60)
+    daemon.last_reconcile = clock.now
+    with mock.patch('s3pub.invalidate.submit') as submit:
+        for keys in [['a'], ['b', 'a']]:
+            daemon.add_changes(set(keys))
+            with mock.patch('s3pub.upload.do_upload', return_value=keys):
+                daemon.publish()
+            daemon.invalidate()
+            clock.now += 10
+        assert_equals(submit.call_count, 1)
+        assert_equals(submit.call_args[0][2], ['a'])
+        clock.now += 60
+        daemon.invalidate()
+    assert_equals(submit.call_count, 2)
+    assert_equals(submit.call_args[0][2], ['a', 'b'])
+    assert_equals(daemon.pending_inval, set())
+
+def test_status_file():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'status.json')
+        daemon, clock = _daemon(status_path=path)
+        daemon.add_changes(set(['a', 'b']))
+        daemon.write_status()
+        with open(path) as fp:
+            status = json.load(fp)
+        assert_equals(status['queue_depth'], 2)
+        assert_equals(os.listdir(tmpdir), ['status.json'])
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+'''
+Tests for s3pub.workers.
+'''
+
+from __future__ import absolute_import
+
+import threading
+
+from nose.tools import assert_equals, assert_true, raises
+
+from s3pub import workers
+
+def test_map():
+    '''
+    WorkerPool.map: returns results in input order, using several threads.
+    '''
+    pool = workers.WorkerPool(3)
+    seen = set()
+    def double(num):
+        seen.add(threading.current_thread().name)
+        return num * 2
+    assert_equals(pool.map(double, range(20)), list(range(0, 40, 2)))
+    assert_true(threading.current_thread().name not in seen)
+    pool.close()
+
+@raises(KeyError)
+def test_map_error():
+    '''
+    WorkerPool.map: re-raises errors from calls.
+    '''
+    workers.WorkerPool(2).map({}.__getitem__, ['missing'])
+
+@raises(ValueError)
+def test_invalid_size():
+    workers.WorkerPool(0)
+
+def test_default_pool():
+    '''
+    default_pool: passes a pool through, or closes the one it creates.
+    '''
+    pool = workers.WorkerPool(2)
+    with workers.default_pool(pool) as given:
+        assert_true(given is pool)
+        given.map(abs, [-1, -2])
+    assert_equals(len(pool._threads), 2)
+    pool.close()
+
+    try:
+        with workers.default_pool() as created:
+            created.map(abs, [-1, -2])
+            assert_true(created._threads)
+            raise KeyError()
+    except KeyError:
+        pass
+    assert_equals(created._threads, [])
@@ -5,31 +5,45 @@ import boto.s3.connection
 import boto.s3.key
 import boto.s3.bucket
 import functools
+import io
 import itertools
+import mimetypes
 import os.path
 import posixpath
-from six import iteritems, itervalues
+from six import iteritems, itervalues, string_types
 import sys
 
+import s3pub.archive
+import s3pub.hashcache
+import s3pub.lowmem
+import s3pub.manifest
+import s3pub.metrics
 import s3pub.progress
+import s3pub.retry
+import s3pub.schedule
+import s3pub.workers
 
-def _upload(bucket, local_path, remote_path, md5, pbar):
+def _upload(bucket, local_path, remote_path, md5, progress,
+        metrics=s3pub.metrics.NULL):
     '''
-    Upload a file to S3 if etags differ, or the remote doesn't exist.
-
-    Return True if the file was uploaded; false otherwise.
+    Upload a file to S3, reporting transfer status to 'progress'.
     '''
-    pbar.change_file(local_path)
+    progress.start_file(local_path)
     # begin upload
-    boto.s3.key.Key(bucket, remote_path).set_contents_from_filename(
-        local_path,
-        policy='public-read',
-        cb=functools.partial(_xfer_status, pbar),
-        md5=md5,
-    )
-
-def _xfer_status(pbar, done, _):
-    pbar.increment(done)
+    with metrics.timer('s3_put'):
+        s3pub.retry.call(
+            boto.s3.key.Key(bucket, remote_path).set_contents_from_filename,
+            (local_path, ),
+            dict(
+                policy='public-read',
+                cb=functools.partial(progress.update, local_path),
+                md5=md5,
+            ),
+            metrics=metrics,
+        )
+    progress.finish_file(local_path, md5[2])
+    metrics.incr('files_uploaded')
+    metrics.incr('bytes_uploaded', md5[2])
 
 def _remote_path(dest, local_path, src_root):
     '''
@@ -46,7 +60,44 @@ def _remote_path(dest, local_path, src_root):
     return (dest and dest + '/' or '') + \
         posixpath.relpath(local_path, src_root)
 
-def _todos(bucket, prefix, paths, check_removed=True):
+def _content_type(path):
+    '''
+    Return the Content-Type boto would give a key uploaded from 'path'; pass
+    it explicitly when uploading from a buffer, which has no name to guess it
+    from.
+    '''
+    return mimetypes.guess_type(path)[0] or \
+        boto.s3.key.Key.DefaultContentType
+
+def _compute_md5(lpath, hashes=None):
+    '''
+    Return boto's (hex_md5, base64_md5, filesize) tuple for a local file.
+
+    'hashes' is an optional HashCache to consult.
+    '''
+    if hashes is not None:
+        return hashes.md5(lpath)
+    with open(lpath, 'rb') as fp:
+        return boto.s3.key.compute_md5(fp)
+
+def _list(bucket, prefix, metrics=s3pub.metrics.NULL):
+    '''
+    Return a dict of key name -> (etag, size) for the keys under 'prefix'.
+
+    The manifest is left out.
+    '''
+    # iterating through the BucketListResultSet pages through the listing, so
+    # we do it only once.
+    manifest_name = s3pub.manifest.key_name(prefix)
+    with metrics.span('list') as span:
+        remote = dict(
+            (key.name, (key.etag.strip('"'), key.size))
+            for key in bucket.list(prefix) if key.name != manifest_name)
+        span.set('keys', len(remote))
+    return remote
+
+def _todos(bucket, prefix, paths, check_removed=True,
+        metrics=s3pub.metrics.NULL, hashes=None, remote=None):
     '''
     Return information about upcoming uploads and deletions.
 
@@ -58,45 +109,109 @@ def _todos(bucket, prefix, paths, check_removed=True):
 
     'delete' is a list of S3 keys that should be removed.  If 'check_removed'
     is False, this list will always be empty.
+
+    'remote' is the dict of keys under the prefix, as returned by _list or
+    read from the manifest; the bucket is listed if it isn't given.
     '''
-    # map rpath -> lpath; we use this to compare md5s for existing keys
-    rpath_map = dict((i[1], i[0]) for i in paths)
-    
-    # Iterate through the BucketListResultSet only once; we'll add elements to
-    # two containers and will return them at the end.
-    up = {}
-    delete = []
-
-    # Create a set of keys in S3 for comparison later
-    s3_keys = set()
-
-    # add entries for keys that have different contents
-    for key in bucket.list(prefix):
-        # Since we're already iterating through the result set, we'll save
-        # key names.
-        s3_keys.add(key.name)
-
-        if check_removed and key.name not in rpath_map:
-            # this key doesn't exist locally, schedule deletion
-            delete.append(key.name)
-            continue
-        
-        # file exists in both; compare md5s
-        lpath = rpath_map[key.name]
-        with open(lpath, 'rb') as fp:
-            md5 = boto.s3.key.compute_md5(fp)
-        if key.etag.strip('"') != md5[0].strip('"'):
-            up[lpath] = (md5, key.name)
+    if remote is None:
+        remote = _list(bucket, prefix, metrics)
+
+    with metrics.span('hash') as span:
+        md5s = dict(
+            (lpath, _compute_md5(lpath, hashes)) for lpath, _ in paths)
+        span.set('files', len(md5s))
+
+    with metrics.span('diff'):
+        # add entries for keys that are new or have different contents
+        up = {}
+        for lpath, rpath in paths:
+            md5 = md5s[lpath]
+            if remote.get(rpath, (None, ))[0] != md5[0].strip('"'):
+                up[lpath] = (md5, rpath)
+
+        delete = []
+        if check_removed:
+            # keys that don't exist locally are scheduled for deletion
+            local = set(rpath for _, rpath in paths)
+            delete = [rpath for rpath in remote if rpath not in local]
 
-    # schedule uploads for new keys
-    for rpath in set(i[1] for i in paths) - s3_keys:
-        lpath = rpath_map[rpath]
-        with open(lpath, 'rb') as fp:
-            md5 = boto.s3.key.compute_md5(fp)
-        up[lpath] = (md5, rpath)
-        
     return up, delete
 
+def _changed_todos(bucket, prefix, src, changes, check_removed=True,
+        metrics=s3pub.metrics.NULL, hashes=None):
+    '''
+    Return (upload, delete) like _todos, for a change set rather than a tree.
+
+    Changed files are uploaded without comparing them to S3, and the bucket
+    is only listed for directories that have been removed.
+    '''
+    paths = []
+    delete = set()
+    with metrics.span('scan') as span:
+        for rel in sorted(changes):
+            lpath = os.path.join(src, rel.rstrip('/'))
+            rpath = _remote_path(prefix, lpath, src)
+            if os.path.isdir(lpath):
+                paths.extend(_walk(src, prefix, lpath))
+            elif os.path.isfile(lpath):
+                paths.append((lpath, rpath))
+            elif check_removed and rel.endswith('/'):
+                with metrics.timer('s3_list'):
+                    delete.update(key.name for key in bucket.list(rpath + '/'))
+            elif check_removed:
+                delete.add(rpath)
+        span.set('files', len(paths))
+
+    with metrics.span('hash') as span:
+        up = dict(
+            (lpath, (_compute_md5(lpath, hashes), rpath))
+            for lpath, rpath in paths)
+        span.set('files', len(up))
+
+    return up, sorted(delete)
+
+def _plan(bucket, prefix, src, paths, changes, delete, metrics, hashes,
+        rebuild_manifest=False):
+    '''
+    Return (upload, delete, entries, fresh) for one destination.
+
+    'paths' are the (local, remote) paths of the whole tree, or None to
+    publish only 'changes'.  'entries' is the manifest to bring up to date
+    once the publish is done, or None if there is none to keep; 'fresh' is
+    True if it came from listing the bucket, and should be written even if
+    nothing changes.
+    '''
+    if paths is None:
+        entries = s3pub.manifest.load(bucket, prefix, metrics)
+        to_upload, to_delete = _changed_todos(
+            bucket, prefix, src, changes, delete, metrics, hashes)
+        return to_upload, to_delete, entries, False
+
+    entries = None
+    if not rebuild_manifest:
+        entries = s3pub.manifest.load(bucket, prefix, metrics)
+    fresh = entries is None
+    if fresh:
+        entries = _list(bucket, prefix, metrics)
+    to_upload, to_delete = _todos(
+        bucket, prefix, paths, delete, metrics, hashes, entries)
+    return to_upload, to_delete, entries, fresh
+
+def _iwalk(src, prefix, top=None):
+    '''
+    Yield (local, remote) path tuples for files under 'top'.
+    '''
+    for root, _, files in os.walk(top or src):
+        for filename in files:
+            lpath = os.path.join(root, filename)
+            yield lpath, _remote_path(prefix, lpath, src)
+
+def _walk(src, prefix, top=None):
+    '''
+    Return a list of (local, remote) path tuples for files under 'top'.
+    '''
+    return list(_iwalk(src, prefix, top))
+
 def _split_dest(dest):
     '''
     Split apart the bucket name and key prefix for uploads.
@@ -110,51 +225,55 @@ def _split_dest(dest):
         return (dest, u'')
     return (dest[:idx], dest[idx+1:])
 
-def _get_index_doc(bucket):
+def _get_index_doc(bucket, metrics=s3pub.metrics.NULL):
     '''
     Return the configured index document name for the bucket.
     '''
     try:
-        conf = bucket.get_website_configuration()
+        with metrics.timer('s3_get_website'):
+            conf = bucket.get_website_configuration()
     except boto.exception.S3ResponseError:
         return
 
     return conf['WebsiteConfiguration']['IndexDocument']['Suffix']
 
-def do_upload(src, dst, delete, creds):
+def connect(creds):
     '''
-    Upload and delete files as necessary to synchronize S3.
+    Return a new S3Connection using the given Credentials.
+    '''
+    return boto.s3.connection.S3Connection(**creds.as_dict())
 
-    Return a list of remote keys modified.
+def _delete_keys(bucket, keys, metrics=s3pub.metrics.NULL):
+    '''
+    Remove keys from a bucket, reporting any that couldn't be removed.
     '''
-    conn = boto.s3.connection.S3Connection(**creds.as_dict())
-    # split bucket name from key prefix
-    bucket_name, prefix = _split_dest(dst)
-    bucket = conn.get_bucket(bucket_name)
+    with metrics.timer('s3_delete'):
+        mdr = s3pub.retry.call(bucket.delete_keys, (keys, ), metrics=metrics)
+    if mdr.errors:
+        sys.stderr.write(
+            'ERROR: problems were encountered trying to remove the '
+                'following objects.\n')
+        for e in mdr.errors:
+            sys.stderr.write(u'  {} - {} - {}\n'.format(
+                e.key, e.code, e.message))
+        raise Exception('Errors reported by S3')
 
-    # paths is a list of tuples: (local, remote)
-    paths = []
-    for root, _, files in os.walk(src):
-        for filename in files:
-            lpath = os.path.join(root, filename)
-            paths.append((lpath, _remote_path(prefix, lpath, src)))
-    
-    to_upload, to_delete = _todos(bucket, prefix, paths, delete)
+def _finish(bucket, prefix, to_upload, to_delete, delete, indexname,
+        metrics=s3pub.metrics.NULL, entries=None, fresh=False):
+    '''
+    Remove deleted keys from a destination once uploads are done, then
+    record the result in its manifest.
 
+    'indexname' is the bucket's index document, from _get_index_doc.  Return
+    the paths to invalidate.
+    '''
     if not to_upload and not to_delete:
+        if fresh:
+            s3pub.manifest.save(bucket, prefix, entries, metrics)
         return []
-    
-    inval_paths = []
-    if to_upload: 
-        # do upload
-        pbar = s3pub.progress.UploadProgressBar(
-            dict((lpath, info[2]) for lpath, (info, _) in iteritems(to_upload)))
-        for lpath, (md5, rpath) in iteritems(to_upload):
-            _upload(bucket, lpath, rpath, md5, pbar)
-            inval_paths.append(rpath)
-        pbar.finish()
-
-    indexname = _get_index_doc(bucket)
+
+    inval_paths = [rpath for _, rpath in itervalues(to_upload)]
+
     if indexname:
         inval_paths.extend(
             itertools.chain.from_iterable(
@@ -167,15 +286,288 @@ def do_upload(src, dst, delete, creds):
 
     if delete and to_delete:
         # do deletion
-        mdr = bucket.delete_keys(to_delete)
-        if mdr.errors:
-            sys.stderr.write(
-                'ERROR: problems were encountered trying to remove the '
-                    'following objects.\n')
-            for e in mdr.errors:
-                sys.stderr.write(u'  {} - {} - {}\n'.format(
-                    e.key, e.code, e.message))
-            raise Exception('Errors reported by S3')
+        with metrics.span('delete', keys=len(to_delete)):
+            _delete_keys(bucket, to_delete, metrics)
         inval_paths.extend(to_delete)
 
+    if entries is not None:
+        for rpath in to_delete:
+            entries.pop(rpath, None)
+        for md5, rpath in itervalues(to_upload):
+            entries[rpath] = (md5[0].strip('"'), md5[2])
+        s3pub.manifest.save(bucket, prefix, entries, metrics)
+
     return inval_paths
+
+class FanoutError(Exception):
+    '''
+    Raised when publishing failed for some of several destinations.
+
+    'results' maps each destination that succeeded to its invalidation list;
+    'errors' maps each that failed to its exception.
+    '''
+    def __init__(self, results, errors):
+        super(FanoutError, self).__init__(
+            u'Publishing failed for: {}'.format(u', '.join(sorted(errors))))
+        self.results = results
+        self.errors = errors
+
+# files up to this size are read once into memory and sent from there to
+# every destination; larger ones are read from disk for each
+FANOUT_BUFFER = 8 * 1024 * 1024
+
+def _upload_phases(pool, func, items, phases, indexnames):
+    '''
+    Call func on each of 'items', (name, size, item) tuples, on the pool, one
+    phase at a time (see s3pub.schedule).
+
+    'indexnames' are the index documents of the destinations involved; they
+    are uploaded last.
+    '''
+    is_index = lambda name: posixpath.basename(name) in indexnames
+    for phase in s3pub.schedule.phases(items, phases, is_index):
+        pool.map(func, phase)
+
+def _upload_fanout(lpath, md5, targets, progress, errors,
+        metrics=s3pub.metrics.NULL):
+    '''
+    Upload one local file to several (dest, bucket, remote_path) targets.
+
+    Failures are recorded in 'errors', keyed on dest, rather than raised.
+    '''
+    data = None
+    if md5[2] <= FANOUT_BUFFER:
+        with open(lpath, 'rb') as fp:
+            data = fp.read()
+        content_type = _content_type(lpath)
+    for dest, bucket, rpath in targets:
+        if dest in errors:
+            continue
+        progress.start_file(lpath)
+        key = boto.s3.key.Key(bucket, rpath)
+        kwargs = dict(
+            policy='public-read',
+            cb=functools.partial(progress.update, lpath),
+            md5=md5,
+        )
+        try:
+            with metrics.timer('s3_put'):
+                if data is None:
+                    s3pub.retry.call(key.set_contents_from_filename,
+                        (lpath, ), kwargs, metrics=metrics)
+                else:
+                    kwargs['headers'] = {'Content-Type': content_type}
+                    # a retry must send the buffer from the start again
+                    kwargs['rewind'] = True
+                    s3pub.retry.call(key.set_contents_from_file,
+                        (io.BytesIO(data), ), kwargs, metrics=metrics)
+        except Exception as exc:
+            errors.setdefault(dest, exc)
+            continue
+        progress.finish_file(lpath, md5[2])
+        metrics.incr('files_uploaded')
+        metrics.incr('bytes_uploaded', md5[2])
+
+def _do_fanout(src, dests, delete, conn, metrics, pool, changes, hashes,
+        rebuild_manifest, phases):
+    '''
+    Synchronize several destinations with one scan of the local tree.
+
+    Local files are listed and hashed once; each destination is then listed
+    and compared concurrently, and each changed file is read once for all the
+    destinations that need it.
+    '''
+    if hashes is None:
+        hashes = s3pub.hashcache.HashCache()
+    errors = {}
+
+    def guarded(func):
+        '''
+        Wrap func(dest, ...) to record its errors instead of raising them.
+        '''
+        def wrapped(args):
+            try:
+                return func(*args)
+            except Exception as exc:
+                errors.setdefault(args[0], exc)
+        return wrapped
+
+    def get_bucket(dest):
+        bucket_name, prefix = _split_dest(dest)
+        return conn.get_bucket(bucket_name), prefix
+    targets = dict(zip(dests, pool.map(
+        guarded(get_bucket), [(dest, ) for dest in dests])))
+
+    full = changes is None or '' in changes
+    if full:
+        with metrics.span('scan') as span:
+            relpaths = _walk(src, '')
+            span.set('files', len(relpaths))
+        with metrics.span('hash') as span:
+            pool.map(hashes.md5, [lpath for lpath, _ in relpaths])
+            span.set('files', len(relpaths))
+
+    def plan(dest):
+        bucket, prefix = targets[dest]
+        paths = None
+        if full:
+            base = prefix.rstrip('/') and prefix.rstrip('/') + '/'
+            paths = [(lpath, base + rel) for lpath, rel in relpaths]
+        todo = _plan(bucket, prefix, src, paths, changes, delete, metrics,
+            hashes, rebuild_manifest)
+        indexname = None
+        if todo[0] or todo[1]:
+            indexname = _get_index_doc(bucket, metrics)
+            s3pub.manifest.discard(bucket, prefix, metrics)
+        return todo + (indexname, )
+    planned = [dest for dest in dests if dest not in errors]
+    todos = dict(zip(planned, pool.map(
+        guarded(plan), [(dest, ) for dest in planned])))
+
+    # lpath -> (md5, [(dest, bucket, rpath), ...])
+    jobs = {}
+    for dest, todo in iteritems(todos):
+        if todo is None:
+            continue
+        for lpath, (md5, rpath) in iteritems(todo[0]):
+            jobs.setdefault(lpath, (md5, []))[1].append(
+                (dest, targets[dest][0], rpath))
+    if jobs:
+        with metrics.span('upload', files=len(jobs)):
+            progress = s3pub.progress.UploadProgress(
+                sum(len(dest_list) for _, dest_list in itervalues(jobs)),
+                sum(md5[2] * len(dest_list)
+                    for md5, dest_list in itervalues(jobs)),
+            )
+            _upload_phases(
+                pool,
+                lambda item: _upload_fanout(
+                    item[0], item[1][0], item[1][1], progress, errors,
+                    metrics),
+                [(dest_list[0][2], md5[2], (lpath, (md5, dest_list)))
+                    for lpath, (md5, dest_list) in iteritems(jobs)],
+                phases,
+                set(todo[4] for todo in itervalues(todos) if todo),
+            )
+            progress.finish()
+
+    results = {}
+    finishing = [dest for dest in dests if dest not in errors]
+    for dest, inval_paths in zip(finishing, pool.map(
+            guarded(lambda dest: _finish(
+                targets[dest][0], targets[dest][1], todos[dest][0],
+                todos[dest][1], delete, todos[dest][4], metrics,
+                todos[dest][2], todos[dest][3])),
+            [(dest, ) for dest in finishing])):
+        if dest not in errors:
+            results[dest] = inval_paths
+
+    if errors:
+        for dest, exc in sorted(iteritems(errors)):
+            sys.stderr.write(u'ERROR: publishing to {} failed: {}\n'.format(
+                dest, exc))
+        raise FanoutError(results, errors)
+    return results
+
+def do_upload(src, dst, delete, creds, metrics=s3pub.metrics.NULL,
+        pool=None, conn=None, changes=None, hashes=None,
+        rebuild_manifest=False, phases=s3pub.schedule.DEFAULT_PHASES,
+        low_memory=False):
+    '''
+    Upload and delete files as necessary to synchronize S3.
+
+    Uploads run concurrently on 'pool', a WorkerPool; if it isn't given, one
+    is created and closed afterwards.  'conn' is an S3Connection to reuse; if omitted, one is
+    opened using 'creds'.
+
+    If 'changes' is given, it is a change set (see s3pub.changes) and only
+    those paths are published; the rest of the tree and bucket are assumed
+    to be in sync already.  'hashes' is a HashCache to reuse digests of
+    files that haven't changed since an earlier run.
+
+    Each destination keeps a manifest of its keys (see s3pub.manifest),
+    which is used instead of listing the bucket when it can be trusted.  If
+    'rebuild_manifest' is True, the bucket is listed regardless.
+
+    Files are uploaded in 'phases', largest first within each, and index
+    documents last; see s3pub.schedule.
+
+    'src' may also be a tar or zip archive, or '-' for a tar stream on stdin,
+    which is published without being extracted; see s3pub.archive.
+
+    If 'low_memory' is True, the tree and the listing of the bucket are
+    compared on disk rather than in memory, for trees of millions of files;
+    see s3pub.lowmem.  The manifest isn't used then.
+
+    Return a list of remote keys modified.
+
+    'dst' may also be a list of destinations, which are all synchronized from
+    a single scan of 'src'.  In that case, return a dict mapping each
+    destination to its list of modified keys; if any destination fails, the
+    others are still completed and a FanoutError is raised.
+    '''
+    conn = conn or connect(creds)
+    with s3pub.workers.default_pool(pool) as pool:
+        if s3pub.archive.is_archive(src):
+            if not isinstance(dst, string_types) or changes is not None:
+                raise ValueError(
+                    'archives are published to one destination, as a whole')
+            bucket_name, prefix = _split_dest(dst)
+            return s3pub.archive.publish(
+                src, conn.get_bucket(bucket_name), prefix, delete, metrics,
+                pool, rebuild_manifest, phases)
+        if low_memory:
+            if not isinstance(dst, string_types) or changes is not None:
+                raise ValueError(
+                    'low-memory publishing takes one destination and the '
+                    'whole tree')
+            bucket_name, prefix = _split_dest(dst)
+            return s3pub.lowmem.publish(
+                src, conn.get_bucket(bucket_name), prefix, delete, metrics,
+                pool, phases, hashes)
+        if not isinstance(dst, string_types):
+            return _do_fanout(
+                src, dst, delete, conn, metrics, pool, changes, hashes,
+                rebuild_manifest, phases)
+
+        # split bucket name from key prefix
+        bucket_name, prefix = _split_dest(dst)
+        bucket = conn.get_bucket(bucket_name)
+
+        paths = None
+        if changes is None or '' in changes:
+            # paths is a list of tuples: (local, remote)
+            with metrics.span('scan') as span:
+                paths = _walk(src, prefix)
+                span.set('files', len(paths))
+        to_upload, to_delete, entries, fresh = _plan(
+            bucket, prefix, src, paths, changes, delete, metrics, hashes,
+            rebuild_manifest)
+
+        indexname = None
+        if to_upload or to_delete:
+            indexname = _get_index_doc(bucket, metrics)
+            # an interrupted publish must not leave a manifest behind
+            s3pub.manifest.discard(bucket, prefix, metrics)
+
+        if to_upload: 
+            # do upload
+            with metrics.span('upload', files=len(to_upload)):
+                progress = s3pub.progress.UploadProgress(
+                    len(to_upload),
+                    sum(info[2] for info, _ in itervalues(to_upload)),
+                )
+                _upload_phases(
+                    pool,
+                    lambda item: _upload(
+                        bucket, item[0], item[1][1], item[1][0], progress,
+                        metrics),
+                    [(rpath, md5[2], (lpath, (md5, rpath)))
+                        for lpath, (md5, rpath) in iteritems(to_upload)],
+                    phases,
+                    set([indexname]),
+                )
+                progress.finish()
+
+        return _finish(bucket, prefix, to_upload, to_delete, delete, indexname,
+            metrics, entries, fresh)
@@ -0,0 +1,106 @@
+'''
+Verification that S3 matches the local tree after a publish.
+
+Each local file's MD5, size and expected Content-Type are compared with its
+key, either by requesting the key's headers (HEAD, one request per key, run
+concurrently on a WorkerPool) or from a fresh listing of the prefix, which
+takes a request per thousand keys but doesn't include Content-Types.  Very
+large trees can be checked on a random sample of files.
+'''
+
+from __future__ import absolute_import
+
+import random
+
+import s3pub.metrics
+import s3pub.retry
+import s3pub.upload
+import s3pub.workers
+
+METHODS = ('head', 'list')
+
+def _expected(lpath, hashes=None):
+    '''
+    Return (hex_md5, size, content_type) for the key a local file was
+    uploaded to.
+    '''
+    md5 = s3pub.upload._compute_md5(lpath, hashes)
+    return md5[0].strip('"'), md5[2], s3pub.upload._content_type(lpath)
+
+def _head(bucket, rpath, metrics=s3pub.metrics.NULL):
+    '''
+    Return (etag, size, content_type) for a key, or None if it doesn't exist.
+    '''
+    with metrics.timer('s3_head'):
+        key = s3pub.retry.call(bucket.get_key, (rpath, ), metrics=metrics)
+    return key and (key.etag.strip('"'), key.size, key.content_type)
+
+def _compare(expected, found):
+    '''
+    Return a description of how 'found', a key's (etag, size, content_type),
+    differs from 'expected', or None if it doesn't.
+
+    A content_type of None in 'found' isn't checked.
+    '''
+    if found is None:
+        return 'missing'
+    etag, size, content_type = expected
+    problems = []
+    if found[1] != size:
+        problems.append(u'size {} != {}'.format(found[1], size))
+    # the ETag of a multipart upload isn't the MD5 of the contents
+    if found[0] != etag and '-' not in found[0]:
+        problems.append(u'ETag {} != {}'.format(found[0], etag))
+    if found[2] is not None and found[2] != content_type:
+        problems.append(
+            u'Content-Type {} != {}'.format(found[2], content_type))
+    return problems and u', '.join(problems) or None
+
+def verify(bucket, prefix, src, delete=True, method='head', sample=None,
+        pool=None, hashes=None, metrics=s3pub.metrics.NULL, rng=random):
+    '''
+    Compare the keys under 'prefix' in 'bucket' with the local tree 'src'.
+
+    'method' is 'head' to request each key's headers concurrently on 'pool',
+    or 'list' to list the prefix.  If 'sample' is given, only that many local
+    files, picked at random, are checked.  When listing and 'delete' is True,
+    keys that don't exist locally are reported too.  'hashes' is a HashCache,
+    such as the one used for the publish, so files aren't read again.
+
+    Return (number of files checked, sorted list of (key, problem)).
+    '''
+    if method not in METHODS:
+        raise ValueError(u'unknown verification method: {}'.format(method))
+    with s3pub.workers.default_pool(pool) as pool, \
+            metrics.span('verify', method=method) as span:
+        paths = s3pub.upload._walk(src, prefix)
+        checked = paths
+        if sample is not None and sample < len(paths):
+            checked = rng.sample(paths, sample)
+
+        remote = None
+        if method == 'list':
+            remote = dict(
+                (rpath, (etag, size, None)) for rpath, (etag, size) in
+                    s3pub.upload._list(bucket, prefix, metrics).items())
+
+        def check(item):
+            lpath, rpath = item
+            if remote is None:
+                found = _head(bucket, rpath, metrics)
+            else:
+                found = remote.get(rpath)
+            return rpath, _compare(_expected(lpath, hashes), found)
+        mismatches = [
+            (rpath, problem) for rpath, problem in pool.map(check, checked)
+            if problem]
+
+        if remote is not None and delete:
+            local = set(rpath for _, rpath in paths)
+            mismatches.extend(
+                (rpath, 'not in the local tree')
+                for rpath in remote if rpath not in local)
+        span.set('keys', len(checked))
+        span.set('mismatches', len(mismatches))
+    metrics.incr('verify_mismatches', len(mismatches))
+    return len(checked), sorted(mismatches)
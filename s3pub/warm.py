@@ -0,0 +1,116 @@
+'''
+Warming of CDN caches after a publish.
+
+Once an invalidation completes, the first request for each changed page is
+fetched from the origin, so whoever makes it waits longer.  Requesting the
+changed URLs straight away takes that fetch off visitors, at least at the edge
+locations nearest to where s3pub runs.
+'''
+
+from __future__ import absolute_import
+
+import socket
+import threading
+import time
+
+from six.moves import http_client
+from six.moves.urllib.parse import quote, urlsplit
+
+import s3pub.metrics
+import s3pub.workers
+
+# request methods URLs can be warmed with
+METHODS = ('GET', 'HEAD')
+# URLs fetched at once
+DEFAULT_CONCURRENCY = 8
+# seconds to wait for each response
+DEFAULT_TIMEOUT = 10.0
+
+def urls(base_url, paths):
+    '''
+    Return the URLs under 'base_url' for key paths, such as those returned by
+    do_upload, without duplicates.
+    '''
+    base = base_url.rstrip('/') + '/'
+    seen = set()
+    result = []
+    for path in paths:
+        url = base + quote(path.lstrip('/').encode('utf-8'), safe='/~')
+        if url not in seen:
+            seen.add(url)
+            result.append(url)
+    return result
+
+class _Connections(threading.local):
+    '''
+    HTTP connections kept open by each worker thread, by scheme and host.
+    '''
+    def __init__(self, opened):
+        self.conns = {}
+        # every connection, across threads, so that they can be closed
+        self.opened = opened
+
+    def get(self, scheme, netloc, timeout):
+        conn = self.conns.get((scheme, netloc))
+        if conn is None:
+            cls = scheme == 'https' and http_client.HTTPSConnection or \
+                http_client.HTTPConnection
+            conn = cls(netloc, timeout=timeout)
+            self.conns[(scheme, netloc)] = conn
+            self.opened.append(conn)
+        return conn
+
+    def drop(self, scheme, netloc):
+        conn = self.conns.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+def _fetch(conns, url, method, timeout, metrics):
+    '''
+    Request 'url'; return (url, status, seconds, error).
+    '''
+    parts = urlsplit(url)
+    path = (parts.path or '/') + (parts.query and '?' + parts.query or '')
+    start = time.time()
+    # a kept-alive connection may have been closed by the server; try once
+    # more on a new one
+    for attempt in range(2):
+        reused = (parts.scheme, parts.netloc) in conns.conns
+        conn = conns.get(parts.scheme, parts.netloc, timeout)
+        try:
+            conn.request(method, path, headers={'User-Agent': 's3pub'})
+            resp = conn.getresponse()
+            resp.read()
+        except (socket.error, http_client.HTTPException) as exc:
+            conns.drop(parts.scheme, parts.netloc)
+            if reused and attempt == 0:
+                continue
+            metrics.incr('warm_errors')
+            return url, None, time.time() - start, str(exc) or repr(exc)
+        break
+    elapsed = time.time() - start
+    metrics.observe('warm_' + method.lower(), elapsed)
+    return url, resp.status, elapsed, None
+
+def warm(urls, concurrency=DEFAULT_CONCURRENCY, method='GET',
+        timeout=DEFAULT_TIMEOUT, metrics=s3pub.metrics.NULL):
+    '''
+    Request each of 'urls', 'concurrency' at a time, reusing connections.
+
+    Return a list of (url, status, seconds, error) in the order of 'urls':
+    'status' is None and 'error' describes the failure if no response was
+    received.  HEAD requests are cheaper, but CloudFront may then cache only
+    the headers.
+    '''
+    opened = []
+    conns = _Connections(opened)
+    pool = s3pub.workers.WorkerPool(concurrency)
+    try:
+        with metrics.span('warm', urls=len(urls), method=method):
+            return pool.map(
+                lambda url: _fetch(conns, url, method, timeout, metrics),
+                urls)
+    finally:
+        pool.close()
+        for conn in opened:
+            conn.close()
@@ -0,0 +1,223 @@
+'''
+A resident process that publishes changes as they are made.
+'''
+
+from __future__ import absolute_import, print_function
+
+import os
+import os.path
+import sys
+import time
+
+import s3pub.changes
+import s3pub.hashcache
+import s3pub.invalidate
+import s3pub.jsonfile
+import s3pub.metrics
+import s3pub.schedule
+import s3pub.upload
+
+# seconds without further changes before a burst of changes is published
+DEFAULT_DEBOUNCE = 2.0
+# a steady stream of changes is published at least this often, in seconds
+MAX_DELAY = 30.0
+# seconds between invalidation requests
+DEFAULT_INVALIDATE_INTERVAL = 60.0
+# seconds to wait before retrying a failed publish
+RETRY_DELAY = 10.0
+
+def _log(message):
+    sys.stderr.write('{} {}\n'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S'), message))
+
+class Daemon(object):
+    '''
+    Watch 'src' and publish changes to 'dest' until interrupted.
+
+    A full comparison against a listing of the bucket is done at startup and
+    every 'reconcile_interval' seconds, if given; in between, only the paths
+    reported by the watcher are published.  Connections, worker threads and
+    local digests are kept for the life of the process.  Invalidations are
+    sent to 'distrib_id', if given, at most once every 'invalidate_interval'
+    seconds, without waiting for them to complete.
+    '''
+    def __init__(self, src, dest, delete, conn, pool, cf_conn=None,
+            distrib_id=None, debounce=DEFAULT_DEBOUNCE,
+            invalidate_interval=DEFAULT_INVALIDATE_INTERVAL,
+            reconcile_interval=None, status_path=None,
+            metrics=s3pub.metrics.NULL, after_publish=None,
+            clock=time.time, phases=s3pub.schedule.DEFAULT_PHASES,
+            hashes=None):
+        self.src = src
+        self.dest = dest
+        self.delete = delete
+        self.conn = conn
+        self.pool = pool
+        self.cf_conn = cf_conn
+        self.distrib_id = distrib_id
+        self.debounce = debounce
+        self.invalidate_interval = invalidate_interval
+        self.reconcile_interval = reconcile_interval
+        self.status_path = status_path
+        self.metrics = metrics
+        self.after_publish = after_publish
+        self.clock = clock
+        self.phases = phases
+        if hashes is None:
+            hashes = s3pub.hashcache.HashCache()
+        self.hashes = hashes
+
+        # paths changed since the last publish, and when they started piling up
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+        self.pending_inval = set()
+        self.last_inval = 0
+        self.last_reconcile = None
+        self.retry_at = 0
+        self.status = {
+            'pid': os.getpid(),
+            'state': 'starting',
+            'publishes': 0,
+            'errors': 0,
+            'invalidations': 0,
+            'last_publish': None,
+            'last_error': None,
+        }
+
+    def add_changes(self, changes):
+        '''
+        Queue paths reported by a watcher.
+        '''
+        if not changes:
+            return
+        now = self.clock()
+        if not self.pending:
+            self.first_change = now
+        self.last_change = now
+        self.pending |= changes
+
+    def publish_due(self, now):
+        '''
+        Return True if queued changes should be published now.
+        '''
+        if not self.pending or now < self.retry_at:
+            return False
+        return now - self.last_change >= self.debounce or \
+            now - self.first_change >= MAX_DELAY
+
+    def reconcile_due(self, now):
+        '''
+        Return True if the whole tree should be compared with S3 now.
+        '''
+        if now < self.retry_at:
+            return False
+        if self.last_reconcile is None:
+            return True
+        return self.reconcile_interval is not None and \
+            now - self.last_reconcile >= self.reconcile_interval
+
+    def publish(self, full=False):
+        '''
+        Publish queued changes, or the whole tree if 'full' is True.
+        '''
+        changes, self.pending = self.pending, set()
+        self.status['state'] = 'publishing'
+        self.write_status()
+        start = self.clock()
+        try:
+            keys = s3pub.upload.do_upload(
+                self.src, self.dest, self.delete, None, self.metrics,
+                self.pool, self.conn, changes=None if full else changes,
+                hashes=self.hashes, rebuild_manifest=full,
+                phases=self.phases)
+        except Exception as exc:
+            # keep the changes for the next attempt
+            self.pending |= changes
+            if full:
+                self.pending.add('')
+            self.first_change = self.last_change = start
+            self.retry_at = start + RETRY_DELAY
+            self.status['errors'] += 1
+            self.status['last_error'] = {'time': start, 'message': str(exc)}
+            _log('publish failed: {}'.format(exc))
+        else:
+            elapsed = self.clock() - start
+            if full:
+                self.last_reconcile = start
+            self.pending_inval.update(keys)
+            self.status['publishes'] += 1
+            self.status['last_publish'] = {
+                'time': start,
+                'seconds': elapsed,
+                'full': full,
+                'keys': len(keys),
+            }
+            _log('published {} keys in {:.2f}s{}'.format(
+                len(keys), elapsed, full and ' (full)' or ''))
+        self.status['state'] = 'idle'
+        if self.after_publish:
+            self.after_publish()
+
+    def invalidate(self, force=False):
+        '''
+        Send pending invalidations if the interval has passed, or 'force'.
+        '''
+        now = self.clock()
+        due = force or now - self.last_inval >= self.invalidate_interval
+        if not self.distrib_id or not self.pending_inval or not due:
+            return
+        keys = sorted(self.pending_inval)
+        try:
+            req = s3pub.invalidate.submit(
+                self.cf_conn, self.distrib_id, keys, self.metrics)
+        except Exception as exc:
+            self.status['errors'] += 1
+            self.status['last_error'] = {'time': now, 'message': str(exc)}
+            _log('invalidation failed: {}'.format(exc))
+        else:
+            self.pending_inval.difference_update(keys)
+            self.status['invalidations'] += 1
+            _log('invalidation {} sent for {} paths'.format(req.id, len(keys)))
+        self.last_inval = now
+
+    def write_status(self):
+        if not self.status_path:
+            return
+        self.status['queue_depth'] = len(self.pending)
+        self.status['pending_invalidations'] = len(self.pending_inval)
+        self.status['updated'] = self.clock()
+        s3pub.jsonfile.write_json_atomic(self.status_path, self.status)
+
+    def step(self, watcher):
+        '''
+        Wait briefly for changes, then do whatever work is due.
+        '''
+        self.add_changes(watcher.poll(self.debounce / 2))
+        now = self.clock()
+        if ('' in self.pending and now >= self.retry_at) or \
+                self.reconcile_due(now):
+            # the watcher lost track, or it's time to look for drift
+            self.pending.discard('')
+            self.publish(full=True)
+        elif self.publish_due(now):
+            self.publish()
+        self.invalidate()
+        self.write_status()
+
+    def run(self):
+        watcher = s3pub.changes.make_watcher(self.src)
+        try:
+            _log('watching {} ({})'.format(
+                self.src, type(watcher).__name__))
+            while True:
+                self.step(watcher)
+        except KeyboardInterrupt:
+            _log('stopping')
+        finally:
+            watcher.close()
+        if self.pending:
+            self.publish()
+        self.invalidate(force=True)
+        self.status['state'] = 'stopped'
+        self.write_status()
@@ -0,0 +1,117 @@
+'''
+A small pool of threads for running S3 requests concurrently.
+'''
+
+from __future__ import absolute_import
+
+import contextlib
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+DEFAULT_WORKERS = 4
+
+class Task(object):
+    '''
+    The pending result of a callable submitted to a WorkerPool.
+    '''
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self._done = threading.Event()
+        self._value = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._value = self.func(*self.args)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def result(self):
+        '''
+        Wait for the task to complete; return its value or raise its error.
+        '''
+        self._done.wait()
+        if self._exc_info:
+            six.reraise(*self._exc_info)
+        return self._value
+
+class WorkerPool(object):
+    '''
+    A fixed number of daemon threads executing submitted tasks in order.
+
+    Threads are started on first use, so an idle pool costs nothing.
+    '''
+    def __init__(self, size=DEFAULT_WORKERS):
+        if size < 1:
+            raise ValueError('invalid worker count: {}'.format(size))
+        self.size = size
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            task.run()
+
+    def submit(self, func, *args):
+        '''
+        Schedule func(*args) on a worker thread and return its Task.
+        '''
+        if len(self._threads) < self.size:
+            self._start()
+        task = Task(func, args)
+        self._queue.put(task)
+        return task
+
+    def map(self, func, items):
+        '''
+        Call func on each item concurrently; return the results in order.
+
+        Waits for every call to finish; the first error raised by any call is
+        re-raised afterwards.
+        '''
+        tasks = [self.submit(func, item) for item in items]
+        for task in tasks:
+            task._done.wait()
+        return [task.result() for task in tasks]
+
+    def close(self):
+        '''
+        Stop the worker threads once queued tasks are complete.
+        '''
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+@contextlib.contextmanager
+def default_pool(pool=None):
+    '''
+    Yield 'pool', or if it is None, a new WorkerPool that is closed on
+    leaving, so library calls made without a pool don't leave threads behind.
+    '''
+    if pool is not None:
+        yield pool
+        return
+    pool = WorkerPool()
+    try:
+        yield pool
+    finally:
+        pool.close()